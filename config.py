@@ -20,4 +20,31 @@ with open("config.json", "r", encoding="utf-8") as f:
 
 BOT_TOKEN = config["bot_token"]
 ALLOWED_USERS = config["allowed_users"]
-ALLOWED_GROUPS = config["allowed_groups"]
\ No newline at end of file
+ALLOWED_GROUPS = config["allowed_groups"]
+
+# Пул HTTP-соединений к микротикам (необязательная секция config.json)
+ROUTER_POOL = config.get("router_pool", {})
+
+# Время жизни снимков таблиц микротика (секреты, активные сессии, пиры WG), секунды
+SNAPSHOT_TTL = config.get("snapshot_ttl", 15)
+
+# Пул для рендеринга QR-кодов и конфигураций: executor - "thread" (по умолчанию) или "process"
+RENDER_POOL = config.get("render_pool", {})
+
+# Хранилище микротиков, администраторов и выбранных микротиков:
+# {"backend": "json"} (файлы в data/) или {"backend": "sqlite", "sqlite_path": "data/bot.db"}
+STORAGE = config.get("storage", {"backend": "json"})
+
+# Хранилище состояний FSM (незавершенных диалогов): "sqlite" (по умолчанию), "redis" или "memory"
+FSM_STORAGE = config.get("fsm_storage", {"backend": "sqlite"})
+
+# Встроенный HTTP-сервер (/health) и режим вебхука вместо long polling
+WEB_SERVER = config.get("web_server", {})
+WEBHOOK = config.get("webhook", {})
+
+# Сторожевой поток цикла событий: блокировки дольше threshold секунд пишутся в лог со стеком
+WATCHDOG = config.get("watchdog", {"enabled": True, "threshold": 0.5})
+
+# Трассировка обновлений: сколько самых медленных трассировок хранить для /traces
+# и порог длительности (секунды), ниже которого трассировка не сохраняется
+TRACING = config.get("tracing", {"slowest": 20, "min_duration": 0.1})
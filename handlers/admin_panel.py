@@ -3,15 +3,16 @@ from aiogram.filters import Command
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import json
 import logging
 
 from utils.admin_utils import (
     check_admin_level, add_mikrotik, upload_openvpn_template,
     add_level2_admin, get_mikrotik_list, delete_mikrotik, delete_admin,
     get_mikrotik_by_id, edit_mikrotik_field, update_admin_name,
-    update_admin_mikrotiks, promote_admin_to_level1, demote_admin_to_level2
+    update_admin_mikrotiks, promote_admin_to_level1, demote_admin_to_level2,
+    get_level2_admin, load_admins
 )
+from utils.tracing import format_trace, slow_traces
 
 router = Router()
 
@@ -120,14 +121,7 @@ async def edit_admin_l2_callback(callback: CallbackQuery, state: FSMContext):
     admin_id = int(callback.data.split(":", 1)[1])
     
     # Получаем данные администратора
-    with open('data/admins.json', 'r', encoding='utf-8') as f:
-        admins_data = json.load(f)
-    
-    admin_info = None
-    for admin in admins_data["level_2"]:
-        if admin["id"] == admin_id:
-            admin_info = admin
-            break
+    admin_info = get_level2_admin(admin_id)
     
     if not admin_info:
         return await callback.answer("Администратор не найден.", show_alert=True)
@@ -175,14 +169,7 @@ async def edit_admin_mikrotiks_callback(callback: CallbackQuery, state: FSMConte
     admin_id = int(callback.data.split(":", 1)[1])
     
     # Получаем данные администратора
-    with open('data/admins.json', 'r', encoding='utf-8') as f:
-        admins_data = json.load(f)
-    
-    admin_info = None
-    for admin in admins_data["level_2"]:
-        if admin["id"] == admin_id:
-            admin_info = admin
-            break
+    admin_info = get_level2_admin(admin_id)
     
     if not admin_info:
         return await callback.answer("Администратор не найден.", show_alert=True)
@@ -253,16 +240,6 @@ async def toggle_mikrotik_callback(callback: CallbackQuery, state: FSMContext):
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
     
-    # Получаем имя админа для отображения
-    with open('data/admins.json', 'r', encoding='utf-8') as f:
-        admins_data = json.load(f)
-    
-    admin_name = "Неизвестный"
-    for admin in admins_data["level_2"]:
-        if admin["id"] == admin_id:
-            admin_name = admin.get("name", "Неизвестный")
-            break
-    
     await callback.message.edit_reply_markup(reply_markup=keyboard)
     await callback.answer(f"Доступ к микротику {'добавлен' if mikrotik_id in selected_mikrotiks else 'удален'}")
 
@@ -340,6 +317,41 @@ async def admin_command(message: types.Message):
         "Панель управления администратора 1-го уровня",
         reply_markup=get_admin_keyboard()
     )
+
+# Сколько трассировок показывает /traces без аргумента
+TRACES_SHOWN = 5
+
+# Обработчик команды /traces: самые медленные обновления с разбивкой по интервалам
+@router.message(Command("traces"))
+async def traces_command(message: types.Message):
+    admin_level = check_admin_level(message.from_user.id)
+    
+    if admin_level != 1:
+        return await message.reply("Доступ запрещён. Эта команда доступна только администраторам 1-го уровня.")
+    
+    # /traces clear - очистить, /traces N - показать N самых медленных
+    args = (message.text or "").split()[1:]
+    if args and args[0] == "clear":
+        slow_traces.clear()
+        return await message.reply("Сохраненные трассировки очищены.")
+    limit = int(args[0]) if args and args[0].isdigit() else TRACES_SHOWN
+    
+    traces = slow_traces.slowest(limit)
+    if not traces:
+        return await message.reply(
+            f"Нет сохраненных трассировок дольше {slow_traces.min_duration * 1000:.0f} мс."
+        )
+    
+    # Разбиваем на сообщения, чтобы не превысить лимит Telegram в 4096 символов
+    chunk = ""
+    for trace in traces:
+        text = format_trace(trace)[:4000]
+        if chunk and len(chunk) + len(text) + 2 > 4000:
+            await message.answer(chunk)
+            chunk = ""
+        chunk = f"{chunk}\n\n{text}" if chunk else text
+    await message.answer(chunk)
+
 # обработчик для кнопки редактирования микротика
 @router.callback_query(F.data.startswith("edit_mikrotik:"))
 async def edit_mikrotik_callback(callback: CallbackQuery):
@@ -721,8 +733,7 @@ async def manage_admins(message: types.Message):
 async def send_admins_list(message: types.Message, page: int = 1):
     """Отправляет список администраторов с пагинацией"""
     # Загружаем список администраторов
-    with open('data/admins.json', 'r', encoding='utf-8') as f:
-        admins_data = json.load(f)
+    admins_data = load_admins()
     
     # Создаем общий список всех администраторов
     all_admins = []
@@ -837,8 +848,7 @@ async def admins_page_callback(callback: CallbackQuery):
 async def send_admins_list_internal(message: types.Message, page: int = 1):
     """Внутренняя функция для отправки списка администраторов с пагинацией"""
     # Загружаем список администраторов
-    with open('data/admins.json', 'r', encoding='utf-8') as f:
-        admins_data = json.load(f)
+    admins_data = load_admins()
     
     # Создаем общий список всех администраторов
     all_admins = []
@@ -1081,14 +1091,10 @@ async def process_template_file(message: types.Message, state: FSMContext, bot:
     data = await state.get_data()
     mikrotik_id = data.get("mikrotik_id")
     
-    # Загружаем файл (исправленный код)
-    file_path = f"temp_{message.document.file_id}.ovpn"
-    await bot.download(message.document, file_path)
-    
-    # Чтение содержимого файла
+    # Загружаем файл в память, не создавая временных файлов
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            template_content = f.read()
+        file_buffer = await bot.download(message.document)
+        template_content = file_buffer.read().decode('utf-8')
         
         # Загружаем шаблон
         success, result_message = upload_openvpn_template(mikrotik_id, template_content, message.from_user.id)
@@ -1096,11 +1102,6 @@ async def process_template_file(message: types.Message, state: FSMContext, bot:
         await message.reply(result_message)
     except Exception as e:
         await message.reply(f"Ошибка при обработке файла: {e}")
-    finally:
-        # Удаляем временный файл
-        import os
-        if os.path.exists(file_path):
-            os.unlink(file_path)
     
     # Сбрасываем состояние
     await state.clear()
@@ -4,7 +4,7 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeybo
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from utils.admin_utils import check_admin_level, get_mikrotik_list
+from utils.admin_utils import check_admin_level, get_mikrotik_list, get_user_mikrotik, set_user_mikrotik
 
 router = Router()
 
@@ -12,9 +12,6 @@ router = Router()
 class SelectMikrotik(StatesGroup):
     waiting_for_mikrotik = State()
 
-# Хранилище текущего выбранного микротика для каждого пользователя
-user_mikrotik = {}
-
 def get_connection_keyboard():
     """Создает клавиатуру для выбора микротика"""
     keyboard = ReplyKeyboardMarkup(
@@ -225,7 +222,7 @@ async def connect_mikrotik_callback(callback: CallbackQuery):
         return await callback.answer("У вас нет доступа к этому микротику.", show_alert=True)
     
     # Сохраняем выбранный микротик для пользователя
-    user_mikrotik[user_id] = mikrotik_id
+    await set_user_mikrotik(user_id, mikrotik_id)
     
     await callback.message.edit_text(f"✅ Вы подключились к микротику: {mikrotik_names[mikrotik_id]}")
     
@@ -241,4 +238,4 @@ async def connect_mikrotik_callback(callback: CallbackQuery):
 
 def get_current_mikrotik(user_id):
     """Возвращает ID текущего выбранного микротика для пользователя"""
-    return user_mikrotik.get(user_id)
\ No newline at end of file
+    return get_user_mikrotik(user_id)
\ No newline at end of file
@@ -1,34 +1,57 @@
 import asyncio
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, FSInputFile, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, BufferedInputFile, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.utils.markdown import hbold, hcode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import os
+from aiogram.exceptions import TelegramBadRequest
 
 from config import ALLOWED_USERS, ALLOWED_GROUPS
 from utils.mikrotik_api import (
     get_active_openvpn_profiles,
     get_enabled_openvpn_profiles,
     deactivate_openvpn_profile,
+    deactivate_openvpn_profiles_bulk,
     disable_openvpn_secret,
+    disable_openvpn_secrets_bulk,
     add_openvpn_profile,
+    add_openvpn_profiles_bulk,
     get_openvpn_profile_credentials
 )
 from utils.wireguard_api import (
     get_wireguard_peers,
     disable_wireguard_peer,
+    disable_wireguard_peers_bulk,
     add_wireguard_peer,
+    add_wireguard_peers_bulk,
     regenerate_wireguard_config
 )
 from utils.vpn_template import generate_ovpn_file
-from utils.admin_utils import check_admin_level, get_mikrotik_by_id
+from utils.admin_utils import check_admin_level, get_mikrotik_by_id, load_admins
+from utils.broadcast import broadcast, retry_on_flood
+from utils.archive import build_zip
+from utils.render_pool import render_pool
 from handlers.connection import get_current_mikrotik
 
 # Добавляем константу для задержки перед удалением сообщений
 AUTO_DELETE_DELAY = 30  # 30 секунд
 
+# Ограничения для массового создания профилей
+MAX_BULK_NAMES = 500
+MAX_BULK_FILE_SIZE = 1024 * 1024  # 1 МБ
+
+# Действия над выбранными записями в режиме множественного выбора:
+# ovpn - профили OpenVPN, active - активные подключения, wg - пиры WireGuard
+SELECTION_ACTIONS = {
+    "ovpn": "🗑️ Удалить выбранные",
+    "active": "🔴 Отключить выбранные",
+    "wg": "🗑️ Удалить выбранные"
+}
+
+# Символы, недопустимые в именах профилей и пиров
+INVALID_NAME_CHARS = "'\"\\/?*:;|<>, "
+
 router = Router()
 
 # Определяем состояния для диалогов создания профилей
@@ -38,6 +61,10 @@ class ProfileCreation(StatesGroup):
 class WireGuardProfileCreation(StatesGroup):
     waiting_for_name = State()
 
+class BulkProfileCreation(StatesGroup):
+    waiting_for_file = State()
+    waiting_for_wg_file = State()
+
 # Добавим состояния для пагинации
 class PaginationData(StatesGroup):
     profiles_page = State()
@@ -116,6 +143,98 @@ def is_authorized_from_callback(callback: CallbackQuery):
         return chat.id in ALLOWED_GROUPS
     return False
 
+def validate_vpn_name(name: str):
+    """Возвращает причину, по которой имя профиля недопустимо, или None"""
+    if len(name) < 3:
+        return "короче 3 символов"
+    if any(c in INVALID_NAME_CHARS for c in name):
+        return "недопустимые символы"
+    return None
+
+def parse_bulk_names(text: str):
+    """
+    Разбирает список имен из CSV или текста: имя в первой колонке или
+    по одному на строку. Пустые строки, строки с # и заголовок пропускаются.
+    
+    Returns:
+        (names, invalid): допустимые имена без повторов и пары (имя, причина)
+    """
+    names = []
+    invalid = []
+    for line in text.splitlines():
+        name = line.split(",")[0].split(";")[0].strip().strip('"').strip()
+        if not name or name.startswith("#") or name.lower() in ("name", "имя"):
+            continue
+        
+        reason = validate_vpn_name(name)
+        if reason:
+            invalid.append((name, reason))
+        else:
+            names.append(name)
+    return list(dict.fromkeys(names)), invalid
+
+def bulk_names_prompt(vpn_name: str):
+    """Текст приглашения отправить список имен для массового создания"""
+    return (
+        f"Отправьте CSV или текстовый файл с именами профилей {vpn_name} (по одному в строке, "
+        f"не больше {MAX_BULK_NAMES}). Можно отправить список и обычным сообщением."
+    )
+
+async def read_bulk_names(message: types.Message):
+    """Возвращает текст со списком имен из документа или сообщения"""
+    if message.document:
+        if message.document.file_size and message.document.file_size > MAX_BULK_FILE_SIZE:
+            raise ValueError("файл больше 1 МБ")
+        file_buffer = await message.bot.download(message.document)
+        return file_buffer.read().decode('utf-8-sig')
+    return message.text or ""
+
+def format_bulk_report(title: str, created, skipped, failed, invalid, limit: int = 20, unrendered=()):
+    """
+    Формирует отчет о массовом создании профилей.
+    limit - сколько имен показывать в каждом списке (0 - все),
+    unrendered - созданные записи, файлы которых сформировать не удалось.
+    """
+    lines = [
+        title,
+        f"Создано: {len(created)}",
+        f"Пропущено (уже существуют): {len(skipped)}",
+        f"Ошибки создания: {len(failed)}",
+        f"Недопустимые имена: {len(invalid)}"
+    ]
+    if unrendered:
+        lines.append(f"Созданы без файлов конфигурации: {len(unrendered)}")
+    sections = (
+        ("Пропущены", skipped),
+        ("Ошибки", failed),
+        ("Недопустимые имена", invalid),
+        ("Созданы без файлов конфигурации", unrendered)
+    )
+    for header, items in sections:
+        if not items:
+            continue
+        lines.append("")
+        lines.append(f"{header}:")
+        shown = items[:limit] if limit else items
+        lines.extend(f"- {name}: {reason}" for name, reason in shown)
+        if len(items) > len(shown):
+            lines.append(f"... и еще {len(items) - len(shown)}")
+    return "\n".join(lines)
+
+def selection_button(kind: str, key: str, label: str, selected):
+    """Кнопка-флажок записи в режиме множественного выбора"""
+    mark = "✅" if key in selected else "⬜"
+    return InlineKeyboardButton(text=f"{mark} {label}", callback_data=f"sel:{kind}:{key}")
+
+def selection_controls(kind: str, selected, page: int = 1):
+    """Кнопки включения режима выбора или применения действия к выбранным записям"""
+    if selected is None:
+        return [[InlineKeyboardButton(text="☑️ Выбрать несколько", callback_data=f"sel_start:{kind}:{page}")]]
+    return [[
+        InlineKeyboardButton(text=f"{SELECTION_ACTIONS[kind]} ({len(selected)})", callback_data=f"sel_apply:{kind}"),
+        InlineKeyboardButton(text="✖️ Отмена", callback_data=f"sel_cancel:{kind}")
+    ]]
+
 # Функция для удаления сообщения с задержкой
 async def delete_message_after_delay(message: types.Message, delay: int):
     """Удаляет сообщение после указанной задержки в секундах"""
@@ -126,6 +245,24 @@ async def delete_message_after_delay(message: types.Message, delay: int):
         # Игнорируем ошибки при удалении, например, если сообщение уже удалено
         pass
 
+async def send_list_message(message: types.Message, text: str, delay: int, edit: bool = False, **kwargs):
+    """
+    Отправляет сообщение со списком и планирует его удаление.
+    При edit=True обновляет сообщение message на месте: его удаление
+    уже запланировано при первой отправке.
+    """
+    if edit:
+        try:
+            await message.edit_text(text, **kwargs)
+            return
+        except TelegramBadRequest as e:
+            # Отметки и страница не изменились
+            if "message is not modified" in str(e):
+                return
+            # Сообщение уже нельзя изменить - отправляем новое
+    sent_msg = await message.answer(text, **kwargs)
+    asyncio.create_task(delete_message_after_delay(sent_msg, delay))
+
 # Обработчики для кнопок администратора 1-го уровня
 @router.message(lambda message: message.text == "⚙️ Админ-панель")
 async def handle_admin_panel_button(message: types.Message):
@@ -231,6 +368,38 @@ async def add_wireguard_handler(message: types.Message, state: FSMContext):
     await message.reply("Введите имя нового WireGuard пира:")
     await state.set_state(WireGuardProfileCreation.waiting_for_name)
 
+@router.message(Command("bulk_ovpn"))
+async def bulk_ovpn_handler(message: types.Message, state: FSMContext):
+    """Обработчик команды массового создания профилей OpenVPN"""
+    if not is_authorized(message):
+        return await message.reply("Доступ запрещён.")
+    
+    # Проверяем, выбран ли микротик
+    if not await check_mikrotik_selected(message, message.from_user.id):
+        return
+    
+    mikrotik_id = get_current_mikrotik(message.from_user.id)
+    await state.update_data(mikrotik_id=mikrotik_id)
+    
+    await message.reply(bulk_names_prompt("OpenVPN"))
+    await state.set_state(BulkProfileCreation.waiting_for_file)
+
+@router.message(Command("bulk_wg"))
+async def bulk_wg_handler(message: types.Message, state: FSMContext):
+    """Обработчик команды массового создания пиров WireGuard"""
+    if not is_authorized(message):
+        return await message.reply("Доступ запрещён.")
+    
+    # Проверяем, выбран ли микротик
+    if not await check_mikrotik_selected(message, message.from_user.id):
+        return
+    
+    mikrotik_id = get_current_mikrotik(message.from_user.id)
+    await state.update_data(mikrotik_id=mikrotik_id)
+    
+    await message.reply(bulk_names_prompt("WireGuard"))
+    await state.set_state(BulkProfileCreation.waiting_for_wg_file)
+
 @router.message(Command("start"))
 async def show_buttons(message: types.Message):
     if not is_authorized(message):
@@ -293,7 +462,9 @@ async def handle_add_vpn(message: types.Message):
     # Показываем меню выбора типа VPN для добавления
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Добавить OpenVPN", callback_data=f"add_profile:{mikrotik_id}")],
-        [InlineKeyboardButton(text="Добавить WireGuard", callback_data=f"add_wireguard:{mikrotik_id}")]
+        [InlineKeyboardButton(text="Добавить WireGuard", callback_data=f"add_wireguard:{mikrotik_id}")],
+        [InlineKeyboardButton(text="Массово добавить OpenVPN", callback_data=f"bulk_ovpn:{mikrotik_id}")],
+        [InlineKeyboardButton(text="Массово добавить WireGuard", callback_data=f"bulk_wg:{mikrotik_id}")]
     ])
     
     await message.answer(
@@ -374,7 +545,7 @@ async def download_ovpn_callback(callback: CallbackQuery):
     name = parts[2]
     
     # Получаем данные профиля
-    result = get_openvpn_profile_credentials(name, mikrotik_id)
+    result = await get_openvpn_profile_credentials(name, mikrotik_id)
     
     if isinstance(result, dict) and result.get("success"):
         # Получаем данные профиля
@@ -382,11 +553,11 @@ async def download_ovpn_callback(callback: CallbackQuery):
         password = result['password']
         
         try:
-            # Генерируем .ovpn файл
-            file_path, filename = generate_ovpn_file(name, password, mikrotik_id)
+            # Генерируем .ovpn файл в памяти
+            file_data, filename = generate_ovpn_file(name, password, mikrotik_id)
             
             # Создаем объект файла для отправки
-            vpn_file = FSInputFile(file_path, filename=filename)
+            vpn_file = BufferedInputFile(file_data, filename=filename)
             
             # Отправляем файл
             await callback.message.answer_document(
@@ -394,9 +565,6 @@ async def download_ovpn_callback(callback: CallbackQuery):
                 caption=f"✅ Профиль OpenVPN {hbold(name)} готов к использованию.",
                 parse_mode="HTML"
             )
-            
-            # Удаляем временный файл после отправки
-            os.unlink(file_path)
         except Exception as e:
             # Если произошла ошибка при генерации файла
             await callback.message.answer(
@@ -428,20 +596,20 @@ async def download_wg_callback(callback: CallbackQuery):
     peer_id = parts[2]
     
     # Регенерируем конфигурацию с указанием микротика
-    result = regenerate_wireguard_config(peer_id, mikrotik_id)
+    result = await regenerate_wireguard_config(peer_id, mikrotik_id)
     
     if isinstance(result, dict) and result.get("success"):
         # Получаем данные
         name = result['name']
-        conf_file = result['conf_file']
+        conf_data = result['conf_data']
         conf_filename = result['conf_filename']
-        qr_file = result['qr_file']
+        qr_data = result['qr_data']
         qr_filename = result['qr_filename']
         
         try:
             # Создаем объекты файлов для отправки
-            config_file = FSInputFile(conf_file, filename=conf_filename)
-            qr_image = FSInputFile(qr_file, filename=qr_filename)
+            config_file = BufferedInputFile(conf_data, filename=conf_filename)
+            qr_image = BufferedInputFile(qr_data, filename=qr_filename)
             
             # Отправляем файлы
             await callback.message.answer_document(
@@ -455,10 +623,6 @@ async def download_wg_callback(callback: CallbackQuery):
                 caption=f"QR-код для пира {hbold(name)}. Отсканируйте его в приложении WireGuard.",
                 parse_mode="HTML"
             )
-            
-            # Удаляем временные файлы после отправки
-            os.unlink(conf_file)
-            os.unlink(qr_file)
         except Exception as e:
             # Если произошла ошибка при отправке файлов
             await callback.message.answer(
@@ -522,6 +686,32 @@ async def add_profile_callback(callback: CallbackQuery, state: FSMContext):
     await state.set_state(ProfileCreation.waiting_for_name)
     await callback.answer()
 
+@router.callback_query(F.data.startswith("bulk_ovpn:"))
+async def bulk_ovpn_callback(callback: CallbackQuery, state: FSMContext):
+    """Обработчик кнопки массового создания профилей OpenVPN"""
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    mikrotik_id = callback.data.split(":", 1)[1]
+    
+    await state.update_data(mikrotik_id=mikrotik_id)
+    await callback.message.reply(bulk_names_prompt("OpenVPN"))
+    await state.set_state(BulkProfileCreation.waiting_for_file)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("bulk_wg:"))
+async def bulk_wg_callback(callback: CallbackQuery, state: FSMContext):
+    """Обработчик кнопки массового создания пиров WireGuard"""
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    mikrotik_id = callback.data.split(":", 1)[1]
+    
+    await state.update_data(mikrotik_id=mikrotik_id)
+    await callback.message.reply(bulk_names_prompt("WireGuard"))
+    await state.set_state(BulkProfileCreation.waiting_for_wg_file)
+    await callback.answer()
+
 @router.callback_query(F.data == "show_wireguard")
 async def wireguard_peers_callback(callback: CallbackQuery):
     if not is_authorized_from_callback(callback):
@@ -563,7 +753,7 @@ async def deactivate_profile_callback(callback: CallbackQuery):
     mikrotik_id = parts[1]
     name = parts[2]
     
-    result = deactivate_openvpn_profile(name, mikrotik_id)
+    result = await deactivate_openvpn_profile(name, mikrotik_id)
     
     # Результат теперь всегда строка с сообщением
     sent_msg = await callback.message.answer(result)
@@ -591,7 +781,7 @@ async def disable_secret_callback(callback: CallbackQuery):
     mikrotik_id = parts[1]
     name = parts[2]
     
-    result = disable_openvpn_secret(name, mikrotik_id)
+    result = await disable_openvpn_secret(name, mikrotik_id)
     
     sent_msg = await callback.message.answer(result)
     
@@ -618,7 +808,7 @@ async def disable_wireguard_callback(callback: CallbackQuery):
     mikrotik_id = parts[1]
     peer_id = parts[2]
     
-    result = disable_wireguard_peer(peer_id, mikrotik_id)
+    result = await disable_wireguard_peer(peer_id, mikrotik_id)
     
     sent_msg = await callback.message.answer(result)
     
@@ -633,6 +823,174 @@ async def disable_wireguard_callback(callback: CallbackQuery):
     
     await callback.answer()
 
+# Режим множественного выбора: отмеченные записи хранятся в данных FSM
+async def show_selection(message: types.Message, selection: dict, edit: bool = False):
+    """Показывает список в режиме множественного выбора (edit - изменить сообщение message)"""
+    kind = selection["kind"]
+    mikrotik_id = selection["mikrotik_id"]
+    selected = selection["items"]
+    
+    if kind == "ovpn":
+        await send_openvpn_profiles(message, selection["page"], mikrotik_id, selected=selected, edit=edit)
+    elif kind == "active":
+        await send_openvpn_status(message, mikrotik_id, selected=selected, edit=edit)
+    else:
+        await send_wireguard_peers(message, selection["page"], mikrotik_id, selected=selected, edit=edit)
+
+async def refresh_selection(callback: CallbackQuery, selection: dict):
+    """Обновляет сообщение со списком на месте с актуальными отметками"""
+    await show_selection(callback.message, selection, edit=True)
+
+async def get_selection(state: FSMContext, kind: str):
+    """Возвращает текущий выбор пользователя для списка kind или None"""
+    data = await state.get_data()
+    selection = data.get("selection")
+    if not selection or selection.get("kind") != kind:
+        return None
+    return selection
+
+def format_bulk_action_result(result: dict, done_title: str, limit: int = 20):
+    """Формирует сообщение о результате действия над выбранными записями"""
+    lines = [f"{done_title}: {len(result['done'])}"]
+    if result["missing"]:
+        lines.append(f"⚠️ Не найдены (уже изменены): {len(result['missing'])}")
+    if result["failed"]:
+        lines.append(f"❌ Ошибки: {len(result['failed'])}")
+        lines.extend(f"- {name}: {error}" for name, error in result["failed"][:limit])
+        if len(result["failed"]) > limit:
+            lines.append(f"... и еще {len(result['failed']) - limit}")
+    return "\n".join(lines)
+
+@router.callback_query(F.data.startswith("sel_start:"))
+async def selection_start_callback(callback: CallbackQuery, state: FSMContext):
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    parts = callback.data.split(":", 2)
+    if len(parts) < 3 or parts[1] not in SELECTION_ACTIONS or not parts[2].isdigit():
+        return await callback.answer("Неверный формат данных", show_alert=True)
+    
+    # Проверяем, выбран ли микротик
+    mikrotik_id = get_current_mikrotik(callback.from_user.id)
+    if not mikrotik_id:
+        await callback.message.reply(
+            "Сначала выберите микротик. "
+            "Используйте команду /connect или кнопку 'Выбрать микротик'."
+        )
+        return
+    
+    selection = {"kind": parts[1], "mikrotik_id": mikrotik_id, "items": [], "page": int(parts[2])}
+    await state.update_data(selection=selection)
+    
+    await refresh_selection(callback, selection)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("sel:"))
+async def selection_toggle_callback(callback: CallbackQuery, state: FSMContext):
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    parts = callback.data.split(":", 2)
+    if len(parts) < 3:
+        return await callback.answer("Неверный формат данных", show_alert=True)
+    
+    selection = await get_selection(state, parts[1])
+    if not selection:
+        return await callback.answer("Режим выбора устарел, откройте список заново", show_alert=True)
+    
+    # Отмечаем или снимаем отметку
+    key = parts[2]
+    if key in selection["items"]:
+        selection["items"].remove(key)
+    else:
+        selection["items"].append(key)
+    await state.update_data(selection=selection)
+    
+    await refresh_selection(callback, selection)
+    await callback.answer(f"Выбрано: {len(selection['items'])}")
+
+@router.callback_query(F.data.startswith("sel_page:"))
+async def selection_page_callback(callback: CallbackQuery, state: FSMContext):
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    parts = callback.data.split(":", 2)
+    if len(parts) < 3 or not parts[2].isdigit():
+        return await callback.answer("Неверный формат данных", show_alert=True)
+    
+    selection = await get_selection(state, parts[1])
+    if not selection:
+        return await callback.answer("Режим выбора устарел, откройте список заново", show_alert=True)
+    
+    selection["page"] = int(parts[2])
+    await state.update_data(selection=selection)
+    
+    await refresh_selection(callback, selection)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("sel_cancel:"))
+async def selection_cancel_callback(callback: CallbackQuery, state: FSMContext):
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    kind = callback.data.split(":", 1)[1]
+    selection = await get_selection(state, kind)
+    await state.update_data(selection=None)
+    
+    # Удаляем сообщение со списком
+    try:
+        await callback.message.delete()
+    except:
+        pass
+    
+    # Возвращаем обычный список
+    if selection:
+        selection["items"] = None
+        await show_selection(callback.message, selection)
+    await callback.answer("Выбор отменен")
+
+@router.callback_query(F.data.startswith("sel_apply:"))
+async def selection_apply_callback(callback: CallbackQuery, state: FSMContext):
+    if not is_authorized_from_callback(callback):
+        return await callback.answer("Доступ запрещён", show_alert=True)
+    
+    kind = callback.data.split(":", 1)[1]
+    selection = await get_selection(state, kind)
+    if not selection:
+        return await callback.answer("Режим выбора устарел, откройте список заново", show_alert=True)
+    if not selection["items"]:
+        return await callback.answer("Ничего не выбрано", show_alert=True)
+    
+    await callback.answer("⏳ Выполняю...")
+    mikrotik_id = selection["mikrotik_id"]
+    items = selection["items"]
+    
+    # Все записи обрабатываются по одной выборке таблицы
+    if kind == "ovpn":
+        result = await disable_openvpn_secrets_bulk(items, mikrotik_id)
+        done_title = "✅ Отключено профилей"
+    elif kind == "active":
+        result = await deactivate_openvpn_profiles_bulk(items, mikrotik_id)
+        done_title = "✅ Деактивировано профилей"
+    else:
+        result = await disable_wireguard_peers_bulk(items, mikrotik_id)
+        done_title = "✅ Отключено пиров"
+    
+    await state.update_data(selection=None)
+    
+    if isinstance(result, dict):
+        result = format_bulk_action_result(result, done_title)
+    sent_msg = await callback.message.answer(result)
+    
+    # Удаляем оригинальное сообщение с кнопками
+    try:
+        await callback.message.delete()
+    except:
+        pass
+    
+    # Удаляем сообщение с результатом через минуту
+    asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+
 # Обработчики состояний FSM для создания профилей
 @router.message(F.text.startswith("/find_ovpn"))
 async def find_openvpn_profile(message: types.Message):
@@ -654,7 +1012,7 @@ async def find_openvpn_profile(message: types.Message):
     search_name = parts[1].lower()
     
     # Получаем все профили
-    profiles = get_enabled_openvpn_profiles(mikrotik_id)
+    profiles = await get_enabled_openvpn_profiles(mikrotik_id)
     if isinstance(profiles, str):
         return await message.reply(profiles)
     
@@ -690,15 +1048,13 @@ async def process_profile_name(message: types.Message, state: FSMContext):
     # Получаем имя профиля из сообщения
     profile_name = message.text.strip()
     
-    # Проверяем корректность имени
-    if not profile_name or len(profile_name) < 3:
-        await message.reply("Имя профиля должно содержать минимум 3 символа. Попробуйте еще раз:")
-        return
-    
-    # Предотвращаем использование специальных символов
-    invalid_chars = "'\"\\/?*:;|<>, "
-    if any(c in invalid_chars for c in profile_name):
-        await message.reply(f"Имя профиля не должно содержать следующие символы: {invalid_chars}\nПопробуйте еще раз:")
+    # Проверяем корректность имени (те же правила, что и при массовом создании)
+    reason = validate_vpn_name(profile_name)
+    if reason:
+        await message.reply(
+            f"Недопустимое имя профиля: {reason}. Имя должно содержать минимум 3 символа "
+            f"и не содержать следующие символы: {INVALID_NAME_CHARS}\nПопробуйте еще раз:"
+        )
         return
     
     # Получаем ID микротика из состояния
@@ -712,7 +1068,7 @@ async def process_profile_name(message: types.Message, state: FSMContext):
     
     # Создаем профиль
     await message.reply(f"⏳ Создаю профиль OpenVPN {hbold(profile_name)}...")
-    result = add_openvpn_profile(profile_name, mikrotik_id)
+    result = await add_openvpn_profile(profile_name, mikrotik_id)
     
      # Сбрасываем состояние
     await state.clear()
@@ -744,18 +1100,20 @@ async def process_profile_name(message: types.Message, state: FSMContext):
         mikrotik_name = mikrotik_info.get("name", "Неизвестный микротик") if mikrotik_info else "Неизвестный микротик"
         
         try:
-            # Генерируем .ovpn файл
-            file_path, filename = generate_ovpn_file(name, password, mikrotik_id)
+            # Генерируем .ovpn файл в памяти
+            file_data, filename = generate_ovpn_file(name, password, mikrotik_id)
             
             # Создаем объект файла для отправки
-            vpn_file = FSInputFile(file_path, filename=filename)
+            vpn_file = BufferedInputFile(file_data, filename=filename)
             
             # Отправляем файл создателю
-            await message.reply_document(
+            sent_doc = await message.reply_document(
                 document=vpn_file,
                 caption=f"✅ Профиль OpenVPN {hbold(name)} для {hbold(mikrotik_name)} успешно создан и готов к использованию.",
                 parse_mode="HTML"
             )
+            # Файл уже загружен в Telegram, остальным отправляем его по file_id
+            doc_file_id = sent_doc.document.file_id
             
             # Отправляем файл всем остальным администраторам
             bot = message.bot
@@ -777,24 +1135,16 @@ async def process_profile_name(message: types.Message, state: FSMContext):
             # Делаем список уникальным
             # admins_with_access = list(set(admins_with_access)) # Раскоментировать  если нужно  чтобы  получали  админы  2го  уровня
             
-            for admin_id in admins_with_access:
-                # Пропускаем создателя, т.к. ему уже отправили
-                if admin_id != creator_id:
-                    try:
-                        # Создаем новый объект файла для каждого админа
-                        admin_vpn_file = FSInputFile(file_path, filename=filename)
-                        await bot.send_document(
-                            chat_id=admin_id,
-                            document=admin_vpn_file,
-                            caption=f"✅ Администратор {creator_name} создал новый профиль OpenVPN {hbold(name)} для {hbold(mikrotik_name)}.",
-                            parse_mode="HTML"
-                        )
-                    except Exception as e:
-                        # Логируем ошибку, но продолжаем работу
-                        print(f"Не удалось отправить профиль администратору {admin_id}: {e}")
+            async def send_profile(admin_id):
+                await retry_on_flood(lambda: bot.send_document(
+                    chat_id=admin_id,
+                    document=doc_file_id,
+                    caption=f"✅ Администратор {creator_name} создал новый профиль OpenVPN {hbold(name)} для {hbold(mikrotik_name)}.",
+                    parse_mode="HTML"
+                ))
             
-            # Удаляем временный файл после отправки
-            os.unlink(file_path)
+            # Пропускаем создателя, т.к. ему уже отправили
+            await broadcast([a for a in admins_with_access if a != creator_id], send_profile)
         except Exception as e:
             # Если произошла ошибка при генерации файла, выводим данные в текстовом виде
             await message.reply(
@@ -814,15 +1164,13 @@ async def process_wireguard_name(message: types.Message, state: FSMContext):
     # Получаем имя пира из сообщения
     peer_name = message.text.strip()
     
-    # Проверяем корректность имени
-    if not peer_name or len(peer_name) < 3:
-        await message.reply("Имя пира должно содержать минимум 3 символа. Попробуйте еще раз:")
-        return
-    
-    # Предотвращаем использование специальных символов
-    invalid_chars = "'\"\\/?*:;|<>, "
-    if any(c in invalid_chars for c in peer_name):
-        await message.reply(f"Имя пира не должно содержать следующие символы: {invalid_chars}\nПопробуйте еще раз:")
+    # Проверяем корректность имени (те же правила, что и при массовом создании)
+    reason = validate_vpn_name(peer_name)
+    if reason:
+        await message.reply(
+            f"Недопустимое имя пира: {reason}. Имя должно содержать минимум 3 символа "
+            f"и не содержать следующие символы: {INVALID_NAME_CHARS}\nПопробуйте еще раз:"
+        )
         return
     
     # Получаем ID микротика из состояния
@@ -836,7 +1184,7 @@ async def process_wireguard_name(message: types.Message, state: FSMContext):
     
     # Создаем пир
     await message.reply(f"⏳ Создаю пир WireGuard {hbold(peer_name)}...")
-    result = add_wireguard_peer(peer_name, mikrotik_id)
+    result = await add_wireguard_peer(peer_name, mikrotik_id)
     
     # Получаем информацию о микротике для сообщения
     mikrotik_info = get_mikrotik_by_id(mikrotik_id)
@@ -846,30 +1194,33 @@ async def process_wireguard_name(message: types.Message, state: FSMContext):
     if isinstance(result, dict) and result.get("success"):
         # Получаем данные пира
         name = result['name']
-        conf_file = result['conf_file']
+        conf_data = result['conf_data']
         conf_filename = result['conf_filename']
-        qr_file = result['qr_file']
+        qr_data = result['qr_data']
         qr_filename = result['qr_filename']
         creator_id = message.from_user.id
         creator_name = message.from_user.full_name
         
         try:
             # Создаем объекты файлов для отправки
-            config_file = FSInputFile(conf_file, filename=conf_filename)
-            qr_image = FSInputFile(qr_file, filename=qr_filename)
+            config_file = BufferedInputFile(conf_data, filename=conf_filename)
+            qr_image = BufferedInputFile(qr_data, filename=qr_filename)
             
             # Отправляем файлы создателю
-            await message.reply_document(
+            sent_doc = await message.reply_document(
                 document=config_file,
                 caption=f"✅ Пир WireGuard {hbold(name)} для {hbold(mikrotik_name)} успешно создан.\n"
                         f"Конфигурационный файл и QR-код для сканирования:",
                 parse_mode="HTML"
             )
-            await message.reply_photo(
+            sent_photo = await message.reply_photo(
                 photo=qr_image,
                 caption=f"QR-код для пира {hbold(name)}. Отсканируйте его в приложении WireGuard.",
                 parse_mode="HTML"
             )
+            # Файлы уже загружены в Telegram, остальным отправляем их по file_id
+            doc_file_id = sent_doc.document.file_id
+            photo_file_id = sent_photo.photo[-1].file_id
             
             # Отправляем файлы всем остальным администраторам с доступом к этому микротику
             bot = message.bot
@@ -892,34 +1243,23 @@ async def process_wireguard_name(message: types.Message, state: FSMContext):
             # Делаем список уникальным
             # admins_with_access = list(set(admins_with_access)) # Раскоментировать  если нужно  чтобы  получали  админы  2го  уровня
             
-            for admin_id in admins_with_access:
-                # Пропускаем создателя, т.к. ему уже отправили
-                if admin_id != creator_id:
-                    try:
-                        # Создаем новые объекты файлов для каждого админа
-                        admin_config_file = FSInputFile(conf_file, filename=conf_filename)
-                        admin_qr_image = FSInputFile(qr_file, filename=qr_filename)
-                        
-                        await bot.send_document(
-                            chat_id=admin_id,
-                            document=admin_config_file,
-                            caption=f"✅ Администратор {creator_name} создал новый пир WireGuard {hbold(name)} для {hbold(mikrotik_name)}.\n"
-                                    f"Конфигурационный файл и QR-код для сканирования:",
-                            parse_mode="HTML"
-                        )
-                        await bot.send_photo(
-                            chat_id=admin_id,
-                            photo=admin_qr_image,
-                            caption=f"QR-код для пира {hbold(name)}. Отсканируйте его в приложении WireGuard.",
-                            parse_mode="HTML"
-                        )
-                    except Exception as e:
-                        # Логируем ошибку, но продолжаем работу
-                        print(f"Не удалось отправить файлы WireGuard администратору {admin_id}: {e}")
+            async def send_peer_files(admin_id):
+                await retry_on_flood(lambda: bot.send_document(
+                    chat_id=admin_id,
+                    document=doc_file_id,
+                    caption=f"✅ Администратор {creator_name} создал новый пир WireGuard {hbold(name)} для {hbold(mikrotik_name)}.\n"
+                            f"Конфигурационный файл и QR-код для сканирования:",
+                    parse_mode="HTML"
+                ))
+                await retry_on_flood(lambda: bot.send_photo(
+                    chat_id=admin_id,
+                    photo=photo_file_id,
+                    caption=f"QR-код для пира {hbold(name)}. Отсканируйте его в приложении WireGuard.",
+                    parse_mode="HTML"
+                ))
             
-            # Удаляем временные файлы после отправки
-            os.unlink(conf_file)
-            os.unlink(qr_file)
+            # Пропускаем создателя, т.к. ему уже отправили
+            await broadcast([a for a in admins_with_access if a != creator_id], send_peer_files)
         except Exception as e:
             # Если произошла ошибка при генерации файлов
             await message.reply(
@@ -940,9 +1280,159 @@ async def process_wireguard_name(message: types.Message, state: FSMContext):
         reply_markup=get_main_menu(message.from_user.id)  # Передаем user_id
     )
 
+async def receive_bulk_names(message: types.Message, state: FSMContext):
+    """
+    Читает и проверяет список имен для массового создания.
+    При ошибке отвечает пользователю и возвращает None.
+    
+    Returns:
+        (names, invalid, mikrotik_id) или None
+    """
+    try:
+        text = await read_bulk_names(message)
+    except Exception as e:
+        await message.reply(f"Не удалось прочитать файл: {e}. Попробуйте еще раз:")
+        return None
+    
+    names, invalid = parse_bulk_names(text)
+    if not names:
+        await message.reply("В списке нет допустимых имен профилей. Попробуйте еще раз:")
+        return None
+    if len(names) > MAX_BULK_NAMES:
+        await message.reply(f"Слишком много имен: {len(names)}. Максимум - {MAX_BULK_NAMES}. Попробуйте еще раз:")
+        return None
+    
+    # Получаем ID микротика из состояния
+    data = await state.get_data()
+    mikrotik_id = data.get("mikrotik_id")
+    await state.clear()
+    
+    if not mikrotik_id:
+        await message.reply("Ошибка: Не выбран микротик. Пожалуйста, начните заново.")
+        return None
+    
+    return names, invalid, mikrotik_id
+
+async def send_bulk_archive(message: types.Message, zip_data: bytes, filename: str, caption: str, notify_caption: str):
+    """Отправляет архив создателю, а затем по file_id остальным администраторам 1-го уровня"""
+    sent_doc = await message.reply_document(
+        document=BufferedInputFile(zip_data, filename=filename),
+        caption=caption,
+        parse_mode="HTML"
+    )
+    doc_file_id = sent_doc.document.file_id
+    
+    bot = message.bot
+    admins_with_access = load_admins()["level_1"]
+    
+    async def send_archive(admin_id):
+        await retry_on_flood(lambda: bot.send_document(
+            chat_id=admin_id,
+            document=doc_file_id,
+            caption=notify_caption,
+            parse_mode="HTML"
+        ))
+    
+    # Пропускаем создателя, т.к. ему уже отправили
+    await broadcast([a for a in admins_with_access if a != message.from_user.id], send_archive)
+
+@router.message(BulkProfileCreation.waiting_for_file)
+async def process_bulk_ovpn_file(message: types.Message, state: FSMContext):
+    """Обработчик файла со списком имен для массового создания профилей OpenVPN"""
+    received = await receive_bulk_names(message, state)
+    if received is None:
+        return
+    names, invalid, mikrotik_id = received
+    
+    mikrotik_info = get_mikrotik_by_id(mikrotik_id)
+    mikrotik_name = mikrotik_info.get("name", "Неизвестный микротик") if mikrotik_info else "Неизвестный микротик"
+    
+    await message.reply(f"⏳ Создаю профили OpenVPN: {len(names)} шт. для {hbold(mikrotik_name)}...", parse_mode="HTML")
+    result = await add_openvpn_profiles_bulk(names, mikrotik_id)
+    
+    if not isinstance(result, dict):
+        await message.reply(result, reply_markup=get_main_menu(message.from_user.id))
+        return
+    
+    created = result["created"]
+    title = f"Массовое создание OpenVPN для {mikrotik_name}"
+    report = format_bulk_report(title, created, result["skipped"], result["failed"], invalid)
+    
+    if created:
+        try:
+            # Собираем .ovpn-файлы и полный отчет в один архив
+            files = []
+            for profile in created:
+                file_data, filename = generate_ovpn_file(profile["name"], profile["password"], mikrotik_id)
+                files.append((filename, file_data))
+            files.append(("report.txt", format_bulk_report(title, created, result["skipped"], result["failed"], invalid, limit=0).encode('utf-8')))
+            zip_data = await render_pool.run(build_zip, files)
+            
+            await send_bulk_archive(
+                message,
+                zip_data,
+                f"ovpn_{mikrotik_id}_{len(created)}.zip",
+                f"✅ Профили OpenVPN для {hbold(mikrotik_name)}: {len(created)} шт.",
+                f"✅ Администратор {message.from_user.full_name} создал профили OpenVPN для {hbold(mikrotik_name)}: {len(created)} шт."
+            )
+        except Exception as e:
+            report += f"\n\n⚠️ Не удалось создать архив с профилями: {e}"
+    
+    # Полный отчет лежит в архиве, в сообщение помещаем его начало
+    await message.answer(report[:4000], reply_markup=get_main_menu(message.from_user.id))
+
+@router.message(BulkProfileCreation.waiting_for_wg_file)
+async def process_bulk_wg_file(message: types.Message, state: FSMContext):
+    """Обработчик файла со списком имен для массового создания пиров WireGuard"""
+    received = await receive_bulk_names(message, state)
+    if received is None:
+        return
+    names, invalid, mikrotik_id = received
+    
+    mikrotik_info = get_mikrotik_by_id(mikrotik_id)
+    mikrotik_name = mikrotik_info.get("name", "Неизвестный микротик") if mikrotik_info else "Неизвестный микротик"
+    
+    await message.reply(f"⏳ Создаю пиры WireGuard: {len(names)} шт. для {hbold(mikrotik_name)}...", parse_mode="HTML")
+    result = await add_wireguard_peers_bulk(names, mikrotik_id)
+    
+    if not isinstance(result, dict):
+        await message.reply(result, reply_markup=get_main_menu(message.from_user.id))
+        return
+    
+    created = result["created"]
+    # Пиры, созданные на микротике, но без сформированных файлов
+    unrendered = [(peer["name"], peer["render_error"]) for peer in created if "render_error" in peer]
+    rendered = [peer for peer in created if "render_error" not in peer]
+    title = f"Массовое создание WireGuard для {mikrotik_name}"
+    report = format_bulk_report(title, created, result["skipped"], result["failed"], invalid, unrendered=unrendered)
+    
+    if rendered:
+        try:
+            # Собираем .conf-файлы, QR-коды и полный отчет в один архив
+            files = []
+            for peer in rendered:
+                files.append((peer["conf_filename"], peer["conf_data"]))
+                files.append((peer["qr_filename"], peer["qr_data"]))
+            files.append(("report.txt", format_bulk_report(title, created, result["skipped"], result["failed"], invalid, limit=0, unrendered=unrendered).encode('utf-8')))
+            zip_data = await render_pool.run(build_zip, files)
+            
+            await send_bulk_archive(
+                message,
+                zip_data,
+                f"wireguard_{mikrotik_id}_{len(rendered)}.zip",
+                f"✅ Пиры WireGuard для {hbold(mikrotik_name)}: {len(rendered)} шт.\n"
+                f"В архиве конфигурационные файлы и QR-коды.",
+                f"✅ Администратор {message.from_user.full_name} создал пиры WireGuard для {hbold(mikrotik_name)}: {len(rendered)} шт."
+            )
+        except Exception as e:
+            report += f"\n\n⚠️ Не удалось создать архив с пирами: {e}"
+    
+    # Полный отчет лежит в архиве, в сообщение помещаем его начало
+    await message.answer(report[:4000], reply_markup=get_main_menu(message.from_user.id))
+
 # Функции отправки данных
-async def send_openvpn_status(message: types.Message, mikrotik_id: str):
-    profiles = get_active_openvpn_profiles(mikrotik_id)
+async def send_openvpn_status(message: types.Message, mikrotik_id: str, selected=None, edit: bool = False):
+    profiles = await get_active_openvpn_profiles(mikrotik_id)
     
     # Получаем информацию о микротике для сообщения
     mikrotik_info = get_mikrotik_by_id(mikrotik_id)
@@ -950,12 +1440,10 @@ async def send_openvpn_status(message: types.Message, mikrotik_id: str):
     
     if isinstance(profiles, str):
         # Сообщение с ошибкой (будем удалять)
-        sent_msg = await message.answer(profiles)
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        await send_list_message(message, profiles, AUTO_DELETE_DELAY, edit)
     elif not profiles:
         # Сообщение об отсутствии профилей (будем удалять)
-        sent_msg = await message.answer(f"Нет активных OVPN профилей на {hbold(mikrotik_name)}.", parse_mode="HTML")
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        await send_list_message(message, f"Нет активных OVPN профилей на {hbold(mikrotik_name)}.", AUTO_DELETE_DELAY, edit, parse_mode="HTML")
     else:
         # Сортируем профили в алфавитном порядке по имени
         profiles = sorted(profiles, key=lambda p: p.get('name', '').lower())
@@ -965,26 +1453,27 @@ async def send_openvpn_status(message: types.Message, mikrotik_id: str):
         row = []
         for i, p in enumerate(profiles):
             name = p.get("name", "Неизвестно")
-            row.append(InlineKeyboardButton(text=f"🔴 {name}", callback_data=f"deactivate:{mikrotik_id}:{name}"))
+            if selected is None:
+                row.append(InlineKeyboardButton(text=f"🔴 {name}", callback_data=f"deactivate:{mikrotik_id}:{name}"))
+            else:
+                row.append(selection_button("active", name, name, selected))
             
             # Добавляем по 2 кнопки в ряд
             if len(row) == 2 or i == len(profiles) - 1:
                 buttons.append(row)
                 row = []
         
+        buttons.extend(selection_controls("active", selected))
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
         
-        # Отправляем сообщение с inline-клавиатурой, которое будет удалено
-        sent_msg = await message.answer(
-            f"Активные профили OpenVPN на {hbold(mikrotik_name)}:", 
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
+        text = f"Активные профили OpenVPN на {hbold(mikrotik_name)}:"
+        if selected is not None:
+            text += f"\nОтметьте подключения и нажмите «{SELECTION_ACTIONS['active']}». Выбрано: {len(selected)}"
         
-        # Планируем удаление сообщения
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        # Отправляем сообщение с inline-клавиатурой, которое будет удалено
+        await send_list_message(message, text, AUTO_DELETE_DELAY, edit, reply_markup=keyboard, parse_mode="HTML")
 
-async def send_openvpn_profiles(message: types.Message, page: int = 1, mikrotik_id: str = None):
+async def send_openvpn_profiles(message: types.Message, page: int = 1, mikrotik_id: str = None, selected=None, edit: bool = False):
     # Если mikrotik_id не передан, попробуем его получить
     if not mikrotik_id:
         mikrotik_id = get_current_mikrotik(message.from_user.id)
@@ -999,14 +1488,12 @@ async def send_openvpn_profiles(message: types.Message, page: int = 1, mikrotik_
     mikrotik_info = get_mikrotik_by_id(mikrotik_id)
     mikrotik_name = mikrotik_info.get("name", "Неизвестный микротик") if mikrotik_info else "Неизвестный микротик"
     
-    profiles = get_enabled_openvpn_profiles(mikrotik_id)
+    profiles = await get_enabled_openvpn_profiles(mikrotik_id)
     
     if isinstance(profiles, str):
-        sent_msg = await message.answer(profiles)
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        await send_list_message(message, profiles, AUTO_DELETE_DELAY, edit)
     elif not profiles:
-        sent_msg = await message.answer(f"Нет доступных OpenVPN профилей на {hbold(mikrotik_name)}.", parse_mode="HTML")
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        await send_list_message(message, f"Нет доступных OpenVPN профилей на {hbold(mikrotik_name)}.", AUTO_DELETE_DELAY, edit, parse_mode="HTML")
     else:
         # Сортируем профили
         profiles = sorted(profiles, key=lambda p: p.get('name', '').lower())
@@ -1030,43 +1517,55 @@ async def send_openvpn_profiles(message: types.Message, page: int = 1, mikrotik_
         buttons = []
         for p in current_profiles:
             name = p.get("name", "Неизвестно")
-            row = [
-                InlineKeyboardButton(text=f"📥 {name}", callback_data=f"download_ovpn:{mikrotik_id}:{name}"),
-                InlineKeyboardButton(text=f"🗑️ {name}", callback_data=f"disable:{mikrotik_id}:{name}")
-            ]
+            if selected is None:
+                row = [
+                    InlineKeyboardButton(text=f"📥 {name}", callback_data=f"download_ovpn:{mikrotik_id}:{name}"),
+                    InlineKeyboardButton(text=f"🗑️ {name}", callback_data=f"disable:{mikrotik_id}:{name}")
+                ]
+            else:
+                row = [selection_button("ovpn", name, name, selected)]
             buttons.append(row)
         
+        # В режиме выбора страницы переключаются с сохранением отметок
+        page_prefix = "ovpn_page:" if selected is None else "sel_page:ovpn:"
+        
         # Добавляем кнопки навигации
         nav_buttons = []
         
         # Кнопка "Предыдущая"
         if page > 1:
-            nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"ovpn_page:{page-1}"))
+            nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"{page_prefix}{page-1}"))
         
         # Информация о текущей странице
         nav_buttons.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="page_info"))
         
         # Кнопка "Следующая"
         if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"ovpn_page:{page+1}"))
+            nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"{page_prefix}{page+1}"))
         
         if nav_buttons:
             buttons.append(nav_buttons)
         
+        buttons.extend(selection_controls("ovpn", selected, page))
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
         
-        sent_msg = await message.answer(
+        if selected is None:
+            hint = "📥 - Скачать профиль\n🗑️ - Удалить профиль\n"
+        else:
+            hint = f"Отметьте профили и нажмите «{SELECTION_ACTIONS['ovpn']}». Выбрано: {len(selected)}\n"
+        
+        await send_list_message(
+            message,
             f"Профили OpenVPN на {hbold(mikrotik_name)} (страница {page}/{total_pages}):\n"
-            f"📥 - Скачать профиль\n"
-            f"🗑️ - Удалить профиль\n"
-            f"Всего профилей: {len(profiles)}", 
+            f"{hint}"
+            f"Всего профилей: {len(profiles)}",
+            AUTO_DELETE_DELAY * 2,  # Увеличиваем время для навигации
+            edit,
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-        
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY * 2))  # Увеличиваем время для навигации
 
-async def send_wireguard_peers(message: types.Message, page: int = 1, mikrotik_id: str = None):
+async def send_wireguard_peers(message: types.Message, page: int = 1, mikrotik_id: str = None, selected=None, edit: bool = False):
     # Если mikrotik_id не передан, попробуем его получить
     if not mikrotik_id:
         mikrotik_id = get_current_mikrotik(message.from_user.id)
@@ -1081,21 +1580,18 @@ async def send_wireguard_peers(message: types.Message, page: int = 1, mikrotik_i
     mikrotik_info = get_mikrotik_by_id(mikrotik_id)
     mikrotik_name = mikrotik_info.get("name", "Неизвестный микротик") if mikrotik_info else "Неизвестный микротик"
     
-    peers = get_wireguard_peers(mikrotik_id)
+    peers = await get_wireguard_peers(mikrotik_id)
     
     if isinstance(peers, str):
-        sent_msg = await message.answer(peers)
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        await send_list_message(message, peers, AUTO_DELETE_DELAY, edit)
     elif not peers:
-        sent_msg = await message.answer(f"Нет доступных пиров WireGuard на {hbold(mikrotik_name)}.", parse_mode="HTML")
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+        await send_list_message(message, f"Нет доступных пиров WireGuard на {hbold(mikrotik_name)}.", AUTO_DELETE_DELAY, edit, parse_mode="HTML")
     else:
         # Фильтруем только активные пиры (не отключенные)
         active_peers = [p for p in peers if p.get("disabled") == "false"]
         
         if not active_peers:
-            sent_msg = await message.answer(f"Нет активных пиров WireGuard на {hbold(mikrotik_name)}.", parse_mode="HTML")
-            asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY))
+            await send_list_message(message, f"Нет активных пиров WireGuard на {hbold(mikrotik_name)}.", AUTO_DELETE_DELAY, edit, parse_mode="HTML")
             return
         
         # Сортируем пиры
@@ -1122,38 +1618,50 @@ async def send_wireguard_peers(message: types.Message, page: int = 1, mikrotik_i
             name = p.get("name", "Неизвестно")
             peer_id = p.get(".id", "")
             if peer_id:
-                row = [
-                    InlineKeyboardButton(text=f"📥 {name}", callback_data=f"download_wg:{mikrotik_id}:{peer_id}"),
-                    InlineKeyboardButton(text=f"🗑️ {name}", callback_data=f"disable_wg:{mikrotik_id}:{peer_id}")
-                ]
+                if selected is None:
+                    row = [
+                        InlineKeyboardButton(text=f"📥 {name}", callback_data=f"download_wg:{mikrotik_id}:{peer_id}"),
+                        InlineKeyboardButton(text=f"🗑️ {name}", callback_data=f"disable_wg:{mikrotik_id}:{peer_id}")
+                    ]
+                else:
+                    row = [selection_button("wg", peer_id, name, selected)]
                 buttons.append(row)
         
+        # В режиме выбора страницы переключаются с сохранением отметок
+        page_prefix = "wg_page:" if selected is None else "sel_page:wg:"
+        
         # Добавляем кнопки навигации
         nav_buttons = []
         
         # Кнопка "Предыдущая"
         if page > 1:
-            nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"wg_page:{page-1}"))
+            nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"{page_prefix}{page-1}"))
         
         # Информация о текущей странице
         nav_buttons.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="page_info"))
         
         # Кнопка "Следующая"
         if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"wg_page:{page+1}"))
+            nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"{page_prefix}{page+1}"))
         
         if nav_buttons:
             buttons.append(nav_buttons)
         
+        buttons.extend(selection_controls("wg", selected, page))
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
         
-        sent_msg = await message.answer(
+        if selected is None:
+            hint = "📥 - Скачать конфигурацию\n🗑️ - Удалить пир\n"
+        else:
+            hint = f"Отметьте пиры и нажмите «{SELECTION_ACTIONS['wg']}». Выбрано: {len(selected)}\n"
+        
+        await send_list_message(
+            message,
             f"Пиры WireGuard на {hbold(mikrotik_name)} (страница {page}/{total_pages}):\n"
-            f"📥 - Скачать конфигурацию\n"
-            f"🗑️ - Удалить пир\n"
-            f"Всего активных пиров: {len(active_peers)}", 
+            f"{hint}"
+            f"Всего активных пиров: {len(active_peers)}",
+            AUTO_DELETE_DELAY * 2,
+            edit,
             reply_markup=keyboard,
             parse_mode="HTML"
-        )
-        
-        asyncio.create_task(delete_message_after_delay(sent_msg, AUTO_DELETE_DELAY * 2))
\ No newline at end of file
+        )
\ No newline at end of file
@@ -1,16 +1,27 @@
 import asyncio
-import logging
 import os
+import time
+
+# Отметка начала запуска для замера этапов загрузки
+BOOT_STARTED = time.perf_counter()
+
+from config import BOT_TOKEN, FSM_STORAGE, WEB_SERVER, WEBHOOK, WATCHDOG
+CONFIG_LOADED = time.perf_counter()
+
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
 from handlers import vpn, admin_panel, connection
 from utils.logging import setup_logger
-
-# Отключаем предупреждения о небезопасных HTTPS запросах
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from utils.broadcast import broadcast, retry_on_flood
+from utils.admin_utils import registry, selections_buffer
+from utils.routeros_client import close_router_sessions, mutation_locks
+from utils.render_pool import render_pool
+from utils.fsm_storage import SqliteStorage, create_fsm_storage
+from utils.metrics import TelegramMetricsMiddleware, instrument_router, metrics
+from utils.loop_watchdog import LoopWatchdog
+from utils.snapshot_cache import snapshot_cache
+from utils.tracing import TracingMiddleware, slow_traces
+from utils.web_server import WebServer, run_webhook
 
 # Создаем необходимые папки, если их нет
 os.makedirs('logs', exist_ok=True)
@@ -21,11 +32,28 @@ os.makedirs('templates/mikrotik_templates', exist_ok=True)
 # Настраиваем логирование
 logger = setup_logger()
 
+# Фоновые задачи, запущенные при старте (храним ссылки, чтобы их не собрал GC)
+background_tasks = set()
+
+async def notify_admins_started(bot: Bot, user_ids):
+    """Рассылает администраторам 1-го уровня сообщение о запуске бота"""
+    async def send_greeting(user_id):
+        await retry_on_flood(lambda: bot.send_message(
+            chat_id=user_id,
+            text="VPN-бот запущен! Используйте /admin для доступа к панели администратора или /connect для подключения к микротику."
+        ))
+    
+    sent, failed = await broadcast(user_ids, send_greeting)
+    logger.info(f"Приветствие при запуске отправлено: {sent}, ошибок: {failed}")
+
 async def main():
     logger.info("Бот запускается...")
     
-    # Создаем хранилище для FSM
-    storage = MemoryStorage()
+    # Кэш конфигурации обновляется только в цикле событий, в том числе после записи из рабочих потоков
+    registry.attach_loop(asyncio.get_running_loop())
+    
+    # Создаем хранилище для FSM (по умолчанию SQLite, чтобы диалоги переживали перезапуск)
+    storage = create_fsm_storage(FSM_STORAGE)
     
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher(storage=storage)
@@ -35,31 +63,97 @@ async def main():
     dp.include_router(admin_panel.router)  # Обработчики админ-панели
     dp.include_router(vpn.router)  # Обработчики VPN
 
+    # Метрики: время обработчиков, запросов к Telegram и статистика внутренних кэшей и пулов
+    for handlers_router in (connection.router, admin_panel.router, vpn.router):
+        instrument_router(handlers_router)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    metrics.register_stats("mutation_locks", mutation_locks.stats)
+    metrics.register_stats("snapshot_cache", snapshot_cache.stats)
+    metrics.register_stats("config_registry", registry.stats)
+    metrics.register_stats("selections_write_buffer", selections_buffer.stats)
+    metrics.register_stats("render_pool", render_pool.stats)
+    if isinstance(storage, SqliteStorage):
+        metrics.register_stats("fsm_write_buffer", storage.buffer.stats)
+
+    # Трассировка: каждое обновление - дерево интервалов (обработчик, запросы к микротикам
+    # и Telegram, рендеринг), самые медленные доступны администратору по /traces
+    dp.update.outer_middleware(TracingMiddleware())
+    metrics.register_stats("traces", slow_traces.stats)
+
+    # Сторожевой поток: пишет в лог стек обработчика, надолго заблокировавшего цикл событий
+    watchdog = LoopWatchdog(WATCHDOG.get("threshold", 0.5), WATCHDOG.get("interval", 0.1))
+    metrics.register_stats("loop_watchdog", watchdog.stats)
+
     # Загружаем список администраторов 1-го уровня из конфигурационного файла
-    from utils.admin_utils import load_admins, save_admins
+    from utils.admin_utils import set_level1_admins
     from config import ALLOWED_USERS
     
+    timings = {"конфигурация": CONFIG_LOADED - BOOT_STARTED}
+    
     # Инициализируем файл с администраторами, если он не существует
+    stage_started = time.perf_counter()
     try:
-        admins = load_admins()
         # Обновляем список администраторов 1-го уровня из конфигурационного файла
-        admins["level_1"] = ALLOWED_USERS
-        save_admins(admins)
+        set_level1_admins(ALLOWED_USERS)
     except Exception as e:
         logger.error(f"Ошибка при инициализации файла администраторов: {e}")
+    timings["синхронизация администраторов"] = time.perf_counter() - stage_started
     
-    # При запуске отправляем меню администраторам 1-го уровня
-    for user_id in ALLOWED_USERS:
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text="VPN-бот запущен! Используйте /admin для доступа к панели администратора или /connect для подключения к микротику."
-            )
-        except Exception as e:
-            logger.error(f"Не удалось отправить приветствие пользователю {user_id}: {e}")
+    # Заранее загружаем реестр микротиков, чтобы первый запрос не ждал чтения файлов
+    stage_started = time.perf_counter()
+    try:
+        registry.mikrotiks()
+        registry.admins()
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке реестра микротиков: {e}")
+    timings["прогрев реестра микротиков"] = time.perf_counter() - stage_started
+    
+    async def on_startup():
+        timings["до начала опроса"] = time.perf_counter() - BOOT_STARTED
+        logger.info("Время запуска: " + ", ".join(f"{stage} {seconds:.3f} с" for stage, seconds in timings.items()))
+        
+        # Приветствие и замер задержки цикла событий работают в фоне и не задерживают прием обновлений
+        background = [notify_admins_started(bot, ALLOWED_USERS)]
+        if WATCHDOG.get("enabled", True):
+            background.append(watchdog.heartbeat())
+            watchdog.start()
+        for coro in background:
+            task = asyncio.create_task(coro)
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+    
+    dp.startup.register(on_startup)
+
+    # Встроенный HTTP-сервер (/health, /metrics, вебхук): обязателен в режиме вебхука
+    web_server = None
+    if WEBHOOK.get("enabled") or WEB_SERVER.get("enabled"):
+        web_server = WebServer(
+            WEB_SERVER.get("host", "0.0.0.0"),
+            WEB_SERVER.get("port", 8080),
+            metrics_token=WEB_SERVER.get("metrics_token", "")
+        )
 
     logger.info("Бот начал работу")
-    await dp.start_polling(bot)
+    try:
+        if WEBHOOK.get("enabled"):
+            logger.info("Режим получения обновлений: вебхук")
+            await run_webhook(dp, bot, web_server, WEBHOOK)
+        else:
+            logger.info("Режим получения обновлений: long polling")
+            if web_server is not None:
+                await web_server.start()
+            # Если раньше бот работал через вебхук, getUpdates вернет ошибку, пока вебхук не удален
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        watchdog.stop()
+        if web_server is not None:
+            await web_server.stop()
+        # Сохраняем отложенные состояния FSM и выборы микротиков, закрываем соединения с микротиками и пул рендеринга
+        await storage.close()
+        await selections_buffer.close()
+        await close_router_sessions()
+        render_pool.shutdown()
 
 if __name__ == "__main__":
     try:
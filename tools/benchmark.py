@@ -0,0 +1,336 @@
+"""
+Бенчмарк слоя работы с микротиком и горячих путей обработчиков.
+
+Каждая операция выполняется против имитатора RouterOS
+(tools/routeros_simulator.py) с таблицами заданного размера. Для каждой
+операции выводятся перцентили задержки, пропускная способность и объем
+данных, полученных от микротика.
+
+Примеры (запускать из корня проекта):
+
+    python tools/benchmark.py
+    python tools/benchmark.py --sizes 100,10000 --iterations 50 --output before.json
+    python tools/benchmark.py --sizes 100,10000 --iterations 50 --compare before.json
+
+В режиме --compare результаты сравниваются с сохраненными ранее (например,
+на другом коммите). Если p50 или p95 операции выросли больше чем на
+--threshold, она помечается как регрессия и скрипт завершается с кодом 1.
+
+Бот запускается во временной папке с отдельным config.json, поэтому
+данные в data/ не затрагиваются.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "tools"))
+
+from routeros_simulator import RouterOSSimulator
+
+DEFAULT_SIZES = [100, 10000, 100000]
+DEFAULT_ITERATIONS = 20
+DEFAULT_THRESHOLD = 0.10
+
+# Администратор 1-го уровня во временной конфигурации бота
+BENCH_ADMIN_ID = 1
+
+OVPN_TEMPLATE = """client
+dev tun
+proto tcp-client
+remote vpn.example.com 1194
+cipher AES-256-CBC
+auth SHA256
+<auth-user-pass>
+{username}
+{password}
+</auth-user-pass>
+"""
+
+
+class RecordingMessage:
+    """Сообщение Telegram для обработчиков: ответы запоминаются, а не отправляются"""
+
+    def __init__(self, user_id: int):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers: List[str] = []
+
+    async def answer(self, text: str, **kwargs: Any) -> "RecordingMessage":
+        self.answers.append(text)
+        return self
+
+    reply = answer
+
+    async def delete(self) -> None:
+        pass
+
+
+def prepare_workdir() -> str:
+    """Создает временную папку с config.json бота и делает ее текущей"""
+    workdir = tempfile.mkdtemp(prefix="vpn_bot_bench_")
+    with open(os.path.join(REPO_ROOT, "config.json"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.update({
+        "allowed_users": [BENCH_ADMIN_ID],
+        "storage": {"backend": "json"},
+        "fsm_storage": {"backend": "memory"},
+        "web_server": {"enabled": False},
+        "webhook": {"enabled": False}
+    })
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    os.chdir(workdir)
+    return workdir
+
+
+def load_bot_modules() -> SimpleNamespace:
+    """Импортирует модули бота (после prepare_workdir, т.к. config.py читает текущую папку)"""
+    from utils import admin_utils, mikrotik_api, wireguard_api, vpn_template
+    from utils.snapshot_cache import snapshot_cache
+    from utils.render_pool import render_pool
+    from utils.routeros_client import close_router_sessions
+    from handlers import vpn
+
+    admin_utils.set_level1_admins([BENCH_ADMIN_ID])
+    return SimpleNamespace(
+        admin_utils=admin_utils,
+        mikrotik_api=mikrotik_api,
+        wireguard_api=wireguard_api,
+        vpn_template=vpn_template,
+        snapshot_cache=snapshot_cache,
+        render_pool=render_pool,
+        close_router_sessions=close_router_sessions,
+        handlers=vpn
+    )
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль с линейной интерполяцией (values отсортированы)"""
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+async def measure(
+    iterations: int,
+    concurrency: int,
+    call: Callable[[int], Awaitable[Any]],
+    before: Optional[Callable[[], None]] = None
+) -> Tuple[List[float], float, int]:
+    """
+    Выполняет call(i) iterations раз, не больше concurrency одновременно
+
+    Returns:
+        (длительности вызовов в секундах, общее время, количество ошибок)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    durations: List[float] = []
+    errors = 0
+
+    async def run_one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            if before is not None:
+                before()
+            started = time.perf_counter()
+            try:
+                result = await call(i)
+                if isinstance(result, str) or (isinstance(result, dict) and result.get("success") is False):
+                    errors += 1
+            except Exception:
+                errors += 1
+            durations.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(i) for i in range(iterations)))
+    return sorted(durations), time.perf_counter() - started, errors
+
+
+def summarize(operation: str, records: int, durations: List[float], total: float, errors: int, received: int) -> Dict[str, Any]:
+    iterations = len(durations)
+    return {
+        "operation": operation,
+        "records": records,
+        "iterations": iterations,
+        "errors": errors,
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p90_ms": round(percentile(durations, 90) * 1000, 3),
+        "p95_ms": round(percentile(durations, 95) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+        "max_ms": round(durations[-1] * 1000, 3) if durations else 0.0,
+        "throughput_ops": round(iterations / total, 2) if total else 0.0,
+        "bytes_per_op": received // iterations if iterations else 0
+    }
+
+
+async def bench_size(bot: SimpleNamespace, size: int, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Прогоняет все операции для таблиц из size записей"""
+    simulator = RouterOSSimulator(secrets=size, peers=size, latency=args.latency, seed=size)
+    url = await simulator.start("127.0.0.1", 0)
+
+    success, message = bot.admin_utils.add_mikrotik(
+        f"bench-{size}", url, "admin", "admin", "default-encryption",
+        "wg0", "vpn.example.com:13231", ["0.0.0.0/0"], BENCH_ADMIN_ID
+    )
+    if not success:
+        raise RuntimeError(message)
+    mikrotik_id = bot.admin_utils.registry.mikrotiks()["mikrotiks"][-1]["id"]
+
+    # Шаблон OpenVPN ищется относительно папки бота, а не текущей папки
+    template_dir = os.path.join(REPO_ROOT, "templates", "mikrotik_templates", mikrotik_id)
+    os.makedirs(template_dir, exist_ok=True)
+    with open(os.path.join(template_dir, "openvpn_template.ovpn"), "w", encoding="utf-8") as f:
+        f.write(OVPN_TEMPLATE)
+
+    def cold() -> None:
+        bot.snapshot_cache.invalidate(mikrotik_id)
+
+    async def render_ovpn(i: int) -> Tuple[bytes, str]:
+        return bot.vpn_template.generate_ovpn_file(f"user{i:06d}", "secret", mikrotik_id)
+
+    operations: List[Tuple[str, Callable[[int], Awaitable[Any]], Optional[Callable[[], None]]]] = [
+        ("get_enabled_openvpn_profiles (cold)", lambda i: bot.mikrotik_api.get_enabled_openvpn_profiles(mikrotik_id), cold),
+        ("get_enabled_openvpn_profiles (warm)", lambda i: bot.mikrotik_api.get_enabled_openvpn_profiles(mikrotik_id), None),
+        ("send_openvpn_profiles (cold)", lambda i: bot.handlers.send_openvpn_profiles(RecordingMessage(BENCH_ADMIN_ID), 1, mikrotik_id), cold),
+        ("add_wireguard_peer", lambda i: bot.wireguard_api.add_wireguard_peer(f"bench{size}-{i:05d}", mikrotik_id), None),
+        ("generate_ovpn_file", render_ovpn, None)
+    ]
+
+    results = []
+    try:
+        for name, call, before in operations:
+            if args.only and not any(part in name for part in args.only):
+                continue
+            bytes_before = simulator.bytes_sent
+            durations, total, errors = await measure(args.iterations, args.concurrency, call, before)
+            result = summarize(name, size, durations, total, errors, simulator.bytes_sent - bytes_before)
+            results.append(result)
+            print(format_row(result), flush=True)
+    finally:
+        bot.admin_utils.delete_mikrotik(mikrotik_id, BENCH_ADMIN_ID)
+        shutil.rmtree(template_dir, ignore_errors=True)
+        await simulator.stop()
+    return results
+
+
+HEADER = f"{'операция':<38} {'записей':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'оп/с':>9} {'байт/оп':>10} {'ошибок':>7}"
+
+
+def format_row(result: Dict[str, Any]) -> str:
+    return (
+        f"{result['operation']:<38} {result['records']:>8} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+        f"{result['p99_ms']:>9.2f} {result['throughput_ops']:>9.1f} {result['bytes_per_op']:>10} {result['errors']:>7}"
+    )
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> bool:
+    """Печатает сравнение с базовым прогоном. Возвращает True, если найдены регрессии"""
+    old = {(r["operation"], r["records"]): r for r in baseline["results"]}
+    regressions = False
+
+    print()
+    print(f"Сравнение с {baseline['meta'].get('revision') or 'базовым прогоном'} (порог {threshold:.0%}):")
+    print(f"{'операция':<38} {'записей':>8} {'p50 было':>9} {'p50 стало':>10} {'p95 было':>9} {'p95 стало':>10}")
+    for result in current["results"]:
+        before = old.get((result["operation"], result["records"]))
+        if before is None:
+            continue
+        slower = [
+            metric for metric in ("p50_ms", "p95_ms")
+            if before[metric] > 0 and result[metric] > before[metric] * (1 + threshold)
+        ]
+        mark = "  РЕГРЕССИЯ" if slower else ""
+        regressions = regressions or bool(slower)
+        print(
+            f"{result['operation']:<38} {result['records']:>8} {before['p50_ms']:>9.2f} {result['p50_ms']:>10.2f} "
+            f"{before['p95_ms']:>9.2f} {result['p95_ms']:>10.2f}{mark}"
+        )
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    bot = load_bot_modules()
+    results = []
+    print(HEADER)
+    try:
+        for size in args.sizes:
+            results.extend(await bench_size(bot, size, args))
+    finally:
+        await bot.close_router_sessions()
+        bot.render_pool.shutdown()
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency
+        },
+        "results": results
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк операций бота против имитатора RouterOS")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Размеры таблиц через запятую")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Вызовов каждой операции")
+    parser.add_argument("--concurrency", type=int, default=1, help="Одновременных вызовов")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа имитатора, мс")
+    parser.add_argument("--only", action="append", help="Запускать только операции, содержащие строку (можно повторять)")
+    parser.add_argument("--output", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--compare", help="Сравнить с результатами из JSON-файла")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Допустимое замедление для --compare (0.1 = 10%%)")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    # Пути из аргументов задаются относительно папки запуска, а бот работает во временной
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = prepare_workdir()
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nРезультаты сохранены в {output}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Перенос данных бота между хранилищами (JSON-файлы <-> SQLite).
+
+Примеры (запускать из корня проекта):
+
+    python tools/migrate_storage.py --to sqlite
+    python tools/migrate_storage.py --to sqlite --sqlite-path data/bot.db --force
+    python tools/migrate_storage.py --to json
+
+Переносятся микротики, администраторы с доступами и выбранные
+пользователями микротики. После записи данные читаются обратно
+и сравниваются с исходными. После переноса укажите новый бэкенд
+в секции "storage" файла config.json и перезапустите бота.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.storage import DEFAULT_SQLITE_PATH, open_stores
+
+
+def count_records(name: str, data: dict) -> int:
+    """Количество записей в документе хранилища"""
+    if name == "mikrotiks":
+        return len(data["mikrotiks"])
+    if name == "admins":
+        return len(data["level_1"]) + len(data["level_2"])
+    return len(data["selections"])
+
+
+def is_empty(data: dict) -> bool:
+    return not any(data.values())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Перенос данных бота между JSON-файлами и SQLite")
+    parser.add_argument("--to", choices=["sqlite", "json"], default="sqlite", help="Целевой бэкенд (по умолчанию sqlite)")
+    parser.add_argument("--sqlite-path", default=DEFAULT_SQLITE_PATH, help=f"Путь к базе SQLite (по умолчанию {DEFAULT_SQLITE_PATH})")
+    parser.add_argument("--force", action="store_true", help="Перезаписать непустое целевое хранилище")
+    args = parser.parse_args()
+
+    source_backend = "json" if args.to == "sqlite" else "sqlite"
+    source = open_stores({"backend": source_backend, "sqlite_path": args.sqlite_path})
+    target = open_stores({"backend": args.to, "sqlite_path": args.sqlite_path})
+
+    documents = {name: store.read()[0] for name, store in source.items()}
+
+    if not args.force:
+        occupied = [name for name, store in target.items() if not is_empty(store.read()[0])]
+        if occupied:
+            print(f"Целевое хранилище ({args.to}) уже содержит данные: {', '.join(occupied)}. "
+                  f"Используйте --force для перезаписи.")
+            return 1
+
+    for name, data in documents.items():
+        target[name].write(data)
+        print(f"{name}: перенесено записей - {count_records(name, data)}")
+
+    # Проверяем, что данные читаются из нового хранилища без потерь
+    mismatched = [name for name, data in documents.items() if target[name].read()[0] != data]
+    if mismatched:
+        print(f"Ошибка: данные в целевом хранилище ({args.to}) отличаются от исходных: {', '.join(mismatched)}. "
+              f"Не переключайте бэкенд в config.json.")
+        return 1
+
+    print(f"Готово: {source_backend} -> {args.to}. Укажите \"backend\": \"{args.to}\" в секции storage файла config.json.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
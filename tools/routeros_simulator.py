@@ -0,0 +1,430 @@
+"""
+Локальный имитатор REST API RouterOS для нагрузочного тестирования.
+
+Реализует таблицы, с которыми работает бот:
+
+    /rest/ppp/secret
+    /rest/ppp/active
+    /rest/interface/wireguard
+    /rest/interface/wireguard/peers
+    /rest/ip/address
+
+Поддерживаются GET (в том числе фильтры ?name=...&.proplist=...),
+PUT, PATCH и DELETE, basic-авторизация, заданный размер таблиц,
+искусственная задержка, доля ошибок и зависших запросов.
+Статистика запросов доступна на GET /sim/stats.
+
+Пример (запускать из корня проекта):
+
+    python tools/routeros_simulator.py --secrets 50000 --peers 5000 --latency 20 --error-rate 0.01
+
+В боте микротик добавляется с адресом http://127.0.0.1:8728 и
+учетными данными admin / admin (см. --username и --password).
+"""
+import argparse
+import asyncio
+import base64
+import ipaddress
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import BasicAuth, web
+
+logger = logging.getLogger("routeros_simulator")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8728
+WG_INTERFACE = "wg0"
+# Подсеть /13 вмещает больше 500 тыс. пиров
+WG_NETWORK = ipaddress.ip_network("10.8.0.0/13")
+
+# Значения по умолчанию, которые RouterOS подставляет в новые записи
+TABLE_DEFAULTS: Dict[str, Dict[str, str]] = {
+    "ppp/secret": {
+        "profile": "default",
+        "service": "any",
+        "disabled": "false"
+    },
+    "ppp/active": {
+        "service": "any",
+        "radius": "false"
+    },
+    "interface/wireguard": {
+        "listen-port": "13231",
+        "mtu": "1420",
+        "running": "true",
+        "disabled": "false"
+    },
+    "interface/wireguard/peers": {
+        "endpoint-address": "",
+        "endpoint-port": "0",
+        "disabled": "false"
+    },
+    "ip/address": {
+        "dynamic": "false",
+        "invalid": "false",
+        "disabled": "false"
+    }
+}
+# Таблицы, в которых несколько записей могут иметь одно имя
+NON_UNIQUE_TABLES = {"ppp/active", "ip/address"}
+
+
+class Table:
+    """
+    Таблица RouterOS: записи по .id в порядке создания.
+
+    Для таблиц с уникальными именами ведется индекс по имени. В остальных
+    (например, /ppp/active: у профиля может быть несколько сессий)
+    записи с одним именем ищутся перебором.
+
+    defaults - поля, которые RouterOS заполняет сама, если клиент их не передал.
+    """
+
+    def __init__(self, path: str, unique_name: bool = True, defaults: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.unique_name = unique_name
+        self.defaults = defaults or {}
+        self.records: Dict[str, Dict[str, str]] = {}
+        self.by_name: Dict[str, str] = {}
+        self._next_id = 1
+
+    def insert(self, record: Dict[str, Any]) -> Dict[str, str]:
+        name = record.get("name")
+        if self.unique_name and name is not None and name in self.by_name:
+            raise SimulatorError(400, "failure: entry with the same name already exists")
+        # RouterOS возвращает все значения строками
+        record = {**self.defaults, **{key: _to_str(value) for key, value in record.items()}}
+        record[".id"] = f"*{self._next_id:X}"
+        self._next_id += 1
+        self.records[record[".id"]] = record
+        if self.unique_name and name is not None:
+            self.by_name[record["name"]] = record[".id"]
+        return record
+
+    def lookup(self, key: str) -> Dict[str, str]:
+        """Запись по .id (*1A) или по имени, как в RouterOS"""
+        if key.startswith("*"):
+            record = self.records.get(key)
+        elif self.unique_name:
+            record = self.records.get(self.by_name.get(key, ""))
+        else:
+            record = next((r for r in self.records.values() if r.get("name") == key), None)
+        if record is None:
+            raise SimulatorError(404, "no such item")
+        return record
+
+    def update(self, key: str, changes: Dict[str, Any]) -> Dict[str, str]:
+        record = self.lookup(key)
+        new_name = changes.get("name")
+        if new_name is not None and new_name != record.get("name"):
+            if self.unique_name:
+                if new_name in self.by_name:
+                    raise SimulatorError(400, "failure: entry with the same name already exists")
+                self.by_name.pop(record.get("name"), None)
+                self.by_name[new_name] = record[".id"]
+        record.update({key: _to_str(value) for key, value in changes.items() if key != ".id"})
+        return record
+
+    def delete(self, key: str) -> None:
+        record = self.lookup(key)
+        del self.records[record[".id"]]
+        if self.unique_name and self.by_name.get(record.get("name")) == record[".id"]:
+            del self.by_name[record["name"]]
+
+    def select(self, filters: Dict[str, str], proplist: Optional[List[str]]) -> List[Dict[str, str]]:
+        if "name" in filters and self.unique_name:
+            # Поиск по уникальному имени - через индекс, как у настоящей таблицы
+            record_id = self.by_name.get(filters["name"])
+            candidates = [self.records[record_id]] if record_id else []
+        else:
+            candidates = self.records.values()
+        result = [r for r in candidates if all(r.get(k) == v for k, v in filters.items())]
+        if proplist:
+            result = [{k: r[k] for k in proplist if k in r} for r in result]
+        return result
+
+
+class SimulatorError(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def _to_str(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def random_key() -> str:
+    """Случайный ключ в формате WireGuard (base64 от 32 байт)"""
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+class RouterOSSimulator:
+    """
+    Имитатор микротика: таблицы с данными и aiohttp-приложение над ними.
+
+    Можно запустить из командной строки или встроить в тест/бенчмарк:
+
+        simulator = RouterOSSimulator(secrets=10000)
+        await simulator.start("127.0.0.1", 0)
+        ... simulator.url ...
+        await simulator.stop()
+    """
+
+    def __init__(
+        self,
+        secrets: int = 100,
+        active: Optional[int] = None,
+        peers: int = 100,
+        username: str = "admin",
+        password: str = "admin",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_delay: float = 30.0,
+        filtering: bool = True,
+        seed: Optional[int] = None
+    ):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self.filtering = filtering
+        self.random = random.Random(seed)
+        self.tables: Dict[str, Table] = {
+            path: Table(path, unique_name=path not in NON_UNIQUE_TABLES, defaults=TABLE_DEFAULTS[path])
+            for path in TABLE_DEFAULTS
+        }
+        self.requests: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.errors_injected = 0
+        self.timeouts_injected = 0
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.populate(secrets, secrets // 10 if active is None else active, peers)
+
+    def populate(self, secrets: int, active: int, peers: int) -> None:
+        """Заполняет таблицы тестовыми данными"""
+        secret_table = self.tables["ppp/secret"]
+        for i in range(secrets):
+            secret_table.insert({
+                "name": f"user{i:06d}",
+                "password": f"pass{i:06d}",
+                "profile": "default-encryption",
+                "service": "ovpn",
+                "disabled": "false",
+                "comment": ""
+            })
+
+        active_table = self.tables["ppp/active"]
+        for i in range(min(active, secrets)):
+            active_table.insert({
+                "name": f"user{i:06d}",
+                "service": "ovpn",
+                "caller-id": f"192.0.2.{i % 254 + 1}",
+                "address": f"172.16.{i // 254 % 256}.{i % 254 + 1}",
+                "uptime": f"{i % 24}h{i % 60}m"
+            })
+
+        self.tables["interface/wireguard"].insert({
+            "name": WG_INTERFACE,
+            "public-key": random_key(),
+            "private-key": random_key(),
+            "listen-port": "13231",
+            "mtu": "1420",
+            "running": "true",
+            "disabled": "false"
+        })
+        self.tables["ip/address"].insert({
+            "address": f"{WG_NETWORK.network_address + 1}/{WG_NETWORK.prefixlen}",
+            "network": str(WG_NETWORK.network_address),
+            "interface": WG_INTERFACE
+        })
+
+        peer_table = self.tables["interface/wireguard/peers"]
+        for i in range(peers):
+            address = WG_NETWORK.network_address + 2 + i
+            peer_table.insert({
+                "name": f"peer{i:06d}",
+                "interface": WG_INTERFACE,
+                "public-key": random_key(),
+                "allowed-address": f"{address}/32",
+                "comment": f"peer{i:06d}",
+                "disabled": "false"
+            })
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_get("/sim/stats", self.handle_stats)
+        app.router.add_route("*", "/rest/{path:.+}", self.handle_rest)
+        return app
+
+    def _resolve(self, path: str) -> Tuple[Table, Optional[str]]:
+        """Разбирает путь запроса на таблицу и ключ записи (.id или имя)"""
+        path = path.strip("/")
+        if path in self.tables:
+            return self.tables[path], None
+        table_path, _, key = path.rpartition("/")
+        if table_path in self.tables:
+            return self.tables[table_path], key
+        raise SimulatorError(404, "no such command or directory")
+
+    def _authorized(self, request: web.Request) -> bool:
+        header = request.headers.get("Authorization")
+        if not header:
+            return False
+        try:
+            auth = BasicAuth.decode(header)
+        except ValueError:
+            return False
+        return auth.login == self.username and auth.password == self.password
+
+    async def _inject_faults(self) -> None:
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.timeout_rate and self.random.random() < self.timeout_rate:
+            self.timeouts_injected += 1
+            await asyncio.sleep(self.timeout_delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors_injected += 1
+            raise SimulatorError(500, "simulated failure")
+
+    def _json(self, data: Any, status: int = 200) -> web.Response:
+        body = json.dumps(data).encode()
+        self.bytes_sent += len(body)
+        return web.Response(body=body, status=status, content_type="application/json")
+
+    def _error(self, status: int, detail: str) -> web.Response:
+        messages = {400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 500: "Internal Server Error"}
+        return self._json({"error": status, "message": messages.get(status, "Error"), "detail": detail}, status)
+
+    async def handle_rest(self, request: web.Request) -> web.Response:
+        counter = f"{request.method} {request.match_info['path'].split('/*')[0]}"
+        self.requests[counter] = self.requests.get(counter, 0) + 1
+
+        if not self._authorized(request):
+            return self._error(401, "not logged in")
+
+        try:
+            await self._inject_faults()
+            table, key = self._resolve(request.match_info["path"])
+
+            if request.method == "GET":
+                if key is not None:
+                    return self._json(table.lookup(key))
+                params = dict(request.query)
+                if params and not self.filtering:
+                    raise SimulatorError(400, "unknown parameter")
+                proplist = params.pop(".proplist", None)
+                filters = {k: v for k, v in params.items() if not k.startswith(".") or k == ".id"}
+                return self._json(table.select(filters, proplist.split(",") if proplist else None))
+
+            if request.method == "PUT" and key is None:
+                return self._json(table.insert(await request.json()), 201)
+
+            if request.method == "PATCH" and key is not None:
+                return self._json(table.update(key, await request.json()))
+
+            if request.method == "DELETE" and key is not None:
+                table.delete(key)
+                return web.Response(status=204)
+
+            raise SimulatorError(400, f"method {request.method} is not supported here")
+        except SimulatorError as e:
+            return self._error(e.status, e.detail)
+        except ValueError:
+            return self._error(400, "invalid JSON")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "errors_injected": self.errors_injected,
+            "timeouts_injected": self.timeouts_injected,
+            "tables": {path: len(table.records) for path, table in self.tables.items()}
+        })
+
+    async def start(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> str:
+        """Запускает сервер и возвращает его адрес (порт 0 - любой свободный)"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Имитатор REST API RouterOS")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--secrets", type=int, default=1000, help="Количество PPP-секретов")
+    parser.add_argument("--active", type=int, default=None, help="Количество активных сессий (по умолчанию 10%% секретов)")
+    parser.add_argument("--peers", type=int, default=100, help="Количество пиров WireGuard")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержки, +/- мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов, завершающихся ошибкой 500 (0..1)")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Доля запросов, ответ на которые задерживается на --timeout-delay (0..1)")
+    parser.add_argument("--timeout-delay", type=float, default=30.0, help="Задержка \"зависших\" запросов, с")
+    parser.add_argument("--no-filtering", action="store_true", help="Отвечать 400 на фильтры в GET, как старые прошивки")
+    parser.add_argument("--seed", type=int, default=None, help="Начальное значение генератора случайных чисел")
+    return parser
+
+
+async def serve(args: argparse.Namespace) -> None:
+    started = time.perf_counter()
+    simulator = RouterOSSimulator(
+        secrets=args.secrets,
+        active=args.active,
+        peers=args.peers,
+        username=args.username,
+        password=args.password,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_delay=args.timeout_delay,
+        filtering=not args.no_filtering,
+        seed=args.seed
+    )
+    url = await simulator.start(args.host, args.port)
+    tables = ", ".join(f"{path}: {len(table.records)}" for path, table in simulator.tables.items())
+    logger.info(f"Имитатор RouterOS запущен на {url} за {time.perf_counter() - started:.2f} с ({tables})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    args = build_parser().parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        logger.info("Имитатор остановлен")
+
+
+if __name__ == "__main__":
+    main()
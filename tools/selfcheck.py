@@ -0,0 +1,251 @@
+"""
+Самопроверка кэшей, пула адресов WireGuard и хранилища SQLite.
+
+Проверки не обращаются к микротикам и к Telegram и выполняются во
+временной папке, поэтому данные в data/ не затрагиваются.
+
+Пример (запускать из корня проекта):
+
+    python tools/selfcheck.py
+    python tools/selfcheck.py --only allocator
+
+Скрипт завершается с кодом 1, если хотя бы одна проверка не прошла.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from typing import Callable, Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def prepare_workdir() -> str:
+    """Создает временную папку с config.json бота и делает ее текущей"""
+    workdir = tempfile.mkdtemp(prefix="vpn_bot_check_")
+    with open(os.path.join(REPO_ROOT, "config.json"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.update({
+        "storage": {"backend": "json"},
+        "fsm_storage": {"backend": "memory"},
+        "web_server": {"enabled": False},
+        "webhook": {"enabled": False}
+    })
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    os.chdir(workdir)
+    return workdir
+
+
+def peer(address: str) -> Dict[str, str]:
+    return {"allowed-address": address, "interface": "wg0"}
+
+
+def check_allocator_reuse() -> None:
+    from utils.ip_allocator import AddressPool
+
+    pool = AddressPool(ipaddress.ip_network("10.0.0.0/29"), reserved=[ipaddress.ip_address("10.0.0.1")])
+    first = pool.allocate()
+    second = pool.allocate()
+    assert (str(first), str(second)) == ("10.0.0.2", "10.0.0.3"), (first, second)
+
+    # Неудачное создание пира возвращает адрес первым в очередь
+    pool.release(first)
+    assert pool.allocate() == first
+
+    # Адрес удаленного пира снова выдается после синхронизации
+    pool.commit(first)
+    pool.commit(second)
+    pool.sync([peer("10.0.0.2/32"), peer("10.0.0.3/32")])
+    pool.sync([peer("10.0.0.3/32")])
+    assert pool.allocate() == first
+
+
+def check_allocator_exhaustion() -> None:
+    from utils.ip_allocator import AddressPool, AddressPoolExhausted, PENDING_TTL
+
+    # В /30 два адреса для хостов
+    pool = AddressPool(ipaddress.ip_network("10.0.0.0/30"))
+    pool.sync([peer("10.0.0.2/32")])
+    address = pool.allocate()
+    assert str(address) == "10.0.0.1", address
+    try:
+        pool.allocate()
+    except AddressPoolExhausted:
+        pass
+    else:
+        raise AssertionError("Пул /30 должен быть исчерпан")
+
+    # Пир не появился в таблице до истечения резерва - адрес снова свободен
+    pool.commit(address)
+    pool._pending[int(address) - int(pool.network.network_address)] = time.monotonic() - PENDING_TTL
+    pool.sync([peer("10.0.0.2/32")])
+    assert pool.allocate() == address
+
+
+def check_allocator_ipv6() -> None:
+    from utils.ip_allocator import AddressPool, peer_dns
+
+    network = ipaddress.ip_network("fd00::/64")
+    server = ipaddress.ip_address("fd00::1")
+    pool = AddressPool(network, reserved=[server], dns=str(server))
+    pool.sync([peer("fd00::2/128"), peer("10.0.0.2/32")])
+    address = pool.allocate()
+    assert str(address) == "fd00::3", address
+    assert pool.format(address) == "fd00::3/128"
+    assert peer_dns("fd00::3/128", pool) == "fd00::1"
+    assert pool.stats()["capacity"] == 2 ** 64 - 2
+
+
+def check_allocator_fallback() -> None:
+    from utils.ip_allocator import _discover_pool
+
+    class NoAddresses:
+        async def find(self, *args, **kwargs):
+            return []
+
+    # Подсеть по адресам пиров: первый адрес - интерфейс сервера и DNS клиентов
+    pool = asyncio.run(_discover_pool(NoAddresses(), "wg0", [peer("10.0.0.5/32")]))
+    assert pool.dns == "10.0.0.1", pool.dns
+    assert str(pool.allocate()) == "10.0.0.2"
+
+
+def check_snapshot_cache() -> None:
+    from utils.snapshot_cache import SnapshotCache
+
+    async def run() -> None:
+        cache = SnapshotCache(ttl=60)
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [len(calls)]
+
+        # Одновременные запросы объединяются в одну загрузку
+        results = await asyncio.gather(*(cache.get("m1", "secrets", fetch) for _ in range(5)))
+        assert len(calls) == 1 and all(r == [1] for r in results), (calls, results)
+        assert await cache.get("m1", "secrets", fetch) == [1]
+
+        cache.invalidate("m1")
+        assert await cache.get("m1", "secrets", fetch) == [2]
+
+        # Ошибки загрузки не кэшируются
+        async def failing():
+            raise RuntimeError("boom")
+
+        try:
+            await cache.get("m1", "peers", failing)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Ошибка загрузки должна передаваться вызывающему")
+        assert await cache.get("m1", "peers", fetch) == [3]
+
+    asyncio.run(run())
+
+
+def check_sqlite_cas() -> None:
+    from utils.storage import SqliteDatabase, SqliteAdminStore, SqliteMikrotikStore, VersionConflict, open_stores, transaction
+
+    stores = open_stores({"backend": "sqlite", "sqlite_path": "check.db"})
+    mikrotiks, admins = stores["mikrotiks"], stores["admins"]
+
+    data, version = mikrotiks.read()
+    data["mikrotiks"].append({"id": "m1", "name": "Office", "host": "https://10.0.0.1"})
+    mikrotiks.write(data, version)
+
+    # Запись по устаревшей версии отклоняется
+    data["mikrotiks"].append({"id": "m2", "name": "Stale", "host": "https://10.0.0.2"})
+    try:
+        mikrotiks.write(data, version)
+    except VersionConflict:
+        pass
+    else:
+        raise AssertionError("Запись по устаревшей версии должна вызывать VersionConflict")
+
+    # Конфликт в одном документе транзакции не записывает и остальные
+    admins_before = admins.read()[0]
+    try:
+        with transaction(mikrotiks, admins) as tx:
+            admins_data = tx.read(admins)
+            admins_data["level_1"].append(42)
+            tx.write(admins, admins_data)
+            tx.read(mikrotiks)
+            mikrotiks.write({"mikrotiks": []})  # изменение в обход транзакции
+            tx.write(mikrotiks, {"mikrotiks": [{"id": "m3", "name": "Lost", "host": "h"}]})
+    except VersionConflict:
+        pass
+    else:
+        raise AssertionError("Транзакция с изменившимся документом должна вызывать VersionConflict")
+    assert admins.read()[0] == admins_before
+
+    # Частичная запись строк сохраняет документ целиком: проверяем новым соединением
+    with transaction(admins) as tx:
+        admins_data = tx.read(admins)
+        admins_data["level_1"] = [1, 2]
+        admins_data["level_2"] = [{"id": 2, "name": "Ops", "allowed_mikrotiks": ["m1"]}]
+        tx.write(admins, admins_data)
+    with transaction(admins) as tx:
+        admins_data = tx.read(admins)
+        admins_data["level_1"].remove(1)
+        admins_data["level_2"][0]["allowed_mikrotiks"] = []
+        tx.write(admins, admins_data)
+
+    db = SqliteDatabase("check.db")
+    try:
+        assert SqliteAdminStore(db).read()[0] == {
+            "level_1": [2],
+            "level_2": [{"id": 2, "name": "Ops", "allowed_mikrotiks": []}]
+        }
+        assert SqliteMikrotikStore(db).read()[0] == {"mikrotiks": []}
+    finally:
+        db.close()
+        mikrotiks.db.close()
+
+
+CHECKS: List[Tuple[str, Callable[[], None]]] = [
+    ("allocator: повторная выдача адресов", check_allocator_reuse),
+    ("allocator: исчерпание /30 и истекший резерв", check_allocator_exhaustion),
+    ("allocator: IPv6", check_allocator_ipv6),
+    ("allocator: подсеть по адресам пиров", check_allocator_fallback),
+    ("snapshot_cache: объединение запросов и сброс", check_snapshot_cache),
+    ("storage: конфликт версий SQLite", check_sqlite_cas)
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Самопроверка кэшей, пула адресов и хранилища")
+    parser.add_argument("--only", action="append", help="Запускать только проверки, содержащие строку (можно повторять)")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir()
+    failed = 0
+    try:
+        for title, check in CHECKS:
+            if args.only and not any(part in title for part in args.only):
+                continue
+            try:
+                check()
+            except Exception:
+                failed += 1
+                print(f"FAIL {title}")
+                traceback.print_exc()
+            else:
+                print(f"ok   {title}")
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,72 +1,258 @@
-import json
+import asyncio
+import copy
+import logging
 import os
+import threading
 import uuid
-from typing import List, Dict, Any, Union, Tuple
+from typing import List, Dict, Any, Union, Tuple, Callable, Optional
 
-# Пути к файлам данных
-MIKROTIKS_FILE = 'data/mikrotiks.json'
-ADMINS_FILE = 'data/admins.json'
+from config import STORAGE
+from utils.storage import VersionConflict, Version, open_stores, transaction
+from utils.write_buffer import WriteBehindBuffer
 
-# Создаем директорию и файлы, если их нет
-os.makedirs('data', exist_ok=True)
-if not os.path.exists(MIKROTIKS_FILE):
-    with open(MIKROTIKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump({"mikrotiks": []}, f, indent=2)
+logger = logging.getLogger("vpn_bot")
 
-if not os.path.exists(ADMINS_FILE):
-    with open(ADMINS_FILE, 'w', encoding='utf-8') as f:
-        json.dump({"level_1": [], "level_2": []}, f, indent=2)
+# Хранилища данных: JSON-файлы в data/ (по умолчанию) или база SQLite,
+# в зависимости от секции "storage" в config.json
+stores = open_stores(STORAGE)
+mikrotiks_store = stores["mikrotiks"]
+admins_store = stores["admins"]
+selections_store = stores["user_selections"]
+
+class ConfigRegistry:
+    """
+    Кэш данных микротиков, администраторов и выбранных пользователями микротиков.
+
+    Данные читаются из хранилища один раз и перечитываются только при
+    изменении версии (mtime файла или счетчика записей в SQLite) или после
+    сохранения через save_*. Поиск по ID микротика, ID администратора
+    и ID пользователя выполняется по словарям-индексам.
+
+    Кэш читается и изменяется только в потоке цикла событий. Записи из
+    рабочих потоков (отложенная запись выбранных микротиков) передаются
+    в цикл через call_soon_threadsafe, если он подключен через attach_loop().
+    """
+
+    def __init__(self, mikrotiks_store: Any, admins_store: Any, selections_store: Any):
+        self.mikrotiks_store = mikrotiks_store
+        self.admins_store = admins_store
+        self.selections_store = selections_store
+        self.hits = 0
+        self.misses = 0
+        self._mikrotiks: Optional[Dict] = None
+        self._mikrotiks_version: Version = None
+        self._mikrotiks_by_id: Dict[str, Dict] = {}
+        self._admins: Optional[Dict] = None
+        self._admins_version: Version = None
+        self._level_1: set = set()
+        self._level_2_by_id: Dict[int, Dict] = {}
+        self._selections: Optional[Dict] = None
+        self._selections_version: Version = None
+        self._selection_by_user: Dict[int, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Подключает цикл событий, в котором работают обработчики"""
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+    def _publish(self, apply: Callable[[Dict, Version], None], data: Dict, version: Version) -> None:
+        """Применяет записанные данные к кэшу в потоке цикла событий"""
+        data = copy.deepcopy(data)
+        if self._loop is not None and threading.get_ident() != self._loop_thread and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(apply, data, version)
+        else:
+            apply(data, version)
+
+    def _set_mikrotiks(self, data: Dict, version: Version) -> None:
+        self._mikrotiks = data
+        self._mikrotiks_version = version
+        self._mikrotiks_by_id = {m["id"]: m for m in data["mikrotiks"]}
+
+    def _set_admins(self, data: Dict, version: Version) -> None:
+        self._admins = data
+        self._admins_version = version
+        self._level_1 = set(data["level_1"])
+        self._level_2_by_id = {a["id"]: a for a in data["level_2"]}
+
+    def _set_selections(self, data: Dict, version: Version) -> None:
+        self._selections = data
+        self._selections_version = version
+        self._selection_by_user = {int(user_id): m_id for user_id, m_id in data["selections"].items()}
+
+    def mikrotiks(self) -> Dict:
+        """Возвращает закэшированный список микротиков (только для чтения)"""
+        if self._mikrotiks is None or self.mikrotiks_store.version() != self._mikrotiks_version:
+            self.misses += 1
+            self._set_mikrotiks(*self.mikrotiks_store.read())
+        else:
+            self.hits += 1
+        return self._mikrotiks
+
+    def admins(self) -> Dict:
+        """Возвращает закэшированный список администраторов (только для чтения)"""
+        if self._admins is None or self.admins_store.version() != self._admins_version:
+            self.misses += 1
+            self._set_admins(*self.admins_store.read())
+        else:
+            self.hits += 1
+        return self._admins
+
+    def selections(self) -> Dict:
+        """Возвращает закэшированные выборы микротиков пользователями (только для чтения)"""
+        if self._selections is None or self.selections_store.version() != self._selections_version:
+            self.misses += 1
+            self._set_selections(*self.selections_store.read())
+        else:
+            self.hits += 1
+        return self._selections
+
+    def get_mikrotik(self, mikrotik_id: str) -> Union[Dict, None]:
+        self.mikrotiks()
+        return self._mikrotiks_by_id.get(mikrotik_id)
+
+    def mikrotik_ids(self) -> List[str]:
+        return [m["id"] for m in self.mikrotiks()["mikrotiks"]]
+
+    def is_level1(self, user_id: int) -> bool:
+        self.admins()
+        return user_id in self._level_1
+
+    def get_level2_admin(self, user_id: int) -> Union[Dict, None]:
+        self.admins()
+        return self._level_2_by_id.get(user_id)
+
+    def get_selection(self, user_id: int) -> Optional[str]:
+        self.selections()
+        return self._selection_by_user.get(user_id)
+
+    def mikrotiks_saved(self, data: Dict, version: Version) -> None:
+        """Обновляет кэш после записи списка микротиков"""
+        self._publish(self._set_mikrotiks, data, version)
+
+    def admins_saved(self, data: Dict, version: Version) -> None:
+        """Обновляет кэш после записи списка администраторов"""
+        self._publish(self._set_admins, data, version)
+
+    def selections_saved(self, data: Dict, version: Version) -> None:
+        """Обновляет кэш после записи выбранных микротиков"""
+        self._publish(self._set_selections, data, version)
+
+    def invalidate(self) -> None:
+        """Сбрасывает кэш, данные будут перечитаны при следующем обращении"""
+        self._mikrotiks = None
+        self._admins = None
+        self._selections = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+registry = ConfigRegistry(mikrotiks_store, admins_store, selections_store)
+mikrotiks_store.on_saved = registry.mikrotiks_saved
+admins_store.on_saved = registry.admins_saved
+selections_store.on_saved = registry.selections_saved
 
 def load_mikrotiks() -> Dict:
-    """Загружает список микротиков из файла"""
-    with open(MIKROTIKS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Загружает список микротиков (копию, которую можно изменять и сохранять)"""
+    return copy.deepcopy(registry.mikrotiks())
 
 def save_mikrotiks(data: Dict) -> None:
-    """Сохраняет список микротиков в файл"""
-    with open(MIKROTIKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2)
+    """Сохраняет список микротиков в хранилище"""
+    mikrotiks_store.write(data)
 
 def load_admins() -> Dict:
-    """Загружает список администраторов из файла"""
-    with open(ADMINS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Загружает список администраторов (копию, которую можно изменять и сохранять)"""
+    return copy.deepcopy(registry.admins())
 
 def save_admins(data: Dict) -> None:
-    """Сохраняет список администраторов в файл"""
-    with open(ADMINS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2)
+    """Сохраняет список администраторов в хранилище"""
+    admins_store.write(data)
+
+def set_level1_admins(user_ids: List[int]) -> None:
+    """Заменяет список администраторов 1-го уровня (из конфигурационного файла)"""
+    with transaction(admins_store) as tx:
+        admins_data = tx.read(admins_store)
+        admins_data["level_1"] = list(user_ids)
+        tx.write(admins_store, admins_data)
+
+def _write_selections(batch: Dict[str, str]) -> None:
+    """Сохраняет пачку выборов микротиков (выполняется в отдельном потоке)"""
+    with transaction(mikrotiks_store, selections_store) as tx:
+        # Выбор микротика, удаленного до записи, не сохраняем
+        existing = {m["id"] for m in tx.read(mikrotiks_store)["mikrotiks"]}
+        selections_data = tx.read(selections_store)
+        for user_id, mikrotik_id in batch.items():
+            if mikrotik_id in existing:
+                selections_data["selections"][user_id] = mikrotik_id
+        tx.write(selections_store, selections_data)
+
+# Выборы микротиков записываются отложенно, чтобы /connect не ждал записи на диск
+selections_buffer = WriteBehindBuffer(_write_selections, description="выбранных микротиков")
+
+def get_user_mikrotik(user_id: int) -> Optional[str]:
+    """Возвращает ID микротика, выбранного пользователем через /connect"""
+    pending = selections_buffer.get(str(user_id))
+    if pending is not None and registry.get_mikrotik(pending) is not None:
+        return pending
+    return registry.get_selection(user_id)
+
+async def set_user_mikrotik(user_id: int, mikrotik_id: str) -> None:
+    """Сохраняет выбранный пользователем микротик (запись на диск - в фоне)"""
+    await selections_buffer.put(str(user_id), mikrotik_id)
+
+def get_registry_stats() -> Dict[str, int]:
+    """Возвращает счетчики попаданий и промахов кэша конфигурации"""
+    return registry.stats()
+
+# Обработчики, вызываемые при изменении или удалении микротика
+_mikrotik_listeners: List[Callable[[str, Optional[str]], None]] = []
+
+def register_mikrotik_listener(callback: Callable[[str, Optional[str]], None]) -> None:
+    """
+    Регистрирует обработчик изменений микротика.
+    Обработчик вызывается как callback(mikrotik_id, field), где field - имя
+    измененного поля, "openvpn_template" при загрузке шаблона или None,
+    если микротик удален.
+    """
+    _mikrotik_listeners.append(callback)
+
+def _notify_mikrotik_changed(mikrotik_id: str, field: Optional[str]) -> None:
+    """Оповещает подписчиков об изменении микротика"""
+    for callback in _mikrotik_listeners:
+        try:
+            callback(mikrotik_id, field)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика изменения микротика {mikrotik_id}: {e}")
 
 def check_admin_level(user_id: int) -> int:
     """
     Проверяет уровень администратора.
     Возвращает: 1 - для админа 1-го уровня, 2 - для админа 2-го уровня, 0 - не админ
     """
-    admins = load_admins()
-    
-    if user_id in admins["level_1"]:
+    if registry.is_level1(user_id):
         return 1
     
-    for admin in admins["level_2"]:
-        if admin["id"] == user_id:
-            return 2
+    if registry.get_level2_admin(user_id) is not None:
+        return 2
     
     return 0
 
+def get_level2_admin(user_id: int) -> Union[Dict, None]:
+    """Возвращает данные администратора 2-го уровня по ID"""
+    return registry.get_level2_admin(user_id)
+
 def get_allowed_mikrotiks(user_id: int) -> List[str]:
     """Возвращает список ID микротиков, доступных администратору"""
-    admins = load_admins()
-    mikrotiks_data = load_mikrotiks()
-    mikrotik_ids = [m["id"] for m in mikrotiks_data["mikrotiks"]]
-    
     # Админы 1-го уровня имеют доступ ко всем микротикам
-    if user_id in admins["level_1"]:
-        return mikrotik_ids
+    if registry.is_level1(user_id):
+        return registry.mikrotik_ids()
     
     # Админы 2-го уровня имеют доступ только к разрешенным микротикам
-    for admin in admins["level_2"]:
-        if admin["id"] == user_id:
-            return admin["allowed_mikrotiks"]
+    admin = registry.get_level2_admin(user_id)
+    if admin is not None:
+        return list(admin["allowed_mikrotiks"])
     
     return []
 
@@ -91,8 +277,6 @@ def add_mikrotik(
     if check_admin_level(admin_id) != 1:
         return False, "Доступ запрещён. Требуется уровень администратора 1."
     
-    mikrotiks_data = load_mikrotiks()
-    
     # Генерируем уникальный ID для микротика
     mikrotik_id = f"mikrotik_{str(uuid.uuid4())[:8]}"
     
@@ -117,9 +301,14 @@ def add_mikrotik(
         }
     }
     
-    # Добавляем микротик в список
-    mikrotiks_data["mikrotiks"].append(new_mikrotik)
-    save_mikrotiks(mikrotiks_data)
+    # Добавляем микротик в список (запись отклоняется, если список изменился после чтения)
+    try:
+        with transaction(mikrotiks_store) as tx:
+            mikrotiks_data = tx.read(mikrotiks_store)
+            mikrotiks_data["mikrotiks"].append(new_mikrotik)
+            tx.write(mikrotiks_store, mikrotiks_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
     return True, f"Микротик {name} успешно добавлен с ID {mikrotik_id}"
 
@@ -134,21 +323,13 @@ def upload_openvpn_template(mikrotik_id: str, template_content: str, admin_id: i
     if check_admin_level(admin_id) != 1:
         return False, "Доступ запрещён. Требуется уровень администратора 1."
     
-    mikrotiks_data = load_mikrotiks()
-    
     # Проверяем существование микротика
-    mikrotik_exists = False
-    mikrotik_name = ""
-    
-    for mikrotik in mikrotiks_data["mikrotiks"]:
-        if mikrotik["id"] == mikrotik_id:
-            mikrotik_exists = True
-            mikrotik_name = mikrotik.get("name", "")
-            break
-    
-    if not mikrotik_exists:
+    mikrotik = registry.get_mikrotik(mikrotik_id)
+    if mikrotik is None:
         return False, f"Микротик с ID {mikrotik_id} не найден."
     
+    mikrotik_name = mikrotik.get("name", "")
+    
     # Сохраняем шаблон
     template_dir = os.path.join('templates', 'mikrotik_templates', mikrotik_id)
     os.makedirs(template_dir, exist_ok=True)
@@ -159,6 +340,9 @@ def upload_openvpn_template(mikrotik_id: str, template_content: str, admin_id: i
         with open(template_path, 'w', encoding='utf-8') as f:
             f.write(template_content)
         
+        # Сбрасываем закэшированный шаблон
+        _notify_mikrotik_changed(mikrotik_id, "openvpn_template")
+        
         return True, f"✅ Шаблон OpenVPN для микротика {mikrotik_name} (ID: {mikrotik_id}) успешно загружен."
     except Exception as e:
         return False, f"❌ Ошибка при сохранении шаблона: {e}"
@@ -179,54 +363,47 @@ def add_level2_admin(
     if check_admin_level(creator_id) != 1:
         return False, "Доступ запрещён. Требуется уровень администратора 1."
     
-    admins_data = load_admins()
-    
-    # Проверяем, что админ не существует
-    if new_admin_id in admins_data["level_1"]:
-        return False, f"Пользователь {new_admin_id} уже является администратором 1-го уровня."
-    
-    for admin in admins_data["level_2"]:
-        if admin["id"] == new_admin_id:
-            return False, f"Пользователь {new_admin_id} уже является администратором 2-го уровня."
-    
     # Проверяем существование микротиков
-    mikrotiks_data = load_mikrotiks()
-    existing_mikrotik_ids = [m["id"] for m in mikrotiks_data["mikrotiks"]]
-    
     for mikrotik_id in allowed_mikrotiks:
-        if mikrotik_id not in existing_mikrotik_ids:
+        if registry.get_mikrotik(mikrotik_id) is None:
             return False, f"Микротик с ID {mikrotik_id} не существует."
     
-    # Добавляем нового администратора
-    new_admin = {
-        "id": new_admin_id,
-        "name": name,
-        "allowed_mikrotiks": allowed_mikrotiks
-    }
-    
-    admins_data["level_2"].append(new_admin)
-    save_admins(admins_data)
+    try:
+        with transaction(admins_store) as tx:
+            admins_data = tx.read(admins_store)
+            
+            # Проверяем, что админ не существует (по прочитанной версии)
+            if new_admin_id in admins_data["level_1"]:
+                return False, f"Пользователь {new_admin_id} уже является администратором 1-го уровня."
+            
+            if any(admin["id"] == new_admin_id for admin in admins_data["level_2"]):
+                return False, f"Пользователь {new_admin_id} уже является администратором 2-го уровня."
+            
+            # Добавляем нового администратора
+            new_admin = {
+                "id": new_admin_id,
+                "name": name,
+                "allowed_mikrotiks": allowed_mikrotiks
+            }
+            
+            admins_data["level_2"].append(new_admin)
+            tx.write(admins_store, admins_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
     return True, f"Администратор {name} (ID: {new_admin_id}) успешно добавлен."
 
 def get_mikrotik_by_id(mikrotik_id: str) -> Union[Dict, None]:
-    """Возвращает данные микротика по ID"""
-    mikrotiks_data = load_mikrotiks()
-    
-    for mikrotik in mikrotiks_data["mikrotiks"]:
-        if mikrotik["id"] == mikrotik_id:
-            return mikrotik
-    
-    return None
+    """Возвращает данные микротика по ID (только для чтения)"""
+    return registry.get_mikrotik(mikrotik_id)
 
 def get_mikrotik_list(user_id: int) -> List[Dict]:
     """Возвращает список микротиков, доступных пользователю"""
-    allowed_mikrotik_ids = get_allowed_mikrotiks(user_id)
-    mikrotiks_data = load_mikrotiks()
+    allowed_mikrotik_ids = set(get_allowed_mikrotiks(user_id))
     
     return [
         {"id": m["id"], "name": m["name"]} 
-        for m in mikrotiks_data["mikrotiks"] 
+        for m in registry.mikrotiks()["mikrotiks"] 
         if m["id"] in allowed_mikrotik_ids
     ]
 
@@ -236,31 +413,47 @@ def delete_mikrotik(mikrotik_id: str, admin_id: int) -> Tuple[bool, str]:
     if check_admin_level(admin_id) != 1:
         return False, "Доступ запрещён. Требуется уровень администратора 1."
     
-    mikrotiks_data = load_mikrotiks()
-    
-    # Ищем микротик для удаления
-    for i, mikrotik in enumerate(mikrotiks_data["mikrotiks"]):
-        if mikrotik["id"] == mikrotik_id:
-            # Удаляем микротик из списка
-            del mikrotiks_data["mikrotiks"][i]
-            save_mikrotiks(mikrotiks_data)
+    # Все данные меняются в одной транзакции: версии проверяются до записи
+    try:
+        with transaction(mikrotiks_store, admins_store, selections_store) as tx:
+            mikrotiks_data = tx.read(mikrotiks_store)
+            
+            # Ищем микротик для удаления
+            remaining = [m for m in mikrotiks_data["mikrotiks"] if m["id"] != mikrotik_id]
+            if len(remaining) == len(mikrotiks_data["mikrotiks"]):
+                return False, f"Микротик с ID {mikrotik_id} не найден."
             
-            # Удаляем шаблоны
-            template_dir = os.path.join('templates', 'mikrotik_templates', mikrotik_id)
-            if os.path.exists(template_dir):
-                import shutil
-                shutil.rmtree(template_dir)
+            # Удаляем микротик из списка
+            mikrotiks_data["mikrotiks"] = remaining
+            tx.write(mikrotiks_store, mikrotiks_data)
             
             # Удаляем разрешения для админов 2-го уровня
-            admins_data = load_admins()
+            admins_data = tx.read(admins_store)
             for admin in admins_data["level_2"]:
                 if mikrotik_id in admin["allowed_mikrotiks"]:
                     admin["allowed_mikrotiks"].remove(mikrotik_id)
-            save_admins(admins_data)
+            tx.write(admins_store, admins_data)
             
-            return True, f"Микротик {mikrotik_id} успешно удален."
+            # Сбрасываем выбор удаленного микротика у пользователей
+            selections_data = tx.read(selections_store)
+            selections = selections_data["selections"]
+            stale = [user_id for user_id, m_id in selections.items() if m_id == mikrotik_id]
+            if stale:
+                for user_id in stale:
+                    del selections[user_id]
+                tx.write(selections_store, selections_data)
+    except VersionConflict:
+        return False, "Данные изменились во время удаления. Попробуйте еще раз."
+
+    # Удаляем шаблоны
+    template_dir = os.path.join('templates', 'mikrotik_templates', mikrotik_id)
+    if os.path.exists(template_dir):
+        import shutil
+        shutil.rmtree(template_dir)
+    
+    _notify_mikrotik_changed(mikrotik_id, None)
     
-    return False, f"Микротик с ID {mikrotik_id} не найден."
+    return True, f"Микротик {mikrotik_id} успешно удален."
 
 def delete_admin(admin_id: int, creator_id: int) -> Tuple[bool, str]:
     """Удаляет администратора 2-го уровня"""
@@ -268,16 +461,22 @@ def delete_admin(admin_id: int, creator_id: int) -> Tuple[bool, str]:
     if check_admin_level(creator_id) != 1:
         return False, "Доступ запрещён. Требуется уровень администратора 1."
     
-    admins_data = load_admins()
-    
-    # Ищем админа для удаления
-    for i, admin in enumerate(admins_data["level_2"]):
-        if admin["id"] == admin_id:
-            del admins_data["level_2"][i]
-            save_admins(admins_data)
-            return True, f"Администратор {admin_id} успешно удален."
-    
-    return False, f"Администратор с ID {admin_id} не найден."
+    try:
+        with transaction(admins_store) as tx:
+            admins_data = tx.read(admins_store)
+            
+            # Ищем админа для удаления
+            for i, admin in enumerate(admins_data["level_2"]):
+                if admin["id"] == admin_id:
+                    del admins_data["level_2"][i]
+                    tx.write(admins_store, admins_data)
+                    break
+            else:
+                return False, f"Администратор с ID {admin_id} не найден."
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
+    
+    return True, f"Администратор {admin_id} успешно удален."
 
 def edit_mikrotik_field(mikrotik_id: str, field: str, value, admin_id: int) -> Tuple[bool, str]:
     """
@@ -296,36 +495,35 @@ def edit_mikrotik_field(mikrotik_id: str, field: str, value, admin_id: int) -> T
     if check_admin_level(admin_id) != 1:
         return False, "Доступ запрещён. Требуется уровень администратора 1."
     
-    mikrotiks_data = load_mikrotiks()
-    
-    # Ищем микротик для редактирования
-    mikrotik_found = False
-    mikrotik_idx = -1
-    for idx, mikrotik in enumerate(mikrotiks_data["mikrotiks"]):
-        if mikrotik["id"] == mikrotik_id:
-            mikrotik_found = True
-            mikrotik_idx = idx
-            break
-    
-    if not mikrotik_found:
-        return False, f"Микротик с ID {mikrotik_id} не найден."
+    try:
+        with transaction(mikrotiks_store) as tx:
+            mikrotiks_data = tx.read(mikrotiks_store)
+            
+            # Ищем микротик для редактирования
+            mikrotik = next((m for m in mikrotiks_data["mikrotiks"] if m["id"] == mikrotik_id), None)
+            if mikrotik is None:
+                return False, f"Микротик с ID {mikrotik_id} не найден."
+            
+            # Редактируем соответствующее поле
+            if field in ["name", "host", "username", "password"]:
+                mikrotik[field] = value
+            elif field == "ovpn_profile":
+                mikrotik["openvpn"]["profile"] = value
+            elif field == "wg_interface":
+                mikrotik["wireguard"]["interface_name"] = value
+            elif field == "wg_endpoint":
+                mikrotik["wireguard"]["endpoint"] = value
+            elif field == "wg_allowed_ips":
+                mikrotik["wireguard"]["allowed_ips"] = value
+            else:
+                return False, f"Неизвестное поле {field}."
+            
+            # Сохраняем изменения
+            tx.write(mikrotiks_store, mikrotiks_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
-    # Редактируем соответствующее поле
-    if field in ["name", "host", "username", "password"]:
-        mikrotiks_data["mikrotiks"][mikrotik_idx][field] = value
-    elif field == "ovpn_profile":
-        mikrotiks_data["mikrotiks"][mikrotik_idx]["openvpn"]["profile"] = value
-    elif field == "wg_interface":
-        mikrotiks_data["mikrotiks"][mikrotik_idx]["wireguard"]["interface_name"] = value
-    elif field == "wg_endpoint":
-        mikrotiks_data["mikrotiks"][mikrotik_idx]["wireguard"]["endpoint"] = value
-    elif field == "wg_allowed_ips":
-        mikrotiks_data["mikrotiks"][mikrotik_idx]["wireguard"]["allowed_ips"] = value
-    else:
-        return False, f"Неизвестное поле {field}."
-    
-    # Сохраняем изменения
-    save_mikrotiks(mikrotiks_data)
+    _notify_mikrotik_changed(mikrotik_id, field)
     
     return True, f"✅ Поле {field} успешно обновлено."
 
@@ -334,54 +532,65 @@ def update_admin_name(admin_id: int, new_name: str, editor_id: int) -> Tuple[boo
     if check_admin_level(editor_id) != 1:
         return False, "Доступ запрещён."
     
-    admins_data = load_admins()
-    
-    for admin in admins_data["level_2"]:
-        if admin["id"] == admin_id:
+    try:
+        with transaction(admins_store) as tx:
+            admins_data = tx.read(admins_store)
+            admin = next((a for a in admins_data["level_2"] if a["id"] == admin_id), None)
+            if admin is None:
+                return False, "Администратор не найден."
             admin["name"] = new_name
-            save_admins(admins_data)
-            return True, f"✅ Имя администратора изменено на '{new_name}'"
+            tx.write(admins_store, admins_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
-    return False, "Администратор не найден."
+    return True, f"✅ Имя администратора изменено на '{new_name}'"
 
 def update_admin_mikrotiks(admin_id: int, mikrotik_ids: List[str], editor_id: int) -> Tuple[bool, str]:
     """Обновляет список доступных микротиков для администратора 2-го уровня"""
     if check_admin_level(editor_id) != 1:
         return False, "Доступ запрещён."
     
-    admins_data = load_admins()
-    
-    for admin in admins_data["level_2"]:
-        if admin["id"] == admin_id:
+    try:
+        with transaction(admins_store) as tx:
+            admins_data = tx.read(admins_store)
+            admin = next((a for a in admins_data["level_2"] if a["id"] == admin_id), None)
+            if admin is None:
+                return False, "Администратор не найден."
             admin["allowed_mikrotiks"] = mikrotik_ids
-            save_admins(admins_data)
-            return True, f"✅ Доступ к микротикам обновлен для администратора {admin.get('name', admin_id)}"
+            tx.write(admins_store, admins_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
-    return False, "Администратор не найден."
+    return True, f"✅ Доступ к микротикам обновлен для администратора {admin.get('name', admin_id)}"
 
 def promote_admin_to_level1(admin_id: int, editor_id: int) -> Tuple[bool, str]:
     """Повышает администратора 2-го уровня до 1-го уровня"""
     if check_admin_level(editor_id) != 1:
         return False, "Доступ запрещён."
     
-    admins_data = load_admins()
-    
-    # Находим админа 2-го уровня
-    admin_to_promote = None
-    for i, admin in enumerate(admins_data["level_2"]):
-        if admin["id"] == admin_id:
-            admin_to_promote = admin
-            del admins_data["level_2"][i]
-            break
-    
-    if not admin_to_promote:
-        return False, "Администратор не найден."
-    
-    # Добавляем в админы 1-го уровня
-    if admin_id not in admins_data["level_1"]:
-        admins_data["level_1"].append(admin_id)
+    try:
+        with transaction(admins_store) as tx:
+            admins_data = tx.read(admins_store)
+            
+            # Находим админа 2-го уровня
+            admin_to_promote = None
+            for i, admin in enumerate(admins_data["level_2"]):
+                if admin["id"] == admin_id:
+                    admin_to_promote = admin
+                    del admins_data["level_2"][i]
+                    break
+            
+            if not admin_to_promote:
+                return False, "Администратор не найден."
+            
+            # Добавляем в админы 1-го уровня
+            if admin_id not in admins_data["level_1"]:
+                admins_data["level_1"].append(admin_id)
+            
+            tx.write(admins_store, admins_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
-    save_admins(admins_data)
     return True, f"✅ Администратор {admin_to_promote.get('name', admin_id)} повышен до 1-го уровня"
 
 def demote_admin_to_level2(admin_id: int, name: str, editor_id: int) -> Tuple[bool, str]:
@@ -389,22 +598,27 @@ def demote_admin_to_level2(admin_id: int, name: str, editor_id: int) -> Tuple[bo
     if check_admin_level(editor_id) != 1:
         return False, "Доступ запрещён."
     
-    admins_data = load_admins()
-    
-    if admin_id not in admins_data["level_1"]:
-        return False, "Администратор не найден среди админов 1-го уровня."
-    
-    # Удаляем из админов 1-го уровня
-    admins_data["level_1"].remove(admin_id)
-    
-    # Добавляем в админы 2-го уровня с пустым списком микротиков
-    new_admin = {
-        "id": admin_id,
-        "name": name,
-        "allowed_mikrotiks": []
-    }
-    
-    admins_data["level_2"].append(new_admin)
+    try:
+        with transaction(admins_store) as tx:
+            admins_data = tx.read(admins_store)
+            
+            if admin_id not in admins_data["level_1"]:
+                return False, "Администратор не найден среди админов 1-го уровня."
+            
+            # Удаляем из админов 1-го уровня
+            admins_data["level_1"].remove(admin_id)
+            
+            # Добавляем в админы 2-го уровня с пустым списком микротиков
+            new_admin = {
+                "id": admin_id,
+                "name": name,
+                "allowed_mikrotiks": []
+            }
+            
+            admins_data["level_2"].append(new_admin)
+            
+            tx.write(admins_store, admins_data)
+    except VersionConflict:
+        return False, "Данные изменились во время сохранения. Попробуйте еще раз."
     
-    save_admins(admins_data)
     return True, f"✅ Администратор {name} понижен до 2-го уровня"
\ No newline at end of file
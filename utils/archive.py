@@ -0,0 +1,20 @@
+import zipfile
+from io import BytesIO
+from typing import Iterable, Tuple
+
+
+def build_zip(files: Iterable[Tuple[str, bytes]]) -> bytes:
+    """
+    Упаковывает файлы в ZIP-архив в памяти
+
+    Args:
+        files: Пары (имя файла в архиве, содержимое)
+
+    Returns:
+        Содержимое архива в байтах
+    """
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, data in files:
+            archive.writestr(filename, data)
+    return buffer.getvalue()
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger("vpn_bot")
+
+# Сколько получателей обрабатывается одновременно
+DEFAULT_CONCURRENCY = 5
+
+# Сколько раз повторять запрос при ограничении частоты Telegram
+MAX_RETRIES = 3
+
+
+async def retry_on_flood(call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Выполняет запрос к Telegram, а при ограничении частоты (flood control)
+    ждет указанную паузу и повторяет его
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            logger.warning(f"Ограничение частоты Telegram, повтор через {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
+    return await call()
+
+
+async def broadcast(
+    chat_ids: Iterable[int],
+    send: Callable[[int], Awaitable[Any]],
+    concurrency: int = DEFAULT_CONCURRENCY
+) -> Tuple[int, int]:
+    """
+    Параллельно вызывает send(chat_id) для каждого получателя.
+
+    Не больше concurrency получателей обрабатывается одновременно, ошибки
+    по отдельным получателям логируются и не прерывают рассылку. Запросы
+    к Telegram внутри send стоит оборачивать в retry_on_flood.
+
+    Returns:
+        (sent, failed): число успешных и неудачных отправок
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(chat_id: int) -> bool:
+        async with semaphore:
+            try:
+                await send(chat_id)
+                return True
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                return False
+
+    results = await asyncio.gather(*(send_one(chat_id) for chat_id in dict.fromkeys(chat_ids)))
+    sent = sum(results)
+    return sent, len(results) - sent
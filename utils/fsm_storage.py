@@ -0,0 +1,167 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from utils.write_buffer import DEFAULT_FLUSH_INTERVAL, DEFAULT_MAX_PENDING, WriteBehindBuffer
+
+logger = logging.getLogger("vpn_bot")
+
+# Запись FSM: (состояние, данные)
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+DEFAULT_FSM_PATH = "data/fsm.db"
+DEFAULT_CACHE_SIZE = 10000
+
+
+class SqliteStorage(BaseStorage):
+    """
+    Хранилище FSM в файле SQLite.
+
+    Состояния и данные читаются из LRU-кэша в памяти на cache_size ключей
+    (при промахе - из базы в отдельном потоке), а записываются через
+    WriteBehindBuffer, поэтому смена состояния не ждет записи на диск.
+    Диалоги, начатые до перезапуска бота, продолжаются после него.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_FSM_PATH,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        cache_size: int = DEFAULT_CACHE_SIZE
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)"
+        )
+        self._connection.commit()
+        self._cache: "OrderedDict[str, Record]" = OrderedDict()
+        self._closed = False
+        self.buffer = WriteBehindBuffer(self._write_batch, max_pending, flush_interval, "состояний FSM")
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            getattr(key, "thread_id", None),
+            getattr(key, "business_connection_id", None),
+            key.destiny
+        )
+        return ":".join("" if part is None else str(part) for part in parts)
+
+    def _read(self, key: str) -> Record:
+        """Читает запись из базы (выполняется в отдельном потоке)"""
+        with self._lock:
+            row = self._connection.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, {})
+
+    def _remember(self, key: str, record: Record) -> None:
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _record(self, key: str) -> Record:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            return record
+
+        # Вытесненная из кэша запись могла еще не дойти до базы
+        record = self.buffer.get(key)
+        if record is None:
+            loaded = await asyncio.to_thread(self._read, key)
+            # Пока шло чтение, ключ мог быть записан заново
+            record = self._cache.get(key) or self.buffer.get(key) or loaded
+        self._remember(key, record)
+        return record
+
+    def _write_batch(self, batch: Dict[str, Record]) -> None:
+        """Сохраняет пачку записей в одной транзакции (выполняется в отдельном потоке)"""
+        with self._lock:
+            with self._connection:
+                for key, (state, data) in batch.items():
+                    if state is None and not data:
+                        self._connection.execute("DELETE FROM fsm WHERE key = ?", (key,))
+                    else:
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO fsm (key, state, data) VALUES (?, ?, ?)",
+                            (key, state, json.dumps(data, ensure_ascii=False))
+                        )
+
+    async def _save(self, key: str, record: Record) -> None:
+        self._remember(key, record)
+        await self.buffer.put(key, record)
+
+    async def set_state(self, key: StorageKey, state: Any = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        k = self._key(key)
+        await self._save(k, (state, (await self._record(k))[1]))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self._key(key)
+        await self._save(k, ((await self._record(k))[0], copy.deepcopy(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._record(self._key(key)))[1])
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        await self.buffer.close()
+        with self._lock:
+            self._connection.close()
+
+
+def create_fsm_storage(settings: Optional[Dict] = None) -> BaseStorage:
+    """
+    Создает хранилище FSM по секции "fsm_storage" из config.json
+
+    Args:
+        settings: {"backend": "sqlite", "sqlite_path": "data/fsm.db",
+            "max_pending": 1000, "flush_interval": 1.0, "cache_size": 10000},
+            {"backend": "redis", "redis_url": "redis://localhost:6379/0"}
+            или {"backend": "memory"} (состояния теряются при перезапуске)
+    """
+    settings = settings or {}
+    backend = settings.get("backend", "sqlite")
+
+    if backend == "memory":
+        return MemoryStorage()
+
+    if backend == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+            return RedisStorage.from_url(settings.get("redis_url", "redis://localhost:6379/0"))
+        except ImportError as e:
+            logger.error(f"Хранилище FSM Redis недоступно ({e}), используется SQLite. Установите пакет redis.")
+    elif backend != "sqlite":
+        logger.error(f"Неизвестный бэкенд хранилища FSM: {backend}, используется SQLite")
+
+    return SqliteStorage(
+        settings.get("sqlite_path", DEFAULT_FSM_PATH),
+        max_pending=settings.get("max_pending", DEFAULT_MAX_PENDING),
+        flush_interval=settings.get("flush_interval", DEFAULT_FLUSH_INTERVAL),
+        cache_size=settings.get("cache_size", DEFAULT_CACHE_SIZE)
+    )
@@ -0,0 +1,264 @@
+import asyncio
+import heapq
+import ipaddress
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from utils.admin_utils import register_mikrotik_listener
+from utils.routeros_client import RouterOSClient, RouterOSError
+
+logger = logging.getLogger("vpn_bot")
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# Сколько секунд созданный адрес считается занятым, пока не появится в таблице пиров
+PENDING_TTL = 60
+
+# Длина префикса подсети, если ее не удалось получить с микротика
+FALLBACK_PREFIX = {4: 24, 6: 64}
+
+
+class AddressPoolExhausted(Exception):
+    """В подсети не осталось свободных адресов"""
+
+
+def parse_addresses(allowed_address: str) -> List[IPAddress]:
+    """Разбирает allowed-address пира ("10.0.0.2/32,fd00::2/128") в список адресов"""
+    addresses = []
+    for item in allowed_address.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            addresses.append(ipaddress.ip_interface(item).ip)
+        except ValueError:
+            continue
+    return addresses
+
+
+def fallback_network(address: IPAddress) -> IPNetwork:
+    """Подсеть по умолчанию для адреса: /24 для IPv4, /64 для IPv6"""
+    return ipaddress.ip_interface(f"{address}/{FALLBACK_PREFIX[address.version]}").network
+
+
+class AddressPool:
+    """
+    Индекс адресов подсети WireGuard-интерфейса.
+
+    Адреса хранятся как смещения от начала подсети: множество занятых,
+    куча освобожденных (выдаются первыми, начиная с меньшего) и курсор
+    на первый еще ни разу не выданный адрес. Выдача адреса - O(1) в
+    среднем, поэтому работает для любой длины префикса, включая IPv6.
+
+    Выданный, но еще не созданный на микротике адрес остается занятым
+    до commit() или release(), чтобы параллельные запросы его не получили.
+    sync() и allocate() не содержат await и выполняются в цикле событий
+    атомарно, поэтому отдельная блокировка для них не нужна.
+    """
+
+    def __init__(self, network: IPNetwork, reserved: Iterable[IPAddress] = (), dns: Optional[str] = None):
+        self.network = network
+        self.dns = dns or str(network.network_address + 1)
+
+        size = network.num_addresses
+        if network.version == 4 and size > 2:
+            # Адрес сети и широковещательный адрес не выдаем
+            self._first, self._last = 1, size - 2
+        elif network.version == 6 and size > 1:
+            # Адрес сети в IPv6 - anycast-адрес маршрутизатора подсети
+            self._first, self._last = 1, size - 1
+        else:
+            self._first, self._last = 0, size - 1
+
+        self._reserved: Set[int] = {o for o in map(self._offset, reserved) if o is not None}
+        self._used: Set[int] = set()
+        # Смещение -> срок, до которого адрес держится (None - запрос еще выполняется)
+        self._pending: Dict[int, Optional[float]] = {}
+        self._free: List[int] = []
+        self._cursor = self._first
+
+    def _offset(self, address: IPAddress) -> Optional[int]:
+        if address.version != self.network.version or address not in self.network:
+            return None
+        return int(address) - int(self.network.network_address)
+
+    def _address(self, offset: int) -> IPAddress:
+        return self.network.network_address + offset
+
+    def _taken(self, offset: int) -> bool:
+        return offset in self._used or offset in self._pending or offset in self._reserved
+
+    def sync(self, peers: Iterable[Dict]) -> None:
+        """Обновляет индекс по актуальной таблице пиров"""
+        used = set()
+        for peer in peers:
+            for address in parse_addresses(peer.get("allowed-address", "")):
+                offset = self._offset(address)
+                if offset is not None:
+                    used.add(offset)
+
+        now = time.monotonic()
+        expired = []
+        for offset, expires in list(self._pending.items()):
+            if offset in used:
+                del self._pending[offset]
+            elif expires is not None and expires < now:
+                # Пир так и не появился в таблице - адрес снова свободен
+                del self._pending[offset]
+                expired.append(offset)
+
+        # Адреса удаленных пиров и просроченных резервов возвращаем в кучу свободных
+        removed = self._used - used
+        self._used = used
+        for offset in (*removed, *expired):
+            if not self._taken(offset):
+                heapq.heappush(self._free, offset)
+
+    def allocate(self) -> IPAddress:
+        """
+        Выдает свободный адрес подсети
+
+        Raises:
+            AddressPoolExhausted: если свободных адресов нет
+        """
+        while self._free:
+            offset = heapq.heappop(self._free)
+            if not self._taken(offset):
+                break
+        else:
+            while self._cursor <= self._last and self._taken(self._cursor):
+                self._cursor += 1
+            if self._cursor > self._last:
+                raise AddressPoolExhausted(f"В подсети {self.network} нет свободных адресов")
+            offset = self._cursor
+            self._cursor += 1
+
+        self._pending[offset] = None
+        return self._address(offset)
+
+    def commit(self, address: IPAddress) -> None:
+        """Отмечает, что пир с адресом создан на микротике"""
+        offset = self._offset(address)
+        if offset in self._pending:
+            self._pending[offset] = time.monotonic() + PENDING_TTL
+
+    def release(self, address: IPAddress) -> None:
+        """Возвращает адрес в пул (например, если создать пир не удалось)"""
+        offset = self._offset(address)
+        if offset is None:
+            return
+        self._pending.pop(offset, None)
+        self._used.discard(offset)
+        if not self._taken(offset):
+            heapq.heappush(self._free, offset)
+
+    def contains(self, address: IPAddress) -> bool:
+        return self._offset(address) is not None
+
+    def format(self, address: IPAddress) -> str:
+        """allowed-address пира для адреса (10.0.0.5/32)"""
+        return f"{address}/{address.max_prefixlen}"
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "used": len(self._used),
+            "pending": len(self._pending),
+            "free_list": len(self._free),
+            "capacity": self._last - self._first + 1 - len(self._reserved)
+        }
+
+
+def peer_dns(allowed_address: str, pool: Optional[AddressPool] = None) -> Optional[str]:
+    """
+    Возвращает DNS для клиента по его allowed-address: адрес сервера, если
+    пир в подсети пула, иначе первый адрес подсети по умолчанию
+    (для 10.0.0.5/32 - 10.0.0.1). None, если адрес не разобран.
+    """
+    addresses = parse_addresses(allowed_address)
+    if not addresses:
+        return None
+    if pool is not None and any(pool.contains(address) for address in addresses):
+        return pool.dns
+    return str(fallback_network(addresses[0]).network_address + 1)
+
+
+# Пулы адресов: (ID микротика, имя интерфейса) -> пул
+_pools: Dict[Tuple[str, str], AddressPool] = {}
+_pool_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+
+async def _discover_pool(api: RouterOSClient, interface_name: str, peers: Iterable[Dict]) -> Optional[AddressPool]:
+    """Определяет подсеть интерфейса по /ip/address, а при неудаче - по адресам пиров"""
+    try:
+        records = await api.find("/ip/address", {"interface": interface_name}, proplist=["address"])
+    except RouterOSError as e:
+        logger.warning(f"Не удалось получить адреса интерфейса {interface_name}: {e}")
+        records = []
+
+    for record in records:
+        try:
+            server = ipaddress.ip_interface(record.get("address", ""))
+        except ValueError:
+            continue
+        if server.network.num_addresses > 1:
+            return AddressPool(server.network, reserved=[server.ip], dns=str(server.ip))
+
+    for peer in peers:
+        for address in parse_addresses(peer.get("allowed-address", "")):
+            network = fallback_network(address)
+            logger.info(f"Подсеть интерфейса {interface_name} определена по адресам пиров: {network}")
+            # Первый адрес подсети - обычно адрес самого интерфейса, он же DNS клиентов
+            gateway = network.network_address + 1
+            return AddressPool(network, reserved=[gateway], dns=str(gateway))
+
+    return None
+
+
+async def get_address_pool(
+    api: RouterOSClient,
+    interface_name: str,
+    peers: Optional[Iterable[Dict]] = None
+) -> Optional[AddressPool]:
+    """
+    Возвращает пул адресов WireGuard-интерфейса микротика.
+
+    Пул создается при первом обращении и переиспользуется. Если передан
+    peers (актуальная таблица пиров, в том числе пустая), индекс
+    синхронизируется с ней.
+    Возвращает None, если подсеть определить не удалось.
+    """
+    fetched = peers is not None
+    peers = list(peers or [])
+    key = (api.mikrotik["id"], interface_name)
+    pool = _pools.get(key)
+
+    if pool is None:
+        lock = _pool_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = await _discover_pool(api, interface_name, peers)
+                if pool is None:
+                    return None
+                _pools[key] = pool
+
+    # Пустая таблица тоже синхронизируется: все пиры могли удалить в обход бота
+    if fetched:
+        pool.sync(p for p in peers if p.get("interface") in (None, interface_name))
+    return pool
+
+
+def invalidate_address_pools(mikrotik_id: str) -> None:
+    """Сбрасывает пулы адресов микротика"""
+    for key in [key for key in _pools if key[0] == mikrotik_id]:
+        del _pools[key]
+
+
+def _on_mikrotik_changed(mikrotik_id: str, field: Optional[str]) -> None:
+    if field in (None, "host", "wg_interface"):
+        invalidate_address_pools(mikrotik_id)
+
+
+register_mikrotik_listener(_on_mikrotik_changed)
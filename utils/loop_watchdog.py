@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Dict, List, Optional, Tuple
+
+from utils.metrics import loop_lag, loop_lag_histogram, metrics
+
+logger = logging.getLogger("vpn_bot")
+
+# Папка бота: по ней в стеке ищутся кадры нашего кода (а не библиотек)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_INTERVAL = 0.1
+
+blocking_calls = metrics.counter(
+    "event_loop_blocking_total",
+    "Блокировки цикла событий дольше порога по месту вызова",
+    ("handler", "site")
+)
+
+
+def _project_frames(frame: Optional[FrameType]) -> List[Tuple[str, int, str]]:
+    """Кадры кода бота от внешнего к внутреннему: (путь относительно бота, строка, функция)"""
+    frames = []
+    for summary in traceback.extract_stack(frame):
+        path = os.path.abspath(summary.filename)
+        if path.startswith(PROJECT_ROOT + os.sep) and path != os.path.abspath(__file__):
+            frames.append((os.path.relpath(path, PROJECT_ROOT), summary.lineno, summary.name))
+    return frames
+
+
+class LoopWatchdog:
+    """
+    Сторожевой поток цикла событий.
+
+    Задача heartbeat() в цикле событий каждые interval секунд отмечает,
+    что цикл жив, и записывает задержку пробуждения в метрики. Отдельный
+    поток проверяет отметку: если ее нет дольше threshold секунд, значит
+    какой-то обработчик блокирует цикл синхронным вызовом. Поток снимает
+    стек потока цикла событий, пишет его в лог и увеличивает счетчик по
+    обработчику и месту вызова (самому внутреннему кадру кода бота).
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, interval: float = DEFAULT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._beats = 0
+        self._reported_beat = -1
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    async def heartbeat(self) -> None:
+        """Фоновая задача цикла событий: отметки для сторожевого потока и замер задержки"""
+        self._loop_thread_id = threading.get_ident()
+        loop = asyncio.get_running_loop()
+        while True:
+            self._beat = time.monotonic()
+            self._beats += 1
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            loop_lag.set(lag)
+            loop_lag_histogram.observe(lag)
+
+    def start(self) -> None:
+        """Запускает сторожевой поток (heartbeat() запускается отдельно в цикле событий)"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._beat
+            if stalled < self.threshold or self._loop_thread_id is None:
+                continue
+            # О каждой блокировке сообщаем один раз
+            beats = self._beats
+            if beats == self._reported_beat:
+                continue
+            self._reported_beat = beats
+            self._report(stalled)
+
+    def _report(self, stalled: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        frames = _project_frames(frame)
+        handler = next((name for path, line, name in frames if path.startswith("handlers" + os.sep)), "unknown")
+        site = f"{frames[-1][0]}:{frames[-1][1]} {frames[-1][2]}" if frames else "unknown"
+
+        self.stalls += 1
+        blocking_calls.inc(handler, site)
+        stack = "".join(traceback.format_stack(frame))
+        logger.warning(
+            f"Цикл событий заблокирован дольше {stalled:.2f} с (обработчик {handler}, место {site}). Стек:\n{stack}"
+        )
+
+    def stats(self) -> Dict[str, float]:
+        return {"stalls": self.stalls, "threshold": self.threshold}
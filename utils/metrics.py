@@ -0,0 +1,304 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from utils.tracing import span
+
+logger = logging.getLogger("vpn_bot")
+
+# Префикс имен всех метрик бота
+PREFIX = "vpn_bot_"
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Метрика с набором меток. Значения хранятся по кортежу значений меток"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Счетчик, который только увеличивается"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+
+class Gauge(Metric):
+    """Текущее значение (может уменьшаться)"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам (для задержек)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> (счетчики корзин, сумма, количество)
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        lines = []
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Набор метрик бота и источников статистики.
+
+    Источник статистики - функция без аргументов, возвращающая словарь
+    чисел (например, mutation_locks.stats). Каждый ключ отдается как
+    gauge {PREFIX}{имя источника}_{ключ} при каждом запросе /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._stats: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def add(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help_text, labelnames, buckets))
+
+    def register_stats(self, name: str, callback: Callable[[], Dict[str, Any]]) -> None:
+        self._stats[name] = callback
+
+    def _render_stats(self) -> List[str]:
+        lines = []
+        for source, callback in self._stats.items():
+            try:
+                stats = callback()
+            except Exception as e:
+                logger.error(f"Ошибка сбора статистики {source}: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{PREFIX}{source}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+    def render(self) -> str:
+        """Текст в формате Prometheus (text/plain; version=0.0.4)"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            samples = metric.render()
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        lines.extend(self._render_stats())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Запросы к REST API микротиков
+router_requests = metrics.counter("router_requests_total", "Запросы к REST API микротиков", ("router", "method", "path"))
+router_latency = metrics.histogram("router_request_duration_seconds", "Время запроса к REST API микротика", ("router", "method", "path"))
+router_errors = metrics.counter("router_errors_total", "Ошибки запросов к микротикам по типу", ("router", "kind"))
+
+# Обработчики обновлений
+handler_latency = metrics.histogram("handler_duration_seconds", "Время выполнения обработчика", ("handler", "event"))
+handler_errors = metrics.counter("handler_errors_total", "Исключения в обработчиках", ("handler", "event"))
+
+# Запросы к Telegram Bot API
+telegram_latency = metrics.histogram("telegram_request_duration_seconds", "Время запроса к Telegram Bot API", ("method",))
+telegram_errors = metrics.counter("telegram_errors_total", "Ошибки запросов к Telegram Bot API", ("method", "kind"))
+
+# Цикл событий (измеряется в utils/loop_watchdog.py)
+loop_lag = metrics.gauge("event_loop_lag_seconds", "Последняя измеренная задержка цикла событий")
+loop_lag_histogram = metrics.histogram(
+    "event_loop_lag_distribution_seconds", "Распределение задержки цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+
+def router_path_label(path: str) -> str:
+    """Путь запроса без ID записей (/ppp/secret/*1A -> /ppp/secret/:id), чтобы не плодить метки"""
+    return "/".join(":id" if segment.startswith("*") else segment for segment in path.split("/"))
+
+
+def router_error_kind(status: Optional[int], timeout: bool = False) -> str:
+    """Тип ошибки запроса к микротику для метки kind"""
+    if timeout:
+        return "timeout"
+    if status is None:
+        return "connection"
+    if status in (401, 403):
+        return "auth"
+    return f"http_{status}"
+
+
+def observe_router_request(mikrotik_id: str, method: str, path: str, duration: float, error_kind: Optional[str] = None) -> None:
+    path = router_path_label(path)
+    router_requests.inc(mikrotik_id, method, path)
+    router_latency.observe(duration, mikrotik_id, method, path)
+    if error_kind is not None:
+        router_errors.inc(mikrotik_id, error_kind)
+
+
+def _handler_name(data: Dict[str, Any]) -> str:
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    if callback is None:
+        return "unknown"
+    module = getattr(callback, "__module__", "") or ""
+    return f"{module.rsplit('.', 1)[-1]}.{getattr(callback, '__qualname__', callback)}"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware роутера: замеряет время каждого обработчика.
+
+        router.message.middleware(HandlerMetricsMiddleware())
+        router.callback_query.middleware(HandlerMetricsMiddleware())
+    """
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = _handler_name(data)
+        started = time.perf_counter()
+        try:
+            with span(f"handler {name}"):
+                return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name, self.event)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name, self.event)
+
+
+def instrument_router(router: Any) -> None:
+    """Подключает замер времени обработчиков сообщений и callback-запросов роутера"""
+    router.message.middleware(HandlerMetricsMiddleware("message"))
+    router.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: замеряет время запросов к Telegram Bot API.
+
+        bot.session.middleware(TelegramMetricsMiddleware())
+    """
+
+    async def __call__(self, make_request: Callable[..., Awaitable[Any]], bot: Any, method: Any) -> Any:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            with span(f"telegram {name}"):
+                return await make_request(bot, method)
+        except Exception as e:
+            telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_latency.observe(time.perf_counter() - started, name)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Обработчик GET /metrics для встроенного HTTP-сервера"""
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
@@ -1,22 +1,26 @@
-import requests
 import random
 import string
-from utils.admin_utils import get_mikrotik_by_id  
+from utils.admin_utils import get_mikrotik_by_id
+from utils.routeros_client import RouterOSClient, RouterOSError, mutation_lock, run_bounded
+from utils.snapshot_cache import snapshot_cache, get_snapshot, PPP_SECRETS, PPP_ACTIVE
 
-def get_openvpn_profile_credentials(name, mikrotik_id):
+# Сколько записей создается на микротике одновременно при массовых операциях
+BULK_CONCURRENCY = 4
+
+async def get_openvpn_profile_credentials(name, mikrotik_id):
     """Получает данные профиля OpenVPN для скачивания"""
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/ppp/secret", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        secrets = response.json()
+        async with RouterOSClient(mikrotik) as api:
+            secrets = await api.find(
+                "/ppp/secret",
+                {"name": name, "service": "ovpn"},
+                proplist=["name", "password"]
+            )
         
         # Ищем профиль с указанным именем
         for secret in secrets:
@@ -32,118 +36,164 @@ def get_openvpn_profile_credentials(name, mikrotik_id):
                     }
         
         return f"⚠️ Профиль с именем {name} не найден."
-    except requests.RequestException as e:
+    except RouterOSError as e:
         return f"❌ Ошибка получения данных профиля: {e}"
     
-def get_active_openvpn_profiles(mikrotik_id):
+async def get_active_openvpn_profiles(mikrotik_id):
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/ppp/active", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        active_profiles = response.json()
-        
-        # Сортируем профили по алфавиту
-        active_profiles.sort(key=lambda p: p.get('name', '').lower())
-        
-        return active_profiles
-    except requests.RequestException as e:
+        # Снимок уже отсортирован по алфавиту
+        return await get_snapshot(mikrotik, PPP_ACTIVE)
+    except RouterOSError as e:
         return f"Ошибка подключения к MikroTik: {e}"
 
 
-def get_enabled_openvpn_profiles(mikrotik_id):
+async def get_enabled_openvpn_profiles(mikrotik_id):
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/ppp/secret", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        all_profiles = response.json()
+        # Снимок уже отсортирован по алфавиту
+        all_profiles = await get_snapshot(mikrotik, PPP_SECRETS)
         
         # Фильтруем только НЕ отключенные OVPN профили
-        enabled_profiles = [p for p in all_profiles if p.get("disabled") == "false" and p.get("service") == "ovpn"]
-        
-        # Сортируем профили по алфавиту
-        enabled_profiles.sort(key=lambda p: p.get('name', '').lower())
-        
-        return enabled_profiles
-    except requests.RequestException as e:
+        return [p for p in all_profiles if p.get("disabled") == "false" and p.get("service") == "ovpn"]
+    except RouterOSError as e:
         return f"Ошибка подключения к MikroTik: {e}"
 
 
-def deactivate_openvpn_profile(name, mikrotik_id):
+async def deactivate_openvpn_profile(name, mikrotik_id):
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/ppp/active", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        active_profiles = response.json()
-        
-        for profile in active_profiles:
-            if profile.get("name") == name:
-                id_to_remove = profile.get(".id")
-                if id_to_remove:
-                    delete_response = requests.delete(
-                        f"{BASE_URL}/ppp/active/{id_to_remove}", auth=AUTH, verify=False, timeout=5
-                    )
-                    delete_response.raise_for_status()
-                    return f"✅ Профиль {name} успешно деактивирован."
+        async with mutation_lock(mikrotik_id), RouterOSClient(mikrotik) as api:
+            active_profiles = await api.find("/ppp/active", {"name": name}, proplist=[".id"])
+            
+            for profile in active_profiles:
+                if profile.get("name") == name:
+                    id_to_remove = profile.get(".id")
+                    if id_to_remove:
+                        await api.delete(f"/ppp/active/{id_to_remove}")
+                        snapshot_cache.invalidate(mikrotik_id, PPP_ACTIVE)
+                        return f"✅ Профиль {name} успешно деактивирован."
         
         return f"⚠️ Профиль {name} не найден среди активных."
-    except requests.RequestException as e:
+    except RouterOSError as e:
         return f"❌ Ошибка деактивации профиля: {e}"
 
 
-def disable_openvpn_secret(name, mikrotik_id):
+async def disable_openvpn_secret(name, mikrotik_id):
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/ppp/secret", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        secrets = response.json()
-        
-        for secret in secrets:
-            if secret.get("name") == name and secret.get("service") == "ovpn":
-                id_to_disable = secret.get(".id")
-                if id_to_disable:
-                    patch_response = requests.patch(
-                        f"{BASE_URL}/ppp/secret/{id_to_disable}",
-                        auth=AUTH,
-                        verify=False,
-                        json={"disabled": "true"},
-                        timeout=5
-                    )
-                    patch_response.raise_for_status()
-                    return f"✅ Профиль {name} успешно отключен."
+        async with mutation_lock(mikrotik_id), RouterOSClient(mikrotik) as api:
+            secrets = await api.find(
+                "/ppp/secret",
+                {"name": name, "service": "ovpn"},
+                proplist=[".id"]
+            )
+            
+            for secret in secrets:
+                if secret.get("name") == name and secret.get("service") == "ovpn":
+                    id_to_disable = secret.get(".id")
+                    if id_to_disable:
+                        await api.patch(f"/ppp/secret/{id_to_disable}", {"disabled": "true"})
+                        snapshot_cache.invalidate(mikrotik_id, PPP_SECRETS)
+                        return f"✅ Профиль {name} успешно отключен."
         
         return f"⚠️ Профиль {name} не найден."
-    except requests.RequestException as e:
+    except RouterOSError as e:
         return f"❌ Ошибка отключения профиля: {e}"
 
 
+async def deactivate_openvpn_profiles_bulk(names, mikrotik_id, concurrency=BULK_CONCURRENCY):
+    """
+    Разрывает активные подключения нескольких профилей OpenVPN
+
+    Таблица /ppp/active загружается один раз, подключения разрываются
+    параллельно (не больше concurrency запросов одновременно).
+    
+    Returns:
+        Словарь с полями done (имена), missing (имена без подключения)
+        и failed (пары (имя, ошибка)) или строка с ошибкой
+    """
+    # Получаем данные микротика
+    mikrotik = get_mikrotik_by_id(mikrotik_id)
+    if not mikrotik:
+        return f"⚠️ Микротик не найден."
+    
+    try:
+        async with mutation_lock(mikrotik_id), RouterOSClient(mikrotik) as api:
+            active_profiles = await api.find("/ppp/active", {}, proplist=[".id", "name"])
+            
+            # У одного профиля может быть несколько подключений
+            ids_by_name = {}
+            for profile in active_profiles:
+                if profile.get(".id"):
+                    ids_by_name.setdefault(profile.get("name"), []).append(profile[".id"])
+            
+            to_process = [name for name in dict.fromkeys(names) if name in ids_by_name]
+            missing = [name for name in dict.fromkeys(names) if name not in ids_by_name]
+            
+            async def deactivate(name):
+                for id_to_remove in ids_by_name[name]:
+                    await api.delete(f"/ppp/active/{id_to_remove}")
+            
+            done, failed = await run_bounded(to_process, deactivate, concurrency)
+        snapshot_cache.invalidate(mikrotik_id, PPP_ACTIVE)
+        
+        return {"success": True, "done": done, "missing": missing, "failed": failed}
+    except RouterOSError as e:
+        return f"❌ Ошибка деактивации профилей: {e}"
+
+
+async def disable_openvpn_secrets_bulk(names, mikrotik_id, concurrency=BULK_CONCURRENCY):
+    """
+    Отключает несколько профилей OpenVPN
+
+    Идентификаторы секретов определяются по одной выборке /ppp/secret,
+    профили отключаются параллельно (не больше concurrency запросов одновременно).
+    
+    Returns:
+        Словарь с полями done (имена), missing (не найденные имена)
+        и failed (пары (имя, ошибка)) или строка с ошибкой
+    """
+    # Получаем данные микротика
+    mikrotik = get_mikrotik_by_id(mikrotik_id)
+    if not mikrotik:
+        return f"⚠️ Микротик не найден."
+    
+    try:
+        async with mutation_lock(mikrotik_id), RouterOSClient(mikrotik) as api:
+            secrets = await api.find("/ppp/secret", {"service": "ovpn"}, proplist=[".id", "name"])
+            id_by_name = {secret.get("name"): secret.get(".id") for secret in secrets if secret.get(".id")}
+            
+            to_process = [name for name in dict.fromkeys(names) if name in id_by_name]
+            missing = [name for name in dict.fromkeys(names) if name not in id_by_name]
+            
+            async def disable(name):
+                await api.patch(f"/ppp/secret/{id_by_name[name]}", {"disabled": "true"})
+            
+            done, failed = await run_bounded(to_process, disable, concurrency)
+        snapshot_cache.invalidate(mikrotik_id, PPP_SECRETS)
+        
+        return {"success": True, "done": done, "missing": missing, "failed": failed}
+    except RouterOSError as e:
+        return f"❌ Ошибка отключения профилей: {e}"
+
+
 # Генерация пароля
 def generate_password(length=15):
     """Генерирует пароль заданной длины с разными типами символов"""
@@ -171,78 +221,132 @@ def generate_password(length=15):
 
 
 # Проверка существования профиля
-def check_profile_exists(name, mikrotik_id):
+async def check_profile_exists(name, mikrotik_id):
     """Проверяет, существует ли профиль с таким именем"""
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/ppp/secret", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        secrets = response.json()
+        async with RouterOSClient(mikrotik) as api:
+            secrets = await api.find("/ppp/secret", {"name": name})
         
-        return any(s.get("name") == name for s in secrets)
-    except requests.RequestException as e:
+        return len(secrets) > 0
+    except RouterOSError as e:
         return f"Ошибка проверки профиля: {e}"
 
 
-def add_openvpn_profile(name, mikrotik_id):
+async def add_openvpn_profile(name, mikrotik_id):
     """Добавляет новый OpenVPN профиль"""
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
-    
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
     OVPN_PROFILE = mikrotik["openvpn"]["profile"]
     
-    # Проверяем существование профиля
-    exists_check = check_profile_exists(name, mikrotik_id)
-    
-    if isinstance(exists_check, str):
-        return exists_check  # Вернуть ошибку, если она произошла
-    
-    if exists_check:
-        return f"⚠️ Профиль с именем {name} уже существует."
-    
-    # Генерируем пароль
-    password = generate_password(15)
+    # Проверка имени и создание идут под блокировкой микротика,
+    # чтобы одновременные запросы не создали профили с одним именем
+    async with mutation_lock(mikrotik_id):
+        # Проверяем существование профиля
+        exists_check = await check_profile_exists(name, mikrotik_id)
+        
+        if isinstance(exists_check, str):
+            return exists_check  # Вернуть ошибку, если она произошла
+        
+        if exists_check:
+            return f"⚠️ Профиль с именем {name} уже существует."
+        
+        # Генерируем пароль
+        password = generate_password(15)
+        
+        # Создаем новый профиль
+        profile_data = {
+            "name": name,
+            "password": password,
+            "service": "ovpn",
+            "profile": OVPN_PROFILE
+        }
+        
+        try:
+            # Используем PUT запрос без /add, как в успешном тесте
+            async with RouterOSClient(mikrotik) as api:
+                await api.put("/ppp/secret", profile_data)
+            snapshot_cache.invalidate(mikrotik_id, PPP_SECRETS)
+        except RouterOSError as e:
+            error_msg = f"❌ Ошибка создания профиля: {e}"
+            if e.text:
+                error_msg += f"\nДетали: {e.text}"
+            return error_msg
     
-    # Создаем новый профиль
-    profile_data = {
+    # Возвращаем информацию о созданном профиле
+    return {
+        "success": True,
         "name": name,
         "password": password,
-        "service": "ovpn",
-        "profile": OVPN_PROFILE
+        "message": f"✅ Профиль {name} успешно создан."
     }
+
+
+async def add_openvpn_profiles_bulk(names, mikrotik_id, concurrency=BULK_CONCURRENCY):
+    """
+    Создает несколько OpenVPN профилей за одну операцию
+
+    Имена проверяются по одному снимку таблицы секретов, затем профили
+    создаются параллельно (не больше concurrency запросов одновременно)
+    под одной блокировкой изменений микротика.
     
-    try:
-        # Используем PUT запрос без /add, как в успешном тесте
-        response = requests.put(
-            f"{BASE_URL}/ppp/secret", 
-            auth=AUTH,
-            verify=False,
-            json=profile_data,
-            timeout=5
-        )
-        
-        response.raise_for_status()
-        
-        # Возвращаем информацию о созданном профиле
-        return {
-            "success": True,
-            "name": name,
-            "password": password,
-            "message": f"✅ Профиль {name} успешно создан."
-        }
-    except requests.RequestException as e:
-        error_msg = f"❌ Ошибка создания профиля: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-            error_msg += f"\nДетали: {e.response.text}"
-        return error_msg
\ No newline at end of file
+    Returns:
+        Словарь с полями created (список {"name", "password"}),
+        skipped и failed (списки пар (имя, причина)) или строка с ошибкой
+    """
+    # Получаем данные микротика
+    mikrotik = get_mikrotik_by_id(mikrotik_id)
+    if not mikrotik:
+        return f"⚠️ Микротик не найден."
+    OVPN_PROFILE = mikrotik["openvpn"]["profile"]
+    
+    async with mutation_lock(mikrotik_id):
+        try:
+            secrets = await get_snapshot(mikrotik, PPP_SECRETS, fresh=True)
+        except RouterOSError as e:
+            return f"❌ Ошибка получения списка профилей: {e}"
+        
+        existing = {secret.get("name") for secret in secrets}
+        skipped = []
+        to_create = []
+        for name in dict.fromkeys(names):
+            if name in existing:
+                skipped.append((name, "уже существует"))
+            else:
+                to_create.append(name)
+        
+        # Пароли генерируются заранее, чтобы вернуть их для созданных профилей
+        profiles = [
+            {
+                "name": name,
+                "password": generate_password(15),
+                "service": "ovpn",
+                "profile": OVPN_PROFILE
+            }
+            for name in to_create
+        ]
+        
+        async with RouterOSClient(mikrotik) as api:
+            async def create_profile(profile_data):
+                await api.put("/ppp/secret", profile_data)
+            
+            done, errors = await run_bounded(profiles, create_profile, concurrency)
+        
+        if to_create:
+            snapshot_cache.invalidate(mikrotik_id, PPP_SECRETS)
+    
+    created = [{"name": profile["name"], "password": profile["password"]} for profile in done]
+    failed = [(profile["name"], error) for profile, error in errors]
+    
+    return {
+        "success": True,
+        "created": created,
+        "skipped": skipped,
+        "failed": failed
+    }
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""
+Задачи пула рендеринга: ключи WireGuard, конфигурации и QR-коды.
+
+Функции выполняются в рабочих потоках или процессах RenderPool, поэтому
+модуль не импортирует ничего из бота и не имеет побочных эффектов при импорте.
+"""
+import base64
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+import qrcode
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+
+
+def generate_wireguard_keypair() -> Tuple[str, str]:
+    """Генерирует пару ключей WireGuard (приватный, публичный) в base64"""
+    private_key_obj = x25519.X25519PrivateKey.generate()
+    private_key_bytes = private_key_obj.private_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PrivateFormat.Raw,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    public_key_bytes = private_key_obj.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    return base64.b64encode(private_key_bytes).decode('ascii'), base64.b64encode(public_key_bytes).decode('ascii')
+
+
+def generate_wireguard_keypairs(count: int) -> List[Tuple[str, str]]:
+    """Генерирует count пар ключей WireGuard за один вызов"""
+    return [generate_wireguard_keypair() for _ in range(count)]
+
+
+def build_wireguard_conf(
+    private_key: str,
+    address: str,
+    dns: str,
+    server_pubkey: str,
+    allowed_ips: str,
+    endpoint: str
+) -> str:
+    """Формирует текст клиентского .conf-файла WireGuard"""
+    return f"""[Interface]
+ListenPort = 51820
+PrivateKey = {private_key}
+Address = {address}
+DNS = {dns}
+
+[Peer]
+PublicKey = {server_pubkey}
+AllowedIPs = {allowed_ips}
+Endpoint = {endpoint}
+PersistentKeepalive = 20
+"""
+
+
+def render_qr_png(text: str) -> bytes:
+    """Рендерит QR-код с текстом в PNG"""
+    qr_img = qrcode.make(text)
+    qr_io = BytesIO()
+    qr_img.save(qr_io, format='PNG')
+    return qr_io.getvalue()
+
+
+def render_wireguard_files(conf_params: Dict[str, str]) -> Tuple[str, bytes]:
+    """Формирует .conf-файл WireGuard и его QR-код в PNG"""
+    conf_text = build_wireguard_conf(**conf_params)
+    return conf_text, render_qr_png(conf_text)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import RENDER_POOL
+from utils.tracing import span
+
+logger = logging.getLogger("vpn_bot")
+
+# Модули с функциями задач: импортируются в рабочих процессах заранее
+WORKER_MODULES = ["utils.render_jobs", "utils.archive"]
+
+
+class RenderPool:
+    """
+    Ограниченный пул для CPU-задач (QR-коды, конфигурации), чтобы они
+    не блокировали цикл событий.
+
+    Одновременно в пул передается не больше max_queue задач, остальные
+    ждут своей очереди. queue_depth - число задач в пуле и в ожидании.
+
+    По умолчанию задачи выполняются в пуле потоков. С executor="process"
+    используются процессы forkserver с предзагруженными utils.render_jobs
+    и utils.archive; multiprocessing при этом все равно импортирует main.py
+    в каждом рабочем процессе (как __mp_main__), поэтому режим процессов
+    имеет смысл только при большом потоке QR-кодов.
+    """
+
+    def __init__(self, workers: int = 2, executor: str = "thread", max_queue: int = 32):
+        self.workers = workers
+        self.executor_kind = executor
+        self.max_queue = max_queue
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                try:
+                    # fork после запуска потоков бота (запись FSM, сторожевой поток)
+                    # может оставить в дочернем процессе захваченные блокировки, поэтому
+                    # рабочие процессы порождает чистый сервер с модулями задач
+                    context = multiprocessing.get_context("forkserver")
+                    context.set_forkserver_preload(WORKER_MODULES)
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"Пул процессов недоступен ({e}), используем пул потоков")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет func(*args) в пуле и возвращает результат"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_queue)
+
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            # Время в интервале включает ожидание свободного места в пуле
+            with span(f"render {getattr(func, '__name__', 'task')}"):
+                async with self._slots:
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(self._get_executor(), func, *args)
+        except BaseException:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return result
+        finally:
+            self.queue_depth -= 1
+
+    def shutdown(self) -> None:
+        """Останавливает рабочие процессы"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+render_pool = RenderPool(
+    workers=RENDER_POOL.get("workers", 2),
+    executor=RENDER_POOL.get("executor", "thread"),
+    max_queue=RENDER_POOL.get("max_queue", 32)
+)
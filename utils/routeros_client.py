@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from config import ROUTER_POOL
+from utils.admin_utils import register_mikrotik_listener
+from utils.metrics import observe_router_request, router_error_kind, router_path_label
+from utils.tracing import span
+
+logger = logging.getLogger("vpn_bot")
+
+# Таймаут запросов к REST API микротика (секунды)
+DEFAULT_TIMEOUT = 5
+
+# Поля микротика, при изменении которых сессию нужно пересоздать
+CONNECTION_FIELDS = ("host", "username", "password")
+
+# Ожидание блокировки изменений дольше этого времени (секунды) попадает в лог
+SLOW_LOCK_WAIT = 1.0
+
+
+class RouterOSError(Exception):
+    """Ошибка обращения к REST API RouterOS"""
+
+    def __init__(self, message: str, status: Optional[int] = None, text: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.text = text
+
+
+@dataclass
+class _PooledSession:
+    session: aiohttp.ClientSession
+    fingerprint: Tuple[str, str, str]
+    last_used: float
+    # Открытые клиенты RouterOSClient, использующие сессию
+    in_use: int = 0
+    # Сессия удалена из реестра и закроется, когда ее отпустит последний клиент
+    retired: bool = False
+
+
+class SessionPool:
+    """
+    Реестр постоянных HTTP-сессий к микротикам, ключ - ID микротика.
+
+    Каждая сессия держит keep-alive соединения (TLS-рукопожатие выполняется
+    один раз), ограничена max_connections одновременными соединениями и
+    закрывается, если не использовалась дольше idle_timeout секунд.
+
+    Клиенты берут сессию через acquire() и возвращают через release().
+    Сессия, которую держит хотя бы один клиент, не закрывается: ни по
+    простою, ни при пересоздании после смены адреса или учетных данных.
+    """
+
+    def __init__(self, max_connections: int = 4, keepalive_timeout: float = 60, idle_timeout: float = 300):
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, _PooledSession] = {}
+        self._last_sweep = time.monotonic()
+        # Незавершенные закрытия сессий: ссылки не дают сборщику мусора
+        # уничтожить задачу посреди закрытия, close_all() их дожидается
+        self._closing: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _fingerprint(mikrotik: Dict) -> Tuple[str, str, str]:
+        return mikrotik["host"], mikrotik["username"], mikrotik["password"]
+
+    def _create_session(self, mikrotik: Dict) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections,
+            keepalive_timeout=self.keepalive_timeout,
+            ssl=False  # сертификаты микротиков обычно самоподписанные
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            auth=aiohttp.BasicAuth(mikrotik["username"], mikrotik["password"])
+        )
+
+    def acquire(self, mikrotik: Dict) -> _PooledSession:
+        """Возвращает сессию микротика, создавая ее при необходимости, и отмечает ее занятой"""
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        mikrotik_id = mikrotik["id"]
+        fingerprint = self._fingerprint(mikrotik)
+        entry = self._sessions.get(mikrotik_id)
+
+        # Учетные данные или адрес поменялись в обход edit_mikrotik_field
+        if entry is not None and (entry.fingerprint != fingerprint or entry.session.closed):
+            self.drop(mikrotik_id)
+            entry = None
+
+        if entry is None:
+            entry = _PooledSession(self._create_session(mikrotik), fingerprint, now)
+            self._sessions[mikrotik_id] = entry
+
+        entry.last_used = now
+        entry.in_use += 1
+        return entry
+
+    def release(self, entry: _PooledSession) -> None:
+        """Отпускает сессию, полученную через acquire()"""
+        entry.in_use -= 1
+        entry.last_used = time.monotonic()
+        if entry.retired and entry.in_use == 0 and not entry.session.closed:
+            self._close_later(entry.session)
+
+    def drop(self, mikrotik_id: str) -> None:
+        """Удаляет из реестра сессию микротика и закрывает ее, если она никем не занята"""
+        entry = self._sessions.pop(mikrotik_id, None)
+        if entry is None:
+            return
+        entry.retired = True
+        if entry.in_use == 0 and not entry.session.closed:
+            self._close_later(entry.session)
+
+    def _evict_idle(self, now: float) -> None:
+        """Закрывает сессии, простаивающие дольше idle_timeout"""
+        if now - self._last_sweep < min(self.idle_timeout, 60):
+            return
+        self._last_sweep = now
+
+        for mikrotik_id, entry in list(self._sessions.items()):
+            if entry.in_use == 0 and now - entry.last_used > self.idle_timeout:
+                logger.info(f"Закрываем неактивную сессию микротика {mikrotik_id}")
+                self.drop(mikrotik_id)
+
+    def _close_later(self, session: aiohttp.ClientSession) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(session.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close_all(self) -> None:
+        """Закрывает все сессии (при остановке бота), включая уже начатые закрытия"""
+        sessions = [entry.session for entry in self._sessions.values()]
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def on_mikrotik_changed(self, mikrotik_id: str, field: Optional[str]) -> None:
+        """Пересоздает сессию при смене адреса или учетных данных микротика"""
+        if field is None or field in CONNECTION_FIELDS:
+            self.drop(mikrotik_id)
+
+
+session_pool = SessionPool(
+    max_connections=ROUTER_POOL.get("max_connections", 4),
+    keepalive_timeout=ROUTER_POOL.get("keepalive_timeout", 60),
+    idle_timeout=ROUTER_POOL.get("idle_timeout", 300)
+)
+register_mikrotik_listener(session_pool.on_mikrotik_changed)
+
+
+async def close_router_sessions() -> None:
+    """Закрывает все HTTP-сессии к микротикам"""
+    await session_pool.close_all()
+
+
+class MutationLocks:
+    """
+    Блокировки изменений по микротикам.
+
+    Операции, меняющие таблицы микротика (проверка имени и создание записи,
+    выбор адреса и создание пира, отключение), выполняются под блокировкой
+    своего микротика по очереди. Чтение и другие микротики не ждут.
+    Время ожидания в очереди накапливается для статистики.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiting: Dict[str, int] = {}
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @asynccontextmanager
+    async def hold(self, mikrotik_id: str) -> AsyncIterator[None]:
+        """Удерживает блокировку изменений микротика"""
+        lock = self._locks.setdefault(mikrotik_id, asyncio.Lock())
+        if lock.locked():
+            self.contended += 1
+
+        started = time.perf_counter()
+        self._waiting[mikrotik_id] = self._waiting.get(mikrotik_id, 0) + 1
+        try:
+            await lock.acquire()
+        finally:
+            self._waiting[mikrotik_id] -= 1
+
+        wait = time.perf_counter() - started
+        self.acquisitions += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > SLOW_LOCK_WAIT:
+            logger.warning(f"Ожидание блокировки изменений микротика {mikrotik_id}: {wait:.2f} с")
+
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "waiting": sum(self._waiting.values()),
+            "total_wait": round(self.total_wait, 3),
+            "max_wait": round(self.max_wait, 3)
+        }
+
+
+mutation_locks = MutationLocks()
+
+
+def mutation_lock(mikrotik_id: str):
+    """
+    Блокировка изменений микротика:
+
+        async with mutation_lock(mikrotik_id):
+            ...
+    """
+    return mutation_locks.hold(mikrotik_id)
+
+
+async def run_bounded(
+    items: List[Any],
+    action: Callable[[Any], Awaitable[Any]],
+    concurrency: int
+) -> Tuple[List[Any], List[Tuple[Any, str]]]:
+    """
+    Вызывает action(item) для каждого элемента, не больше concurrency
+    вызовов одновременно. Ошибки RouterOS не прерывают остальные вызовы.
+
+    Returns:
+        (done, failed): обработанные элементы и пары (элемент, ошибка)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(item: Any) -> Optional[str]:
+        async with semaphore:
+            try:
+                await action(item)
+                return None
+            except RouterOSError as e:
+                return e.text or str(e)
+
+    errors = await asyncio.gather(*(run_one(item) for item in items))
+    done = [item for item, error in zip(items, errors) if error is None]
+    failed = [(item, error) for item, error in zip(items, errors) if error is not None]
+    return done, failed
+
+
+# Микротики, прошивка которых не поддерживает фильтрацию в REST-запросах:
+# ID микротика -> время (time.monotonic()), после которого фильтрация пробуется снова
+_filtering_unsupported: Dict[str, float] = {}
+
+# Через сколько секунд снова пробовать фильтрацию (прошивку могли обновить)
+FILTERING_RETRY_INTERVAL = 3600
+
+
+class RouterOSClient:
+    """
+    Асинхронный клиент REST API RouterOS.
+
+    Используется как асинхронный контекстный менеджер:
+
+        async with RouterOSClient(mikrotik) as api:
+            secrets = await api.get("/ppp/secret")
+
+    Запросы идут через постоянную сессию микротика из session_pool,
+    поэтому соединения переиспользуются между вызовами.
+    """
+
+    def __init__(self, mikrotik: Dict, timeout: float = DEFAULT_TIMEOUT):
+        self.mikrotik = mikrotik
+        self.base_url = f"{mikrotik['host']}/rest"
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._entry: Optional[_PooledSession] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "RouterOSClient":
+        self._entry = session_pool.acquire(self.mikrotik)
+        self._session = self._entry.session
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        # Сессия принадлежит пулу и остается открытой
+        session_pool.release(self._entry)
+        self._entry = None
+        self._session = None
+
+    async def request(self, method: str, path: str, json: Any = None, params: Optional[Dict] = None) -> Any:
+        """
+        Выполняет запрос к REST API и возвращает разобранный JSON-ответ
+
+        Raises:
+            RouterOSError: при сетевой ошибке, таймауте или HTTP-статусе >= 400
+        """
+        if self._session is None:
+            raise RouterOSError("Сессия RouterOS не открыта")
+
+        url = f"{self.base_url}{path}"
+        with span(f"router {method} {router_path_label(path)}", router=self.mikrotik["id"]):
+            started = time.perf_counter()
+            error_kind = None
+            try:
+                async with self._session.request(method, url, json=json, params=params, timeout=self.timeout) as response:
+                    text = await response.text()
+                    if response.status >= 400:
+                        error_kind = router_error_kind(response.status)
+                        raise RouterOSError(
+                            f"{response.status} {response.reason} for url: {url}",
+                            status=response.status,
+                            text=text
+                        )
+                    if not text:
+                        return None
+                    return await response.json(content_type=None)
+            except asyncio.TimeoutError:
+                error_kind = router_error_kind(None, timeout=True)
+                raise RouterOSError(f"Превышено время ожидания ответа от {url}")
+            except aiohttp.ClientError as e:
+                error_kind = router_error_kind(None)
+                raise RouterOSError(str(e))
+            finally:
+                observe_router_request(self.mikrotik["id"], method, path, time.perf_counter() - started, error_kind)
+
+    async def get(self, path: str, params: Optional[Dict] = None) -> Any:
+        return await self.request("GET", path, params=params)
+
+    async def put(self, path: str, data: Dict) -> Any:
+        return await self.request("PUT", path, json=data)
+
+    async def patch(self, path: str, data: Dict) -> Any:
+        return await self.request("PATCH", path, json=data)
+
+    async def delete(self, path: str) -> Any:
+        return await self.request("DELETE", path)
+
+    async def find(self, path: str, filters: Dict[str, str], proplist: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Возвращает записи, у которых поля совпадают с filters.
+
+        Фильтрация выполняется на стороне RouterOS (?name=...&.proplist=...),
+        поэтому по сети передаются только нужные записи. Если прошивка не
+        поддерживает фильтрацию, загружается вся таблица и фильтруется здесь.
+        """
+        mikrotik_id = self.mikrotik["id"]
+        records = None
+
+        retry_at = _filtering_unsupported.get(mikrotik_id)
+        if retry_at is None or time.monotonic() >= retry_at:
+            params = dict(filters)
+            if proplist:
+                # Поля фильтра нужны для проверки результата
+                fields = list(dict.fromkeys(list(proplist) + list(filters)))
+                params[".proplist"] = ",".join(fields)
+            try:
+                records = await self.get(path, params=params)
+            except RouterOSError as e:
+                if e.status != 400:
+                    raise
+                # Запоминаем только отказ прошивки от параметров, а не ошибку в значении фильтра
+                if "unknown parameter" in (e.text or "").lower():
+                    logger.info(f"Микротик {mikrotik_id} не поддерживает фильтрацию REST, используем полную выборку")
+                    _filtering_unsupported[mikrotik_id] = time.monotonic() + FILTERING_RETRY_INTERVAL
+                else:
+                    logger.warning(f"Микротик {mikrotik_id} отклонил запрос с фильтром ({e.text}), используем полную выборку")
+            else:
+                _filtering_unsupported.pop(mikrotik_id, None)
+
+        if records is None:
+            records = await self.get(path)
+
+        # Старые прошивки могут проигнорировать параметры и вернуть всю таблицу
+        return [r for r in records or [] if all(r.get(k) == v for k, v in filters.items())]
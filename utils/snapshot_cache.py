@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import SNAPSHOT_TTL
+from utils.admin_utils import register_mikrotik_listener
+from utils.routeros_client import RouterOSClient
+
+# Виды снимков таблиц микротика
+PPP_SECRETS = "ppp_secrets"
+PPP_ACTIVE = "ppp_active"
+WG_PEERS = "wg_peers"
+
+# Метаданные WireGuard-интерфейса (ключ снимка - "wg_interface:<имя>")
+WG_INTERFACE = "wg_interface"
+
+# Публичный ключ и порт интерфейса почти не меняются, поэтому кэшируем их надолго (секунды)
+WG_INTERFACE_TTL = 3600
+
+# REST-пути таблиц для каждого вида снимка
+SNAPSHOT_PATHS = {
+    PPP_SECRETS: "/ppp/secret",
+    PPP_ACTIVE: "/ppp/active",
+    WG_PEERS: "/interface/wireguard/peers",
+}
+
+
+class SnapshotCache:
+    """
+    Кэш снимков таблиц микротика с коротким временем жизни.
+
+    Ключ - пара (ID микротика, вид таблицы). Одновременные запросы одного
+    снимка объединяются: к микротику уходит один запрос, остальные ждут
+    его результат. Ошибки загрузки не кэшируются.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._generations: Dict[Tuple[str, str], int] = {}
+
+    async def get(
+        self,
+        mikrotik_id: str,
+        kind: str,
+        fetch: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None
+    ) -> Any:
+        """Возвращает снимок из кэша или загружает его через fetch()"""
+        key = (mikrotik_id, kind)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        return await self._load(key, fetch, self.ttl if ttl is None else ttl)
+
+    async def refresh(
+        self,
+        mikrotik_id: str,
+        kind: str,
+        fetch: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None
+    ) -> Any:
+        """Загружает свежий снимок в обход кэша и сохраняет его"""
+        self.invalidate(mikrotik_id, kind)
+        self.misses += 1
+        return await self._load((mikrotik_id, kind), fetch, self.ttl if ttl is None else ttl)
+
+    async def _load(self, key: Tuple[str, str], fetch: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        # Загрузка выполняется в отдельной задаче, а все ожидающие (включая
+        # начавшего загрузку) ждут ее через shield: отмена одного обработчика
+        # не отменяет загрузку для остальных
+        task = asyncio.get_running_loop().create_task(self._fetch(key, fetch, ttl))
+        # Помечаем исключение как полученное, если все ожидающие были отменены
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Tuple[str, str], fetch: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        generation = self._generations.get(key, 0)
+        task = asyncio.current_task()
+        try:
+            value = await fetch()
+            # Снимок, инвалидированный во время загрузки, может быть устаревшим
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = (time.monotonic() + ttl, value)
+            return value
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def invalidate(self, mikrotik_id: str, *kinds: str) -> None:
+        """Сбрасывает снимки микротика (все, если виды не указаны)"""
+        keys = [key for key in list(self._entries) + list(self._inflight) if key[0] == mikrotik_id]
+        if kinds:
+            keys = [key for key in keys if key[1] in kinds]
+
+        for key in set(keys):
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def on_mikrotik_changed(self, mikrotik_id: str, field: Optional[str]) -> None:
+        """Сбрасывает снимки при смене адреса или WireGuard-интерфейса микротика и при его удалении"""
+        if field in (None, "host", "username", "password", "wg_interface"):
+            self.invalidate(mikrotik_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+snapshot_cache = SnapshotCache(SNAPSHOT_TTL)
+register_mikrotik_listener(snapshot_cache.on_mikrotik_changed)
+
+
+async def get_snapshot(mikrotik: Dict, kind: str, fresh: bool = False) -> list:
+    """
+    Возвращает таблицу микротика, отсортированную по имени.
+
+    Результат общий для всех вызывающих и не должен изменяться на месте.
+    При fresh=True таблица загружается заново (например, перед созданием записи).
+
+    Raises:
+        RouterOSError: если загрузить таблицу не удалось
+    """
+    async def fetch():
+        async with RouterOSClient(mikrotik) as api:
+            records = await api.get(SNAPSHOT_PATHS[kind])
+        # Пустой ответ RouterOS (None) - пустая таблица
+        records = list(records or [])
+        records.sort(key=lambda p: p.get('name', '').lower())
+        return records
+
+    if fresh:
+        return await snapshot_cache.refresh(mikrotik["id"], kind, fetch)
+    return await snapshot_cache.get(mikrotik["id"], kind, fetch)
+
+
+async def get_wireguard_interface(mikrotik: Dict, interface_name: str) -> Dict:
+    """
+    Возвращает метаданные WireGuard-интерфейса микротика (public-key,
+    listen-port) из долгоживущего кэша.
+
+    Raises:
+        RouterOSError: если загрузить интерфейс не удалось
+    """
+    kind = f"{WG_INTERFACE}:{interface_name}"
+
+    async def fetch():
+        async with RouterOSClient(mikrotik) as api:
+            data = await api.get(f"/interface/wireguard/{interface_name}")
+        # Пустой ответ - интерфейса нет
+        data = data or {}
+        return {
+            "name": data.get("name", interface_name),
+            "public-key": data.get("public-key"),
+            "listen-port": data.get("listen-port")
+        }
+
+    interface = await snapshot_cache.get(mikrotik["id"], kind, fetch, ttl=WG_INTERFACE_TTL)
+    # Интерфейс без ключа (например, еще не настроенный) не держим в кэше
+    if not interface.get("public-key"):
+        snapshot_cache.invalidate(mikrotik["id"], kind)
+    return interface
@@ -0,0 +1,552 @@
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Версия данных. Для JSON-файла - (inode, время изменения в нс, размер):
+# атомарная запись создает новый файл, поэтому версия меняется при каждом
+# сохранении. Для SQLite - счетчик записей документа (в таблице meta и в памяти процесса).
+Version = Any
+
+# Значение expected_version по умолчанию: версию не проверять
+ANY_VERSION = object()
+
+
+class VersionConflict(Exception):
+    """Файл изменился с момента чтения (запись отклонена)"""
+
+
+class JsonStore:
+    """
+    JSON-файл с атомарной записью.
+
+    Данные пишутся во временный файл в той же папке, сбрасываются на диск
+    (fsync) и заменяют основной файл через os.replace, поэтому при сбое
+    на диске остается либо старая, либо новая версия целиком.
+
+    write() принимает ожидаемую версию файла (compare-and-swap): если файл
+    изменили после чтения, запись отклоняется с VersionConflict.
+    """
+
+    def __init__(self, path: str, default: Dict, on_saved: Optional[Callable[[Dict, Version], None]] = None):
+        self.path = path
+        self.default = default
+        self.on_saved = on_saved
+        # Блокировка потоков, а не asyncio.Lock: транзакции - синхронные контекстные
+        # менеджеры, и часть записей выполняется в рабочих потоках (отложенная запись
+        # выбранных микротиков), где asyncio.Lock захватить нельзя. Реентерабельная,
+        # потому что write() вызывается внутри transaction() под той же блокировкой
+        self.lock = threading.RLock()
+
+    def version(self) -> Version:
+        """Текущая версия файла (None, если файла нет)"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def ensure_exists(self) -> None:
+        """Создает файл с данными по умолчанию, если его нет"""
+        with self.lock:
+            if not os.path.exists(self.path):
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._write_file(self.default)
+
+    def read(self) -> Tuple[Dict, Version]:
+        """Читает файл и возвращает (данные, версия)"""
+        with self.lock:
+            version = self.version()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f), version
+
+    def write(self, data: Dict, expected_version: Any = ANY_VERSION) -> Version:
+        """
+        Атомарно записывает данные в файл
+
+        Args:
+            data: Данные для записи
+            expected_version: Версия, прочитанная перед изменением
+                (по умолчанию не проверяется)
+
+        Returns:
+            Новая версия файла
+
+        Raises:
+            VersionConflict: если файл изменился после чтения
+        """
+        with self.lock:
+            if expected_version is not ANY_VERSION and self.version() != expected_version:
+                raise VersionConflict(f"Файл {self.path} изменился после чтения")
+            self._write_file(data)
+            version = self.version()
+
+        if self.on_saved is not None:
+            self.on_saved(data, version)
+        return version
+
+    def _write_file(self, data: Dict) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        _fsync_directory(directory)
+
+
+def _fsync_directory(directory: str) -> None:
+    """Сбрасывает на диск запись о переименовании файла (только POSIX)"""
+    if os.name != "posix":
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Transaction:
+    """
+    Согласованное изменение одного или нескольких хранилищ (JsonStore или SqliteStore).
+
+    read() запоминает версию файла, write() откладывает запись до конца
+    транзакции. При фиксации сначала проверяются версии всех файлов,
+    и только если ни один не изменился, файлы записываются. Документы
+    одной базы SQLite записываются атомарно, одной SQL-транзакцией.
+    """
+
+    def __init__(self, stores: List[Any]):
+        self.stores = stores
+        self._versions: Dict[str, Version] = {}
+        self._pending: Dict[str, Tuple[Any, Dict]] = {}
+
+    def _check_store(self, store: Any) -> None:
+        if store not in self.stores:
+            raise ValueError(f"Файл {store.path} не входит в транзакцию")
+
+    def read(self, store: Any) -> Dict:
+        """Возвращает копию данных файла (с учетом уже сделанных в транзакции изменений)"""
+        self._check_store(store)
+        if store.path in self._pending:
+            return copy.deepcopy(self._pending[store.path][1])
+        data, version = store.read()
+        self._versions.setdefault(store.path, version)
+        return data
+
+    def write(self, store: Any, data: Dict) -> None:
+        """Откладывает запись данных до фиксации транзакции"""
+        self._check_store(store)
+        if store.path not in self._versions:
+            self._versions[store.path] = store.version()
+        self._pending[store.path] = (store, copy.deepcopy(data))
+
+    def commit(self) -> None:
+        for path, (store, data) in self._pending.items():
+            if store.version() != self._versions[path]:
+                raise VersionConflict(f"Файл {path} изменился во время транзакции")
+
+        # Документы одной базы SQLite записываются в одной SQL-транзакции:
+        # при ошибке не применяется ни одно изменение
+        writes = list(self._pending.values())
+        sqlite_only = all(isinstance(store, SqliteStore) for store, data in writes)
+        if writes and sqlite_only and len({id(store.db) for store, data in writes}) == 1:
+            db = writes[0][0].db
+            with db.write_transaction() as conn:
+                versions = [store.write_rows(conn, data, self._versions[store.path]) for store, data in writes]
+            for (store, data), version in zip(writes, versions):
+                store.saved(data, version)
+        else:
+            for path, (store, data) in self._pending.items():
+                store.write(data, self._versions[path])
+        self._pending.clear()
+
+
+@contextmanager
+def transaction(*stores: Any) -> Iterator[Transaction]:
+    """
+    Открывает транзакцию над хранилищами:
+
+        with transaction(mikrotiks_store, admins_store) as tx:
+            data = tx.read(mikrotiks_store)
+            ...
+            tx.write(mikrotiks_store, data)
+
+    Блокировки файлов берутся в порядке путей, чтобы две транзакции
+    не ждали друг друга бесконечно (deadlock). Если блок завершился исключением, ничего
+    не записывается.
+    """
+    ordered = sorted(stores, key=lambda store: store.path)
+    for store in ordered:
+        store.lock.acquire()
+    try:
+        tx = Transaction(ordered)
+        yield tx
+        tx.commit()
+    finally:
+        for store in reversed(ordered):
+            store.lock.release()
+
+
+# Версия схемы (PRAGMA user_version). В версии 0 таблица admins имела ключ id,
+# и администратор из обоих списков терял строку 1-го уровня. В версии 1 были
+# индексы, которые не использовал ни один запрос
+SQLITE_SCHEMA_VERSION = 2
+
+# Индексы, удаленные в версии 2
+SQLITE_DROPPED_INDEXES = ["mikrotiks_name", "admins_level", "admin_mikrotiks_mikrotik", "user_selections_mikrotik"]
+
+# Схема SQLite: по таблице на сущность, строки ищутся по первичному ключу
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mikrotiks (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    host TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mikrotiks_position ON mikrotiks (position);
+CREATE TABLE IF NOT EXISTS admins (
+    id INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    name TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (id, level)
+);
+CREATE TABLE IF NOT EXISTS admin_mikrotiks (
+    admin_id INTEGER NOT NULL,
+    level INTEGER NOT NULL DEFAULT 2,
+    mikrotik_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (admin_id, level, mikrotik_id),
+    FOREIGN KEY (admin_id, level) REFERENCES admins (id, level) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS user_selections (
+    user_id INTEGER PRIMARY KEY,
+    mikrotik_id TEXT NOT NULL
+);
+"""
+
+
+class SqliteDatabase:
+    """
+    Файл базы SQLite с одним соединением на процесс.
+
+    Соединение используется из разных потоков, поэтому все обращения
+    к нему выполняются под общей блокировкой lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: транзакции открываются явно в write_transaction()
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        """Создает таблицы и обновляет схему старой базы в одной транзакции"""
+        with self.write_transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            primary_key = [row[1] for row in sorted(conn.execute("PRAGMA table_info(admins)"), key=lambda row: row[5]) if row[5]]
+            legacy = version < 1 and primary_key == ["id"]
+            for index in SQLITE_DROPPED_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+            if legacy:
+                conn.execute("ALTER TABLE admin_mikrotiks RENAME TO legacy_admin_mikrotiks")
+                conn.execute("ALTER TABLE admins RENAME TO legacy_admins")
+
+            for statement in SQLITE_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+
+            if legacy:
+                conn.execute("INSERT INTO admins (id, level, name, position) SELECT id, level, name, position FROM legacy_admins")
+                conn.execute(
+                    "INSERT INTO admin_mikrotiks (admin_id, level, mikrotik_id, position) "
+                    "SELECT m.admin_id, a.level, m.mikrotik_id, m.position "
+                    "FROM legacy_admin_mikrotiks m JOIN legacy_admins a ON a.id = m.admin_id"
+                )
+                conn.execute("DROP TABLE legacy_admin_mikrotiks")
+                conn.execute("DROP TABLE legacy_admins")
+            conn.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+
+    @contextmanager
+    def write_transaction(self) -> Iterator[sqlite3.Connection]:
+        """Транзакция записи: BEGIN IMMEDIATE ... COMMIT (ROLLBACK при исключении)"""
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class SqliteStore:
+    """
+    Документ хранилища в таблицах SQLite.
+
+    Интерфейс совпадает с JsonStore (read, write, version, ensure_exists),
+    поэтому хранилища взаимозаменяемы в ConfigRegistry и transaction().
+    Подклассы переводят документ в строки таблиц (tables и _rows) и обратно
+    (_load). При записи сравниваются строки нового документа с последними
+    прочитанными или записанными, и в базу попадают только изменения.
+
+    Версия документа - счетчик в таблице meta, он увеличивается при каждой
+    записи и проверяется в той же SQL-транзакции, что и запись. version()
+    возвращает копию счетчика в памяти процесса, поэтому проверка кэша
+    конфигурации не обращается к базе и не ждет чужой записи. База
+    рассчитана на один процесс бота: изменения из другого процесса
+    (например, tools/migrate_storage.py) видны после перезапуска.
+    """
+
+    name = ""
+    default: Dict = {}
+    # Таблицы документа: (таблица, столбцы ключа, остальные столбцы); родительские - первыми
+    tables: List[Tuple[str, Tuple[str, ...], Tuple[str, ...]]] = []
+
+    def __init__(self, db: SqliteDatabase, on_saved: Optional[Callable[[Dict, Version], None]] = None):
+        self.db = db
+        self.on_saved = on_saved
+        self.lock = db.lock
+        self.path = f"{db.path}#{self.name}"
+        with self.lock:
+            self._version = self._stored_version(db.connection)
+        # Строки таблиц на версии _snapshot[0]: база для сравнения при записи
+        self._snapshot: Optional[Tuple[Version, Dict[str, Dict[tuple, tuple]]]] = None
+        self._written: Optional[Tuple[Version, Dict[str, Dict[tuple, tuple]]]] = None
+
+    def _stored_version(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT version FROM meta WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else 0
+
+    def version(self) -> Version:
+        return self._version
+
+    def ensure_exists(self) -> None:
+        """Таблицы создаются вместе с базой, отдельная инициализация не нужна"""
+
+    def read(self) -> Tuple[Dict, Version]:
+        with self.lock:
+            conn = self.db.connection
+            data = self._load(conn)
+            self._version = self._stored_version(conn)
+            self._snapshot = (self._version, self._rows(data))
+            return data, self._version
+
+    def write(self, data: Dict, expected_version: Any = ANY_VERSION) -> Version:
+        """
+        Заменяет содержимое таблиц документа в одной SQL-транзакции
+
+        Raises:
+            VersionConflict: если документ изменился после чтения
+        """
+        with self.db.write_transaction() as conn:
+            version = self.write_rows(conn, data, expected_version)
+        self.saved(data, version)
+        return version
+
+    def write_rows(self, conn: sqlite3.Connection, data: Dict, expected_version: Any = ANY_VERSION) -> Version:
+        """Записывает документ в уже открытой транзакции и возвращает новую версию"""
+        current = self._stored_version(conn)
+        if expected_version is not ANY_VERSION and current != expected_version:
+            raise VersionConflict(f"Данные {self.path} изменились после чтения")
+
+        if self._snapshot is not None and self._snapshot[0] == current:
+            old = self._snapshot[1]
+        else:
+            old = self._rows(self._load(conn))
+        new = self._rows(data)
+
+        # Удаления - начиная с дочерних таблиц, вставки и обновления - с родительских
+        for table, keys, _ in reversed(self.tables):
+            removed = [key for key in old[table] if key not in new[table]]
+            if removed:
+                condition = " AND ".join(f"{column} = ?" for column in keys)
+                conn.executemany(f"DELETE FROM {table} WHERE {condition}", removed)
+        for table, keys, values in self.tables:
+            changed = [key + row for key, row in new[table].items() if old[table].get(key) != row]
+            if changed:
+                columns = ", ".join(keys + values)
+                placeholders = ", ".join("?" for _ in keys + values)
+                updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+                conn.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "
+                    f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+                    changed
+                )
+
+        version = current + 1
+        conn.execute(
+            "INSERT INTO meta (name, version) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET version = excluded.version",
+            (self.name, version)
+        )
+        self._written = (version, new)
+        return version
+
+    def saved(self, data: Dict, version: Version) -> None:
+        """Обновляет версию после фиксации транзакции и оповещает подписчика (кэш конфигурации)"""
+        if self._written is not None and self._written[0] == version:
+            self._snapshot = self._written
+        self._written = None
+        self._version = version
+        if self.on_saved is not None:
+            self.on_saved(data, version)
+
+    def _load(self, conn: sqlite3.Connection) -> Dict:
+        raise NotImplementedError
+
+    def _rows(self, data: Dict) -> Dict[str, Dict[tuple, tuple]]:
+        """Строки таблиц документа: таблица -> {значения ключа: значения остальных столбцов}"""
+        raise NotImplementedError
+
+
+class SqliteMikrotikStore(SqliteStore):
+    """Микротики: {"mikrotiks": [...]} <-> таблица mikrotiks"""
+
+    name = "mikrotiks"
+    default = {"mikrotiks": []}
+    tables = [("mikrotiks", ("id",), ("position", "name", "host", "data"))]
+
+    def _load(self, conn: sqlite3.Connection) -> Dict:
+        rows = conn.execute("SELECT data FROM mikrotiks ORDER BY position").fetchall()
+        return {"mikrotiks": [json.loads(data) for data, in rows]}
+
+    def _rows(self, data: Dict) -> Dict[str, Dict[tuple, tuple]]:
+        return {"mikrotiks": {
+            (m["id"],): (position, m.get("name", ""), m.get("host", ""), json.dumps(m, ensure_ascii=False))
+            for position, m in enumerate(data["mikrotiks"])
+        }}
+
+
+class SqliteAdminStore(SqliteStore):
+    """Администраторы: {"level_1": [...], "level_2": [...]} <-> таблицы admins и admin_mikrotiks"""
+
+    name = "admins"
+    default = {"level_1": [], "level_2": []}
+    tables = [
+        ("admins", ("id", "level"), ("name", "position")),
+        ("admin_mikrotiks", ("admin_id", "level", "mikrotik_id"), ("position",))
+    ]
+
+    def _load(self, conn: sqlite3.Connection) -> Dict:
+        grants: Dict[int, List[str]] = {}
+        for admin_id, mikrotik_id in conn.execute(
+            "SELECT admin_id, mikrotik_id FROM admin_mikrotiks WHERE level = 2 ORDER BY admin_id, position"
+        ):
+            grants.setdefault(admin_id, []).append(mikrotik_id)
+
+        data = {"level_1": [], "level_2": []}
+        for admin_id, level, name in conn.execute("SELECT id, level, name FROM admins ORDER BY level, position"):
+            if level == 1:
+                data["level_1"].append(admin_id)
+            else:
+                data["level_2"].append({
+                    "id": admin_id,
+                    "name": name,
+                    "allowed_mikrotiks": grants.get(admin_id, [])
+                })
+        return data
+
+    def _rows(self, data: Dict) -> Dict[str, Dict[tuple, tuple]]:
+        # Ключ - (id, уровень): ID может одновременно быть в обоих списках
+        admins = {(admin_id, 1): (None, position) for position, admin_id in enumerate(data["level_1"])}
+        grants = {}
+        for position, admin in enumerate(data["level_2"]):
+            admins[(admin["id"], 2)] = (admin.get("name"), position)
+            for i, mikrotik_id in enumerate(admin.get("allowed_mikrotiks", [])):
+                grants.setdefault((admin["id"], 2, mikrotik_id), (i,))
+        return {"admins": admins, "admin_mikrotiks": grants}
+
+
+class SqliteSelectionStore(SqliteStore):
+    """Выбранные пользователями микротики: {"selections": {user_id: mikrotik_id}} <-> таблица user_selections"""
+
+    name = "user_selections"
+    default = {"selections": {}}
+    tables = [("user_selections", ("user_id",), ("mikrotik_id",))]
+
+    def _load(self, conn: sqlite3.Connection) -> Dict:
+        rows = conn.execute("SELECT user_id, mikrotik_id FROM user_selections").fetchall()
+        # Ключи - строки, как в JSON-файле
+        return {"selections": {str(user_id): mikrotik_id for user_id, mikrotik_id in rows}}
+
+    def _rows(self, data: Dict) -> Dict[str, Dict[tuple, tuple]]:
+        return {"user_selections": {
+            (int(user_id),): (mikrotik_id,) for user_id, mikrotik_id in data["selections"].items()
+        }}
+
+
+# Файлы JSON-хранилища (бэкенд по умолчанию): имя документа -> (путь, данные по умолчанию)
+JSON_FILES = {
+    "mikrotiks": ("data/mikrotiks.json", {"mikrotiks": []}),
+    "admins": ("data/admins.json", {"level_1": [], "level_2": []}),
+    "user_selections": ("data/user_selections.json", {"selections": {}})
+}
+
+SQLITE_STORES = {
+    "mikrotiks": SqliteMikrotikStore,
+    "admins": SqliteAdminStore,
+    "user_selections": SqliteSelectionStore
+}
+
+DEFAULT_SQLITE_PATH = "data/bot.db"
+
+
+def open_stores(settings: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Создает хранилища документов mikrotiks, admins и user_selections
+
+    Args:
+        settings: Секция "storage" из config.json:
+            {"backend": "json"} (по умолчанию) или
+            {"backend": "sqlite", "sqlite_path": "data/bot.db"}
+
+    Returns:
+        Словарь имя документа -> хранилище
+    """
+    settings = settings or {}
+    backend = settings.get("backend", "json")
+
+    if backend == "json":
+        stores = {name: JsonStore(path, copy.deepcopy(default)) for name, (path, default) in JSON_FILES.items()}
+    elif backend == "sqlite":
+        db = SqliteDatabase(settings.get("sqlite_path", DEFAULT_SQLITE_PATH))
+        stores = {name: cls(db) for name, cls in SQLITE_STORES.items()}
+    else:
+        raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
+
+    for store in stores.values():
+        store.ensure_exists()
+    return stores
@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+
+from config import TRACING
+
+# Сколько самых медленных трассировок хранить
+DEFAULT_SLOWEST = 20
+
+# Трассировки быстрее этого порога (секунды) не сохраняются
+DEFAULT_MIN_DURATION = 0.1
+
+# Имя команды или префикс данных кнопки, допустимые в имени интервала
+_IDENTIFIER_RE = re.compile(r"[A-Za-z][A-Za-z0-9_]{0,31}")
+
+
+class Span:
+    """Интервал трассировки: имя, время выполнения, атрибуты и вложенные интервалы"""
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None, root: Optional["Span"] = None):
+        self.name = name
+        self.attrs = attrs or {}
+        # Корневой интервал трассировки (интервал обновления)
+        self.root = root or self
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.start
+
+
+# Текущий интервал. Задачи asyncio копируют контекст при создании,
+# поэтому интервалы вложенных задач (gather, create_task) попадают в трассировку родителя
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """
+    Замеряет вложенный интервал текущей трассировки:
+
+        with span("router GET /ppp/secret", router=mikrotik_id):
+            ...
+
+    Вне трассировки (например, при фоновой рассылке) ничего не делает.
+    Задачи, запущенные обработчиком без ожидания (удаление сообщения через
+    минуту), наследуют интервал обновления, но к завершенной и уже
+    сохраненной трассировке ничего не добавляется.
+    """
+    parent = _current_span.get()
+    if parent is None or parent.root.duration is not None:
+        yield None
+        return
+
+    current = Span(name, attrs, parent.root)
+    parent.children.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+
+
+class SlowTraces:
+    """
+    Хранилище самых медленных трассировок.
+
+    Держит не больше capacity трассировок в куче по длительности: новая
+    трассировка вытесняет самую быструю из сохраненных, поэтому память
+    ограничена, а медленные запросы не теряются среди быстрых.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_SLOWEST, min_duration: float = DEFAULT_MIN_DURATION):
+        self.capacity = capacity
+        self.min_duration = min_duration
+        self.recorded = 0
+        self._heap: List[Tuple[float, int, Span]] = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Span) -> None:
+        if trace.duration is None or trace.duration < self.min_duration:
+            return
+        item = (trace.duration, next(self._counter), trace)
+        with self._lock:
+            self.recorded += 1
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, item)
+            elif trace.duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def slowest(self, limit: Optional[int] = None) -> List[Span]:
+        """Трассировки от самой медленной к самой быстрой"""
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        return [trace for _, _, trace in items[:limit]]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heap.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"stored": len(self._heap), "recorded": self.recorded}
+
+
+slow_traces = SlowTraces(
+    capacity=TRACING.get("slowest", DEFAULT_SLOWEST),
+    min_duration=TRACING.get("min_duration", DEFAULT_MIN_DURATION)
+)
+
+
+def _identifier(value: str) -> Optional[str]:
+    """Возвращает value, если это имя команды или действия (латиница, цифры, _), иначе None"""
+    return value if _IDENTIFIER_RE.fullmatch(value) else None
+
+
+def _describe_update(update: Any) -> Tuple[str, Dict[str, Any]]:
+    """Имя корневого интервала и атрибуты по содержимому обновления"""
+    event_type = getattr(update, "event_type", "update")
+    event = getattr(update, "event", None)
+    attrs: Dict[str, Any] = {"update_id": getattr(update, "update_id", None)}
+
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        attrs["user_id"] = user.id
+
+    # В имя попадает только команда или действие кнопки, но не произвольный текст:
+    # в диалогах вводятся пароли, а трассировки показываются через /traces
+    data = getattr(event, "data", None)
+    text = getattr(event, "text", None)
+    if isinstance(data, str):
+        detail = _identifier(data.split(":", 1)[0])
+    elif isinstance(text, str) and text.startswith("/"):
+        command = _identifier(text[1:].split(maxsplit=1)[0].split("@", 1)[0] if text[1:].strip() else "")
+        detail = f"/{command}" if command else None
+    elif getattr(event, "document", None) is not None:
+        detail = "[документ]"
+    else:
+        detail = None
+    name = f"{event_type} {detail}" if detail else event_type
+    return name, attrs
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений: открывает корневой интервал на время
+    обработки обновления и сохраняет трассировку в slow_traces.
+
+        dp.update.outer_middleware(TracingMiddleware())
+    """
+
+    def __init__(self, storage: SlowTraces = slow_traces):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        name, attrs = _describe_update(event)
+        root = Span(name, attrs)
+        token = _current_span.set(root)
+        try:
+            return await handler(event, data)
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            root.finish()
+            _current_span.reset(token)
+            self.storage.add(root)
+
+
+def format_trace(trace: Span, max_depth: int = 6) -> str:
+    """Текстовое дерево трассировки с временем интервалов в мс"""
+    lines = [
+        f"⏱ {trace.duration * 1000:.0f} мс - {trace.name}",
+        f"   {time.strftime('%d.%m %H:%M:%S', time.localtime(trace.started_at))}"
+        + (f", пользователь {trace.attrs['user_id']}" if trace.attrs.get("user_id") else "")
+        + (f", ошибка {trace.error}" if trace.error else "")
+    ]
+
+    def walk(node: Span, depth: int) -> None:
+        for child in node.children:
+            duration = f"{child.duration * 1000:.0f} мс" if child.duration is not None else "не завершен"
+            offset = (child.start - trace.start) * 1000
+            error = f" ❌ {child.error}" if child.error else ""
+            lines.append(f"{'  ' * depth}└ {child.name}: {duration} (+{offset:.0f} мс){error}")
+            if depth < max_depth:
+                walk(child, depth + 1)
+
+    walk(trace, 1)
+    return "\n".join(lines)
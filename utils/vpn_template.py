@@ -1,26 +1,31 @@
 import os
-import tempfile
+import re
+from typing import Dict, List, Optional, Tuple
 
-def generate_ovpn_file(username, password, mikrotik_id):
-    """
-    Генерирует .ovpn файл на основе шаблона c указанными учетными данными
-    
-    Args:
-        username: Имя пользователя VPN
-        password: Пароль пользователя VPN
-        mikrotik_id: ID микротика
-        
-    Returns:
-        Путь к сгенерированному файлу
-    """
-    # Определяем путь к шаблону
-    template_path = os.path.join(
+from utils.admin_utils import register_mikrotik_listener
+from utils.tracing import span
+
+# Плейсхолдеры, которые подставляются в шаблон
+_PLACEHOLDER_RE = re.compile(r'\{(username|password)\}')
+
+# Кэш подготовленных шаблонов: путь к файлу -> (время изменения в нс, размер, части шаблона).
+# Файл проверяется через stat при каждом обращении, поэтому правка шаблона
+# (в том числе стандартного в подключенном томе) видна без перезапуска
+_template_cache: Dict[str, Tuple[int, int, List[str]]] = {}
+
+def _router_template_path(mikrotik_id: str) -> str:
+    """Путь к собственному шаблону микротика"""
+    return os.path.join(
         os.path.dirname(os.path.dirname(__file__)), 
         'templates', 
         'mikrotik_templates', 
         mikrotik_id, 
         'openvpn_template.ovpn'
     )
+
+def _resolve_template_path(mikrotik_id: str) -> str:
+    """Возвращает путь к шаблону микротика или к стандартному шаблону"""
+    template_path = _router_template_path(mikrotik_id)
     
     # Если шаблон не существует, используем стандартный шаблон
     if not os.path.exists(template_path):
@@ -30,27 +35,57 @@ def generate_ovpn_file(username, password, mikrotik_id):
             'openvpn_template.ovpn'
         )
     
-    # Создаем имя файла
-    filename = f"{username}.ovpn"
-    
-    # Создаем временный файл
-    fd, temp_path = tempfile.mkstemp(suffix='.ovpn')
+    return template_path
+
+def _get_template(mikrotik_id: str) -> List[str]:
+    """
+    Возвращает шаблон микротика, разбитый на части.
+    Четные элементы - текст, нечетные - имена плейсхолдеров.
+    """
+    template_path = _resolve_template_path(mikrotik_id)
+    st = os.stat(template_path)
+    cached = _template_cache.get(template_path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+
+    with open(template_path, 'r', encoding='utf-8') as template_file:
+        parts = _PLACEHOLDER_RE.split(template_file.read())
+    _template_cache[template_path] = (st.st_mtime_ns, st.st_size, parts)
+    return parts
+
+def invalidate_template_cache(mikrotik_id: Optional[str] = None) -> None:
+    """Сбрасывает кэш шаблона микротика (или всех шаблонов)"""
+    if mikrotik_id is None:
+        _template_cache.clear()
+    else:
+        _template_cache.pop(_router_template_path(mikrotik_id), None)
+
+def _on_mikrotik_changed(mikrotik_id: str, field: Optional[str]) -> None:
+    if field in (None, "openvpn_template"):
+        invalidate_template_cache(mikrotik_id)
+
+register_mikrotik_listener(_on_mikrotik_changed)
+
+def generate_ovpn_file(username, password, mikrotik_id):
+    """
+    Генерирует .ovpn файл на основе шаблона c указанными учетными данными
     
-    try:
-        # Читаем шаблон
-        with open(template_path, 'r', encoding='utf-8') as template_file:
-            template_content = template_file.read()
+    Args:
+        username: Имя пользователя VPN
+        password: Пароль пользователя VPN
+        mikrotik_id: ID микротика
+        
+    Returns:
+        Кортеж (содержимое файла в байтах, имя файла)
+    """
+    with span("ovpn template"):
+        parts = _get_template(mikrotik_id)
+        values = {'username': username, 'password': password}
         
-        # Заменяем плейсхолдеры на реальные данные
-        file_content = template_content.replace('{username}', username).replace('{password}', password)
+        # Создаем имя файла
+        filename = f"{username}.ovpn"
         
-        # Записываем содержимое в файл
-        with os.fdopen(fd, 'w', encoding='utf-8') as temp_file:
-            temp_file.write(file_content)
+        # Подставляем реальные данные вместо плейсхолдеров
+        file_content = ''.join(values[part] if i % 2 else part for i, part in enumerate(parts))
         
-        return temp_path, filename
-    except Exception as e:
-        # В случае ошибки закрываем дескриптор и удаляем файл
-        os.close(fd)
-        os.unlink(temp_path)
-        raise e
\ No newline at end of file
+        return file_content.encode('utf-8'), filename
\ No newline at end of file
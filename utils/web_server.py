@@ -0,0 +1,216 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from utils.metrics import metrics_handler
+
+logger = logging.getLogger("vpn_bot")
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_WEBHOOK_PATH = "/webhook"
+
+# Сколько секунд при остановке ждать завершения уже принятых обновлений
+DEFAULT_DRAIN_TIMEOUT = 30
+
+# Адреса, с которых /metrics доступен без токена
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+# Заголовок, в котором Telegram передает секрет вебхука
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebServer:
+    """
+    Встроенный HTTP-сервер бота (по умолчанию порт 8080).
+
+    Всегда отдает /health и /metrics (формат Prometheus), остальные
+    маршруты (вебхук и т.п.) добавляются
+    через app.router до вызова start(). Разделы ответа /health
+    регистрируются через add_health_info().
+
+    /metrics раскрывает ID микротиков и имена обработчиков, поэтому
+    отдается только с заголовком "Authorization: Bearer <metrics_token>",
+    а если токен не задан - только на запросы с этой же машины.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, metrics_token: str = ""):
+        self.host = host
+        self.port = port
+        self.metrics_token = metrics_token
+        self.app = web.Application()
+        self.app.router.add_get("/health", self._health)
+        self.app.router.add_get("/metrics", self._metrics)
+        self.started_at = time.monotonic()
+        self._health_info: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_health_info(self, name: str, callback: Callable[[], Dict[str, Any]]) -> None:
+        """Добавляет в ответ /health раздел name с результатом callback()"""
+        self._health_info[name] = callback
+
+    async def _health(self, request: web.Request) -> web.Response:
+        body: Dict[str, Any] = {"status": "ok", "uptime": round(time.monotonic() - self.started_at, 1)}
+        for name, callback in self._health_info.items():
+            try:
+                body[name] = callback()
+            except Exception as e:
+                body[name] = {"error": str(e)}
+        if any(isinstance(info, dict) and info.get("draining") for info in body.values()):
+            body["status"] = "draining"
+            return web.json_response(body, status=503)
+        return web.json_response(body)
+
+    def _metrics_allowed(self, request: web.Request) -> bool:
+        if self.metrics_token:
+            header = request.headers.get("Authorization", "")
+            return hmac.compare_digest(header.encode(), f"Bearer {self.metrics_token}".encode())
+        return request.remote in LOCAL_ADDRESSES
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        if not self._metrics_allowed(request):
+            return web.Response(status=401)
+        return await metrics_handler(request)
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"HTTP-сервер запущен на {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("HTTP-сервер остановлен")
+
+
+class WebhookHandler:
+    """
+    Прием обновлений Telegram через вебхук.
+
+    Запрос проверяется по секретному токену и сразу получает ответ 200,
+    а обновление обрабатывается в отдельной задаче (как и при long
+    polling), чтобы долгие обработчики не задерживали Telegram. При
+    остановке новые обновления отклоняются с 503 (Telegram доставит их
+    повторно), а уже принятые дорабатываются в drain().
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret_token: str):
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self.draining = False
+        self.received = 0
+        self.rejected = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self.draining:
+            return web.Response(status=503)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Dict[str, Any]) -> None:
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}", exc_info=True)
+
+    async def drain(self, timeout: float = DEFAULT_DRAIN_TIMEOUT) -> None:
+        """Перестает принимать обновления и ждет завершения уже принятых"""
+        self.draining = True
+        if not self._tasks:
+            return
+        logger.info(f"Ожидание завершения обработки обновлений: {len(self._tasks)}")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Не дождались завершения обработки обновлений: {len(pending)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "in_flight": len(self._tasks),
+            "received": self.received,
+            "rejected": self.rejected
+        }
+
+
+async def wait_for_stop_signal() -> None:
+    """Ждет SIGINT или SIGTERM (docker stop)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # На Windows обработчики сигналов в цикле событий не поддерживаются
+            pass
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, server: WebServer, settings: Dict[str, Any]) -> None:
+    """
+    Запускает бота в режиме вебхука на встроенном HTTP-сервере
+
+    Args:
+        settings: Секция "webhook" из config.json: url (внешний адрес,
+            например https://bot.example.com), path, secret_token,
+            drain_timeout, drop_pending_updates
+    """
+    path = settings.get("path", DEFAULT_WEBHOOK_PATH)
+    # Если секрет не задан, генерируем новый при каждом запуске: вебхук все равно переустанавливается
+    secret_token = settings.get("secret_token") or secrets.token_urlsafe(32)
+
+    handler = WebhookHandler(dp, bot, secret_token)
+    server.app.router.add_post(path, handler.handle)
+    server.add_health_info("webhook", handler.stats)
+    await server.start()
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await bot.set_webhook(
+            url=settings["url"].rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=settings.get("drop_pending_updates", False)
+        )
+        logger.info(f"Вебхук установлен: {settings['url'].rstrip('/')}{path}")
+
+        await wait_for_stop_signal()
+        logger.info("Получен сигнал остановки, завершаем обработку обновлений")
+    finally:
+        # Вебхук не удаляем: обновления, пришедшие во время перезапуска, Telegram доставит повторно
+        await handler.drain(settings.get("drain_timeout", DEFAULT_DRAIN_TIMEOUT))
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
@@ -1,305 +1,383 @@
-import requests
-import base64
-import json
-import re
-import qrcode
-import os
-import tempfile
-from io import BytesIO
-from cryptography.hazmat.primitives.asymmetric import x25519
-from cryptography.hazmat.primitives import serialization
+import asyncio
 
 from utils.admin_utils import get_mikrotik_by_id
+from utils.routeros_client import RouterOSClient, RouterOSError, mutation_lock, run_bounded
+from utils.snapshot_cache import snapshot_cache, get_snapshot, get_wireguard_interface, WG_PEERS
+from utils.render_pool import render_pool
+from utils.render_jobs import render_wireguard_files, generate_wireguard_keypair, generate_wireguard_keypairs
+from utils.ip_allocator import get_address_pool, peer_dns, AddressPoolExhausted
+from utils.mikrotik_api import BULK_CONCURRENCY
 
-def get_wireguard_peers(mikrotik_id):
-    """Получает список пиров WireGuard"""
+async def get_wireguard_peers(mikrotik_id, fresh=False):
+    """
+    Получает список пиров WireGuard, отсортированный по имени.
+    При fresh=True список загружается с микротика в обход кэша.
+    """
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        response = requests.get(f"{BASE_URL}/interface/wireguard/peers", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        peers = response.json()
-        
-        # Сортируем пиры по имени
-        peers.sort(key=lambda p: p.get('name', '').lower())
-        
-        return peers
-    except requests.RequestException as e:
+        # Снимок уже отсортирован по имени
+        return await get_snapshot(mikrotik, WG_PEERS, fresh=fresh)
+    except RouterOSError as e:
         return f"Ошибка получения пиров WireGuard: {e}"
 
-def disable_wireguard_peer(peer_id, mikrotik_id):
+async def disable_wireguard_peer(peer_id, mikrotik_id):
     """Отключает пир WireGuard по ID"""
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
-    
     try:
-        # Получаем текущий пир
-        response = requests.get(f"{BASE_URL}/interface/wireguard/peers/{peer_id}", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        peer_data = response.json()
-        
-        # Устанавливаем disabled в true
-        update_data = {"disabled": "true"}
-        
-        # Обновляем пир
-        response = requests.patch(
-            f"{BASE_URL}/interface/wireguard/peers/{peer_id}", 
-            auth=AUTH, 
-            verify=False, 
-            json=update_data,
-            timeout=5
-        )
-        response.raise_for_status()
+        async with mutation_lock(mikrotik_id), RouterOSClient(mikrotik) as api:
+            # Получаем текущий пир
+            peer_data = await api.get(f"/interface/wireguard/peers/{peer_id}")
+            
+            # Устанавливаем disabled в true
+            update_data = {"disabled": "true"}
+            
+            # Обновляем пир
+            await api.patch(f"/interface/wireguard/peers/{peer_id}", update_data)
+        snapshot_cache.invalidate(mikrotik_id, WG_PEERS)
         
         return f"✅ Пир {peer_data.get('name', 'Неизвестный')} успешно отключен."
-    except requests.RequestException as e:
+    except RouterOSError as e:
         return f"❌ Ошибка отключения пира: {e}"
 
-def add_wireguard_peer(peer_name, mikrotik_id):
-    """Добавляет новый пир WireGuard"""
+async def disable_wireguard_peers_bulk(peer_ids, mikrotik_id, concurrency=BULK_CONCURRENCY):
+    """
+    Отключает несколько пиров WireGuard по ID
+
+    Имена пиров определяются по одной выборке таблицы пиров, пиры
+    отключаются параллельно (не больше concurrency запросов одновременно).
+    
+    Returns:
+        Словарь с полями done (имена), missing (не найденные ID)
+        и failed (пары (имя, ошибка)) или строка с ошибкой
+    """
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
     
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
+    try:
+        async with mutation_lock(mikrotik_id), RouterOSClient(mikrotik) as api:
+            peers = await api.find("/interface/wireguard/peers", {}, proplist=[".id", "name"])
+            name_by_id = {peer.get(".id"): peer.get("name", "Неизвестный") for peer in peers}
+            
+            to_process = [peer_id for peer_id in dict.fromkeys(peer_ids) if peer_id in name_by_id]
+            missing = [peer_id for peer_id in dict.fromkeys(peer_ids) if peer_id not in name_by_id]
+            
+            async def disable(peer_id):
+                await api.patch(f"/interface/wireguard/peers/{peer_id}", {"disabled": "true"})
+            
+            done, failed = await run_bounded(to_process, disable, concurrency)
+        snapshot_cache.invalidate(mikrotik_id, WG_PEERS)
+        
+        return {
+            "success": True,
+            "done": [name_by_id[peer_id] for peer_id in done],
+            "missing": missing,
+            "failed": [(name_by_id[peer_id], error) for peer_id, error in failed]
+        }
+    except RouterOSError as e:
+        return f"❌ Ошибка отключения пиров: {e}"
+
+async def add_wireguard_peer(peer_name, mikrotik_id):
+    """Добавляет новый пир WireGuard"""
+    # Получаем данные микротика
+    mikrotik = get_mikrotik_by_id(mikrotik_id)
+    if not mikrotik:
+        return f"⚠️ Микротик не найден."
     WG_INTERFACE_NAME = mikrotik["wireguard"]["interface_name"]
     WG_ENDPOINT = mikrotik["wireguard"]["endpoint"]
     WG_ALLOWED_IPS = ", ".join(mikrotik["wireguard"]["allowed_ips"])
     
     try:
-        # Проверяем, существует ли пир с таким именем
-        peers = get_wireguard_peers(mikrotik_id)
-        if isinstance(peers, str):
-            return peers
-        
-        if any(p.get('name') == peer_name for p in peers):
-            return f"⚠️ Пир с именем {peer_name} уже существует."
-        
         # Генерируем ключи клиента
-        private_key_obj = x25519.X25519PrivateKey.generate()
-        private_key_bytes = private_key_obj.private_bytes(
-            encoding=serialization.Encoding.Raw,
-            format=serialization.PrivateFormat.Raw,
-            encryption_algorithm=serialization.NoEncryption()
-        )
-        public_key_bytes = private_key_obj.public_key().public_bytes(
-            encoding=serialization.Encoding.Raw,
-            format=serialization.PublicFormat.Raw
-        )
-        private_key = base64.b64encode(private_key_bytes).decode('ascii')
-        public_key = base64.b64encode(public_key_bytes).decode('ascii')
-        
-        # Получаем публичный ключ интерфейса сервера
-        interface_response = requests.get(
-            f"{BASE_URL}/interface/wireguard/{WG_INTERFACE_NAME}", 
-            auth=AUTH, 
-            verify=False,
-            timeout=5
-        )
-        interface_response.raise_for_status()
-        interface_data = interface_response.json()
-        server_pubkey = interface_data.get("public-key")
-        if not server_pubkey:
-            return "❌ Публичный ключ интерфейса не найден"
-        
-        # Определяем подсеть и следующий свободный IP
-        subnet_prefix = None
-        max_ip_last_octet = 0
-        
-        for peer in peers:
-            allowed_address = peer.get("allowed-address", "")
-            match = re.match(r"^(\d+\.\d+\.\d+)\.(\d+)/32", allowed_address)
-            if match:
-                prefix = match.group(1)
-                octet = int(match.group(2))
-                if subnet_prefix is None:
-                    subnet_prefix = prefix
-                if prefix == subnet_prefix:
-                    max_ip_last_octet = max(max_ip_last_octet, octet)
-        
-        if subnet_prefix is None:
-            return "❌ Не удалось определить подсеть из существующих пиров"
-        
-        next_ip_last_octet = max_ip_last_octet + 1
-        next_ip = f"{subnet_prefix}.{next_ip_last_octet}/32"
-        ip_short = f"{subnet_prefix}.{next_ip_last_octet}"
-        dns = f"{subnet_prefix}.1"
-        
-        # Формируем данные нового пира
-        new_peer = {
-            "interface": WG_INTERFACE_NAME,
-            "name": peer_name,
-            "public-key": public_key,
-            "private-key": private_key,
-            "allowed-address": next_ip,
-            "disabled": "false",
-            "comment": f"Added by VPN Bot"
-        }
-        
-        # Отправляем запрос на создание пира
-        response = requests.put(
-            f"{BASE_URL}/interface/wireguard/peers", 
-            auth=AUTH, 
-            verify=False,
-            json=new_peer,
-            timeout=5
-        )
-        response.raise_for_status()
-        
-        # Генерируем .conf-файл с ключом сервера
-        conf_text = f"""[Interface]
-ListenPort = 51820
-PrivateKey = {private_key}
-Address = {next_ip}
-DNS = {dns}
-
-[Peer]
-PublicKey = {server_pubkey}
-AllowedIPs = {WG_ALLOWED_IPS}
-Endpoint = {WG_ENDPOINT}
-PersistentKeepalive = 20
-"""
-        
-        # Создаем временный файл для конфигурации
-        fd, temp_path = tempfile.mkstemp(suffix='.conf')
-        with os.fdopen(fd, 'w') as temp_file:
-            temp_file.write(conf_text)
-        
-        # Генерируем QR-код
-        qr_img = qrcode.make(conf_text)
-        qr_io = BytesIO()
-        qr_img.save(qr_io, format='PNG')
-        qr_io.seek(0)
-        
-        # Создаем временный файл для QR-кода
-        qr_fd, qr_temp_path = tempfile.mkstemp(suffix='.png')
-        with os.fdopen(qr_fd, 'wb') as qr_temp_file:
-            qr_temp_file.write(qr_io.getvalue())
+        private_key, public_key = generate_wireguard_keypair()
+        
+        # Проверка имени, выбор адреса и создание пира идут под блокировкой
+        # микротика, чтобы одновременные запросы не получили одно имя или адрес
+        async with mutation_lock(mikrotik_id):
+            # Проверяем, существует ли пир с таким именем (нужен актуальный список)
+            peers = await get_wireguard_peers(mikrotik_id, fresh=True)
+            if isinstance(peers, str):
+                return peers
+            
+            if any(p.get('name') == peer_name for p in peers):
+                return f"⚠️ Пир с именем {peer_name} уже существует."
+            
+            # Получаем публичный ключ интерфейса сервера (из кэша)
+            interface_data = await get_wireguard_interface(mikrotik, WG_INTERFACE_NAME)
+            server_pubkey = interface_data.get("public-key")
+            if not server_pubkey:
+                return "❌ Публичный ключ интерфейса не найден"
+            
+            async with RouterOSClient(mikrotik) as api:
+                # Пул адресов подсети интерфейса, синхронизированный с таблицей пиров
+                pool = await get_address_pool(api, WG_INTERFACE_NAME, peers)
+            if pool is None:
+                return "❌ Не удалось определить подсеть интерфейса WireGuard"
+            
+            # Выдаем свободный адрес (в том числе освободившийся после удаления пира)
+            address = pool.allocate()
+            next_ip = pool.format(address)
+            dns = pool.dns
+            
+            # Формируем данные нового пира
+            new_peer = {
+                "interface": WG_INTERFACE_NAME,
+                "name": peer_name,
+                "public-key": public_key,
+                "private-key": private_key,
+                "allowed-address": next_ip,
+                "disabled": "false",
+                "comment": f"Added by VPN Bot"
+            }
+            
+            # Отправляем запрос на создание пира
+            try:
+                async with RouterOSClient(mikrotik) as api:
+                    await api.put("/interface/wireguard/peers", new_peer)
+            except BaseException:
+                # Пир не создан - адрес можно выдать снова
+                pool.release(address)
+                raise
+            pool.commit(address)
+            snapshot_cache.invalidate(mikrotik_id, WG_PEERS)
+        
+        # Генерируем .conf-файл и QR-код в пуле, не блокируя цикл событий
+        conf_text, qr_png = await render_pool.run(render_wireguard_files, {
+            "private_key": private_key,
+            "address": next_ip,
+            "dns": dns,
+            "server_pubkey": server_pubkey,
+            "allowed_ips": WG_ALLOWED_IPS,
+            "endpoint": WG_ENDPOINT
+        })
         
         return {
             "success": True,
             "name": peer_name,
-            "conf_file": temp_path,
+            "conf_data": conf_text.encode('utf-8'),
             "conf_filename": f"{peer_name}.conf",
-            "qr_file": qr_temp_path,
+            "qr_data": qr_png,
             "qr_filename": f"{peer_name}.png",
             "message": f"✅ WireGuard пир {peer_name} успешно создан."
         }
         
-    except requests.RequestException as e:
+    except RouterOSError as e:
         error_msg = f"❌ Ошибка создания пира WireGuard: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-            error_msg += f"\nДетали: {e.response.text}"
+        if e.text:
+            error_msg += f"\nДетали: {e.text}"
         return error_msg
+    except AddressPoolExhausted as e:
+        return f"❌ {e}"
     except Exception as e:
         return f"❌ Ошибка: {str(e)}"
 
-def regenerate_wireguard_config(peer_id, mikrotik_id):
+async def regenerate_wireguard_config(peer_id, mikrotik_id):
     """Регенерирует конфигурацию для существующего пира WireGuard"""
     # Получаем данные микротика
     mikrotik = get_mikrotik_by_id(mikrotik_id)
     if not mikrotik:
         return f"⚠️ Микротик не найден."
-    
-    BASE_URL = f"{mikrotik['host']}/rest"
-    AUTH = (mikrotik["username"], mikrotik["password"])
     WG_INTERFACE_NAME = mikrotik["wireguard"]["interface_name"]
     WG_ENDPOINT = mikrotik["wireguard"]["endpoint"]
     WG_ALLOWED_IPS = ", ".join(mikrotik["wireguard"]["allowed_ips"])
     
     try:
-        # Получаем текущий пир
-        response = requests.get(f"{BASE_URL}/interface/wireguard/peers/{peer_id}", auth=AUTH, verify=False, timeout=5)
-        response.raise_for_status()
-        peer_data = response.json()
-        
-        # Получаем необходимые данные
-        name = peer_data.get("name", "unknown")
-        private_key = peer_data.get("private-key")
-        allowed_address = peer_data.get("allowed-address", "")
-        
-        if not private_key:
-            return f"❌ Приватный ключ для пира {name} не найден."
-        
-        # Получаем публичный ключ интерфейса сервера
-        interface_response = requests.get(
-            f"{BASE_URL}/interface/wireguard/{WG_INTERFACE_NAME}", 
-            auth=AUTH, 
-            verify=False,
-            timeout=5
-        )
-        interface_response.raise_for_status()
-        interface_data = interface_response.json()
+        async with RouterOSClient(mikrotik) as api:
+            # Получаем текущий пир
+            peer_data = await api.get(f"/interface/wireguard/peers/{peer_id}")
+            
+            # Получаем необходимые данные
+            name = peer_data.get("name", "unknown")
+            private_key = peer_data.get("private-key")
+            allowed_address = peer_data.get("allowed-address", "")
+            
+            if not private_key:
+                return f"❌ Приватный ключ для пира {name} не найден."
+            
+            # Подсеть интерфейса нужна, чтобы определить DNS
+            pool = await get_address_pool(api, WG_INTERFACE_NAME)
+        
+        # Получаем публичный ключ интерфейса сервера (из кэша)
+        interface_data = await get_wireguard_interface(mikrotik, WG_INTERFACE_NAME)
         server_pubkey = interface_data.get("public-key")
         
         if not server_pubkey:
             return "❌ Публичный ключ интерфейса не найден"
         
         # Определяем DNS из подсети пира
-        match = re.match(r"^(\d+\.\d+\.\d+)\.(\d+)/32", allowed_address)
-        if not match:
+        dns = peer_dns(allowed_address, pool)
+        if not dns:
             return f"❌ Не удалось определить подсеть из allowed-address: {allowed_address}"
         
-        subnet_prefix = match.group(1)
-        dns = f"{subnet_prefix}.1"
-        
-        # Генерируем .conf-файл с ключом сервера
-        conf_text = f"""[Interface]
-ListenPort = 51820
-PrivateKey = {private_key}
-Address = {allowed_address}
-DNS = {dns}
-
-[Peer]
-PublicKey = {server_pubkey}
-AllowedIPs = {WG_ALLOWED_IPS}
-Endpoint = {WG_ENDPOINT}
-PersistentKeepalive = 20
-"""
-        
-        # Создаем временный файл для конфигурации
-        fd, temp_path = tempfile.mkstemp(suffix='.conf')
-        with os.fdopen(fd, 'w') as temp_file:
-            temp_file.write(conf_text)
-        
-        # Генерируем QR-код
-        qr_img = qrcode.make(conf_text)
-        qr_io = BytesIO()
-        qr_img.save(qr_io, format='PNG')
-        qr_io.seek(0)
-        
-        # Создаем временный файл для QR-кода
-        qr_fd, qr_temp_path = tempfile.mkstemp(suffix='.png')
-        with os.fdopen(qr_fd, 'wb') as qr_temp_file:
-            qr_temp_file.write(qr_io.getvalue())
+        # Генерируем .conf-файл и QR-код в пуле, не блокируя цикл событий
+        conf_text, qr_png = await render_pool.run(render_wireguard_files, {
+            "private_key": private_key,
+            "address": allowed_address,
+            "dns": dns,
+            "server_pubkey": server_pubkey,
+            "allowed_ips": WG_ALLOWED_IPS,
+            "endpoint": WG_ENDPOINT
+        })
         
         return {
             "success": True,
             "name": name,
-            "conf_file": temp_path,
+            "conf_data": conf_text.encode('utf-8'),
             "conf_filename": f"{name}.conf",
-            "qr_file": qr_temp_path,
+            "qr_data": qr_png,
             "qr_filename": f"{name}.png",
             "message": f"✅ Конфигурация WireGuard для пира {name} успешно создана."
         }
         
-    except requests.RequestException as e:
+    except RouterOSError as e:
         error_msg = f"❌ Ошибка генерации конфигурации: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-            error_msg += f"\nДетали: {e.response.text}"
+        if e.text:
+            error_msg += f"\nДетали: {e.text}"
+        return error_msg
+    except Exception as e:
+        return f"❌ Ошибка: {str(e)}"
+
+async def add_wireguard_peers_bulk(peer_names, mikrotik_id, concurrency=BULK_CONCURRENCY):
+    """
+    Создает несколько пиров WireGuard за одну операцию
+
+    Интерфейс и таблица пиров загружаются один раз, адреса выдаются
+    за один проход, ключи генерируются в пуле рендеринга, а пиры
+    создаются параллельно (не больше concurrency запросов одновременно)
+    под одной блокировкой изменений микротика.
+    
+    Returns:
+        Словарь с полями created (список словарей с файлами, как у
+        add_wireguard_peer), skipped и failed (списки пар (имя, причина))
+        или строка с ошибкой. Если пир создан, но его файлы сформировать
+        не удалось, он остается в created с полем render_error вместо файлов
+    """
+    # Получаем данные микротика
+    mikrotik = get_mikrotik_by_id(mikrotik_id)
+    if not mikrotik:
+        return f"⚠️ Микротик не найден."
+    WG_INTERFACE_NAME = mikrotik["wireguard"]["interface_name"]
+    WG_ENDPOINT = mikrotik["wireguard"]["endpoint"]
+    WG_ALLOWED_IPS = ", ".join(mikrotik["wireguard"]["allowed_ips"])
+    
+    try:
+        async with mutation_lock(mikrotik_id):
+            # Один актуальный список пиров на всю операцию
+            peers = await get_wireguard_peers(mikrotik_id, fresh=True)
+            if isinstance(peers, str):
+                return peers
+            
+            existing = {p.get('name') for p in peers}
+            skipped = []
+            to_create = []
+            for name in dict.fromkeys(peer_names):
+                if name in existing:
+                    skipped.append((name, "уже существует"))
+                else:
+                    to_create.append(name)
+            
+            if not to_create:
+                return {"success": True, "created": [], "skipped": skipped, "failed": []}
+            
+            # Ключи для всех пиров генерируются одним заданием в пуле
+            keypairs = await render_pool.run(generate_wireguard_keypairs, len(to_create))
+            
+            # Получаем публичный ключ интерфейса сервера (из кэша)
+            interface_data = await get_wireguard_interface(mikrotik, WG_INTERFACE_NAME)
+            server_pubkey = interface_data.get("public-key")
+            if not server_pubkey:
+                return "❌ Публичный ключ интерфейса не найден"
+            
+            async with RouterOSClient(mikrotik) as api:
+                pool = await get_address_pool(api, WG_INTERFACE_NAME, peers)
+                if pool is None:
+                    return "❌ Не удалось определить подсеть интерфейса WireGuard"
+                
+                # Выдаем адреса всем пирам за один проход
+                failed = []
+                planned = []
+                for name, (private_key, public_key) in zip(to_create, keypairs):
+                    try:
+                        address = pool.allocate()
+                    except AddressPoolExhausted:
+                        failed.append((name, "нет свободных адресов"))
+                        continue
+                    planned.append((address, {
+                        "interface": WG_INTERFACE_NAME,
+                        "name": name,
+                        "public-key": public_key,
+                        "private-key": private_key,
+                        "allowed-address": pool.format(address),
+                        "disabled": "false",
+                        "comment": f"Added by VPN Bot"
+                    }))
+                
+                async def create_peer(item):
+                    address, new_peer = item
+                    try:
+                        await api.put("/interface/wireguard/peers", new_peer)
+                    except BaseException:
+                        # Пир не создан - адрес можно выдать снова
+                        pool.release(address)
+                        raise
+                    pool.commit(address)
+                
+                done, errors = await run_bounded(planned, create_peer, concurrency)
+            
+            if planned:
+                snapshot_cache.invalidate(mikrotik_id, WG_PEERS)
+        
+        failed.extend((new_peer["name"], error) for (address, new_peer), error in errors)
+        new_peers = [new_peer for address, new_peer in done]
+        
+        # Генерируем .conf-файлы и QR-коды в пуле, не блокируя цикл событий.
+        # Пиры уже созданы на микротике, поэтому ошибка одного рендеринга не отменяет результат
+        rendered = await asyncio.gather(*(
+            render_pool.run(render_wireguard_files, {
+                "private_key": new_peer["private-key"],
+                "address": new_peer["allowed-address"],
+                "dns": pool.dns,
+                "server_pubkey": server_pubkey,
+                "allowed_ips": WG_ALLOWED_IPS,
+                "endpoint": WG_ENDPOINT
+            })
+            for new_peer in new_peers
+        ), return_exceptions=True)
+        
+        created = []
+        for new_peer, result in zip(new_peers, rendered):
+            if isinstance(result, BaseException):
+                created.append({"name": new_peer["name"], "render_error": str(result) or type(result).__name__})
+                continue
+            conf_text, qr_png = result
+            created.append({
+                "name": new_peer["name"],
+                "conf_data": conf_text.encode('utf-8'),
+                "conf_filename": f"{new_peer['name']}.conf",
+                "qr_data": qr_png,
+                "qr_filename": f"{new_peer['name']}.png"
+            })
+        
+        return {
+            "success": True,
+            "created": created,
+            "skipped": skipped,
+            "failed": failed
+        }
+        
+    except RouterOSError as e:
+        error_msg = f"❌ Ошибка создания пиров WireGuard: {e}"
+        if e.text:
+            error_msg += f"\nДетали: {e.text}"
         return error_msg
     except Exception as e:
-        return f"❌ Ошибка: {str(e)}"
\ No newline at end of file
+        return f"❌ Ошибка: {str(e)}"
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("vpn_bot")
+
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class WriteBehindBuffer:
+    """
+    Буфер отложенной записи.
+
+    put() только запоминает значение (повторные записи одного ключа
+    схлопываются), а сохранение выполняется пачкой в отдельном потоке:
+    раз в flush_interval секунд или сразу, когда в буфере набралось
+    max_pending ключей. В последнем случае put() ждет окончания записи,
+    поэтому буфер не растет неограниченно.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[Dict[str, Any]], None],
+        max_pending: int = DEFAULT_MAX_PENDING,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        description: str = "записей"
+    ):
+        self.writer = writer
+        self.description = description
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.flushes = 0
+        self.flushed = 0
+        self.errors = 0
+        self._pending: Dict[str, Any] = {}
+        # Пачка, которая сейчас записывается в отдельном потоке
+        self._flushing: Dict[str, Any] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def get(self, key: str) -> Any:
+        """Значение, еще не записанное на диск (None, если его нет в буфере)"""
+        if key in self._pending:
+            return self._pending[key]
+        return self._flushing.get(key)
+
+    async def put(self, key: str, value: Any) -> None:
+        self._pending[key] = value
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Сохраняет все накопленные записи"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                await asyncio.to_thread(self.writer, batch)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка записи {self.description} ({len(batch)} шт.): {e}")
+                # Возвращаем несохраненные записи, не затирая более новые
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                return
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            self.flushed += len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и сохраняет остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "errors": self.errors
+        }